@@ -3,7 +3,9 @@
 
 import os
 import sys
+import shutil
 import subprocess
+import tempfile
 from pathlib import Path
 
 def test_imports():
@@ -195,6 +197,1725 @@ def test_output_structure():
         print(f"✗ 失败: {e}")
         return False
 
+def test_batch_mode():
+    """测试目录批处理模式 / Test directory batch mode"""
+    print("测试 7: 批处理模式...", end=" ")
+    workdir = tempfile.mkdtemp()
+    try:
+        input_dir = Path(workdir) / "transcripts"
+        output_dir = Path(workdir) / "docs"
+        (input_dir / "nested").mkdir(parents=True)
+        shutil.copy("sample_transcript.txt", input_dir / "talk_a.txt")
+        shutil.copy("sample_transcript.txt", input_dir / "nested" / "talk_b.txt")
+        
+        result = subprocess.run(
+            ["python3", "ted_cli.py", "--input-dir", str(input_dir), "--output-dir", str(output_dir)],
+            capture_output=True,
+            text=True,
+            timeout=30
+        )
+        
+        outputs = sorted(p.name for p in output_dir.glob("*.md"))
+        if result.returncode != 0 or outputs != ["talk_a.md", "talk_b.md"]:
+            print(f"✗ 失败 (输出: {outputs})")
+            return False
+        if "Throughput:" not in result.stdout:
+            print("✗ 失败 (缺少吞吐量报告)")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_parallel_batch_mode():
+    """测试多进程批处理 / Test process-pool batch mode"""
+    print("测试 8: 多进程批处理...", end=" ")
+    workdir = tempfile.mkdtemp()
+    try:
+        input_dir = Path(workdir) / "transcripts"
+        output_dir = Path(workdir) / "docs"
+        input_dir.mkdir()
+        names = [f"talk_{i:02d}" for i in range(6)]
+        for name in names:
+            shutil.copy("sample_transcript.txt", input_dir / f"{name}.txt")
+        
+        result = subprocess.run(
+            ["python3", "ted_cli.py", "--input-dir", str(input_dir),
+             "--output-dir", str(output_dir), "--workers", "2"],
+            capture_output=True,
+            text=True,
+            timeout=60
+        )
+        
+        # 结果按输入顺序报告 / Results are reported in input order
+        reported = [line.split(" -> ")[0].rsplit("/", 1)[-1]
+                    for line in result.stdout.splitlines() if " -> " in line and "✓" in line]
+        if result.returncode != 0 or reported != [f"{name}.txt" for name in names]:
+            print(f"✗ 失败 (顺序: {reported})")
+            return False
+        
+        sizes = {p.stat().st_size for p in output_dir.glob("*.md")}
+        if len(list(output_dir.glob("*.md"))) != len(names) or min(sizes) < 1000:
+            print("✗ 失败 (输出不完整)")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_incremental_cache():
+    """测试增量构建缓存 / Test incremental build cache"""
+    print("测试 9: 增量构建缓存...", end=" ")
+    workdir = tempfile.mkdtemp()
+    try:
+        input_dir = Path(workdir) / "transcripts"
+        output_dir = Path(workdir) / "docs"
+        input_dir.mkdir()
+        for name in ("kept", "edited", "removed"):
+            shutil.copy("sample_transcript.txt", input_dir / f"{name}.txt")
+        
+        command = ["python3", "ted_cli.py", "--input-dir", str(input_dir), "--output-dir", str(output_dir)]
+        first = subprocess.run(command, capture_output=True, text=True, timeout=30)
+        
+        with open(input_dir / "edited.txt", "a") as f:
+            f.write("\nOne more sentence changes the content hash.\n")
+        os.remove(input_dir / "removed.txt")
+        second = subprocess.run(command, capture_output=True, text=True, timeout=30)
+        
+        if first.returncode != 0 or "Cache: 0 hits, 3 misses" not in first.stdout:
+            print("✗ 失败 (首次构建)")
+            return False
+        if second.returncode != 0 or "Cache: 1 hits, 1 misses, 1 stale outputs pruned" not in second.stdout:
+            print("✗ 失败 (增量构建)")
+            return False
+        if (output_dir / "removed.md").exists():
+            print("✗ 失败 (过期输出未清理)")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_subtitle_cues():
+    """测试字幕解析与时间戳 / Test subtitle cue parsing and timestamps"""
+    print("测试 10: 字幕时间戳...", end=" ")
+    try:
+        from io import StringIO
+        from ted_subtitles import iter_cues, Cue
+        from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+        
+        srt = (
+            "1\n00:00:01,000 --> 00:00:04,000\nInnovation is the key to progress.\n\n"
+            "2\n00:02:15,500 --> 00:02:19,000\nWe need [Applause] sustainable solutions.\n"
+        )
+        vtt = (
+            "WEBVTT\n\nNOTE header comment\n\n"
+            "intro\n01:00:01.250 --> 01:00:03.000 align:start\n<c>Hello</c> world\n"
+        )
+        
+        cues = list(iter_cues(StringIO(srt))) + list(iter_cues(StringIO(vtt)))
+        expected = [
+            Cue(1, 1000, 4000, "Innovation is the key to progress."),
+            Cue(2, 135500, 139000, "We need [Applause] sustainable solutions."),
+            Cue(1, 3601250, 3603000, "Hello world"),
+        ]
+        if cues != expected:
+            print(f"✗ 失败 (解析: {cues})")
+            return False
+        
+        # "sustainable" is beyond a 3000-word learner's vocabulary, so it gets extracted
+        profile = LearnerProfile("B1", 3000, ["listening"], "bilingual", "srt", "complete")
+        processor = TEDTranscriptProcessor(profile)
+        clean = processor.clean_transcript(srt)
+        segments = processor.segment_by_meaning(clean, with_timestamps=True)
+        vocabulary = {v.word: v for v in processor.extract_vocabulary(clean)}
+        
+        if "-->" in clean or "[Applause]" in clean:
+            print("✗ 失败 (清理)")
+            return False
+        if segments != [("Innovation is the key to progress", "00:00:01"),
+                        ("We need sustainable solutions", "00:02:15")]:
+            print(f"✗ 失败 (分段: {segments})")
+            return False
+        if vocabulary["sustainable"].timestamp != "00:02:15":
+            print("✗ 失败 (词汇时间戳)")
+            return False
+        
+        # 时间戳变化使缓存失效 / Shifted timestamps invalidate the build cache
+        from ted_batch import BuildCache, run_batch
+        workdir = Path(tempfile.mkdtemp(prefix="ted_cues_"))
+        try:
+            source = workdir / "talk.srt"
+            source.write_text(srt, encoding="utf-8")
+            def cached(text):
+                source.write_text(text, encoding="utf-8")
+                cache = BuildCache(str(workdir / "out"))
+                result = run_batch([source], str(workdir / "out"), profile, cache=cache)[0]
+                cache.save()
+                return result.cached
+            cached(srt)
+            shifted = srt.replace("00:02:15,500", "00:03:15,500")
+            if not cached(srt) or cached(shifted) or "00:03:15" not in (workdir / "out" / "talk.md").read_text():
+                print("✗ 失败 (时间戳未进入缓存键)")
+                return False
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+
+def test_shared_tokenizer():
+    """测试共享分词结果 / Test the shared single-pass tokenizer"""
+    print("测试 11: 共享分词...", end=" ")
+    try:
+        from ted_tokenizer import tokenize
+        from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+        
+        text = "Innovation matters!  We must act now,\nand think again? Yes."
+        tokens = tokenize(text)
+        if tokens.sentences != ["Innovation matters", "We must act now,\nand think again", "Yes"]:
+            print(f"✗ 失败 (句子: {tokens.sentences})")
+            return False
+        if list(tokens.sentence_token_counts) != [2, 7, 1] or tokens.tokens[:2] != ["innovation", "matters"]:
+            print("✗ 失败 (词元)")
+            return False
+        if [text[i:i + len(s)] for i, s in zip(tokens.sentence_starts, tokens.sentences)] != tokens.sentences:
+            print("✗ 失败 (偏移)")
+            return False
+        if [text[i:].split()[0] for i in tokens.token_starts][:3] != ["Innovation", "matters!", "We"]:
+            print("✗ 失败 (词元偏移)")
+            return False
+        
+        # 各分析阶段复用同一次分词 / All analysis stages reuse one tokenization
+        profile = LearnerProfile("B2", 8000, ["listening"], "bilingual", "plain_text", "complete")
+        processor = TEDTranscriptProcessor(profile)
+        processor.segment_by_meaning(text)
+        shared = processor._tokens
+        processor.calculate_difficulty(text)
+        processor.estimate_duration(text)
+        if processor._tokens is not shared or processor.estimate_duration(text) != 10 / 150:
+            print("✗ 失败 (未复用)")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+
+def test_frequency_vocabulary():
+    """测试基于词频的词汇提取 / Test frequency-based vocabulary extraction"""
+    print("测试 12: 词频词汇提取...", end=" ")
+    try:
+        from ted_frequency import load_frequency_index, STOPWORDS
+        from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+        
+        frequency = load_frequency_index()
+        if frequency.lemma_rank("challenges")[0] != "challenge" or frequency.rank("the") != 1:
+            print("✗ 失败 (词频索引)")
+            return False
+        
+        # 映射的索引查找后可以关闭 / A mapped index closes cleanly after lookups
+        from ted_frequency import FREQUENCY_INDEX
+        from ted_index import SortedStringIndex
+        index = SortedStringIndex.open(FREQUENCY_INDEX)
+        if index.get("challenge") is None:
+            print("✗ 失败 (索引查找)")
+            return False
+        index.close()
+        
+        with open("sample_transcript.txt", "r") as f:
+            transcript = f.read()
+        
+        selected = {}
+        for vocab_size in (3000, 12000):
+            profile = LearnerProfile("B2", vocab_size, ["vocabulary"], "bilingual", "plain_text", "complete")
+            processor = TEDTranscriptProcessor(profile)
+            items = processor.extract_vocabulary(processor.clean_transcript(transcript), count=15)
+            selected[vocab_size] = [item.word for item in items]
+            
+            for item in items:
+                rank = frequency.rank(item.word)
+                if item.word in STOPWORDS or (rank is not None and rank <= vocab_size // 2):
+                    print(f"✗ 失败 (过于常见: {item.word})")
+                    return False
+                # 原句来自演讲本身 / The original sentence comes from the talk itself
+                if item.original_sentence not in transcript or item.word[:4] not in item.original_sentence.lower():
+                    print(f"✗ 失败 (原句不含 {item.word})")
+                    return False
+        
+        if not selected[3000] or selected[3000] == selected[12000]:
+            print("✗ 失败 (词汇量未影响选词)")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+
+def test_phrase_mining():
+    """测试 n-gram 短语挖掘 / Test n-gram phrase mining"""
+    print("测试 13: 短语挖掘...", end=" ")
+    try:
+        from ted_phrases import PhraseMiner
+        from ted_frequency import load_frequency_index
+        from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+        
+        talk = (
+            "Climate change is real. In other words, we cannot wait. "
+            "We must cut greenhouse gas emissions now. Greenhouse gas emissions keep rising, "
+            "and climate change is getting worse. At the same time, we can make a difference. "
+            "Each of us can make a difference. At the same time, the carbon footprint of a flight "
+            "is huge, so greenhouse gas emissions matter."
+        )
+        profile = LearnerProfile("B2", 6000, ["vocabulary"], "bilingual", "plain_text", "complete")
+        processor = TEDTranscriptProcessor(profile)
+        phrases = processor.extract_phrases(processor.clean_transcript(talk), count=10)
+        expressions = [p.expression for p in phrases]
+        
+        # 短语库短语优先 / Phrasebook phrases used by the talk come first
+        if expressions[0] != "in other words" or "on the other hand" in expressions:
+            print(f"✗ 失败 (短语库: {expressions})")
+            return False
+        for expected in ("greenhouse gas emissions", "climate change", "at the same time", "make a difference"):
+            if expected not in expressions:
+                print(f"✗ 失败 (缺少 {expected}: {expressions})")
+                return False
+        # 只在更长短语中出现的片段不单列 / Fragments of a longer phrase are not listed
+        if "greenhouse gas" in expressions or "gas emissions" in expressions:
+            print(f"✗ 失败 (重复片段: {expressions})")
+            return False
+        for phrase in phrases:
+            if phrase.expression not in phrase.original_excerpt.lower() or phrase.original_excerpt not in talk:
+                print(f"✗ 失败 (原文摘录: {phrase.expression})")
+                return False
+        
+        # 没有重复短语的短讲稿退回短语库 / A short talk with nothing repeated falls back to the phrasebook
+        short = processor.extract_phrases(processor.clean_transcript("Thank you all for coming here today."))
+        if [p.expression for p in short] != ["in other words", "on the other hand"] or \
+                any(p.original_excerpt for p in short):
+            print(f"✗ 失败 (短讲稿: {[p.expression for p in short]})")
+            return False
+        
+        # 跨文档累计计数 / Counts accumulate across documents (library mining)
+        miner = PhraseMiner()
+        miner.add_document([["renewable", "energy", "is", "cheap."]])
+        miner.add_document([["we", "need", "renewable", "energy,", "now."]])
+        mined = miner.top(5, background=load_frequency_index())
+        if [(m.text, m.count) for m in mined] != [("renewable energy", 2)]:
+            print(f"✗ 失败 (跨文档: {mined})")
+            return False
+        
+        # 词表超出键位宽时自动加宽，计数不串 / Keys widen instead of colliding when the vocabulary outgrows them
+        narrow = PhraseMiner()
+        narrow._base = 4
+        narrow.add_document([["renewable", "energy", "is", "cheap."]])
+        narrow.add_document([["we", "need", "renewable", "energy,", "now."]])
+        if narrow._base <= 4 or [(m.text, m.count) for m in narrow.top(5, background=load_frequency_index())] \
+                != [("renewable energy", 2)]:
+            print("✗ 失败 (键位宽)")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+
+def test_section_selection():
+    """测试按需生成章节 / Test lazy, section-selective rendering"""
+    print("测试 14: 按需生成章节...", end=" ")
+    try:
+        from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile, select_sections
+        
+        with open("sample_transcript.txt", "r") as f:
+            transcript = f.read()
+        
+        profile = LearnerProfile("B2", 8000, ["listening"], "bilingual", "plain_text", "simplified")
+        if select_sections(profile) != ["parameters", "overview", "vocabulary", "listening", "shadowing"]:
+            print(f"✗ 失败 (simplified: {select_sections(profile)})")
+            return False
+        
+        # 只计算所选章节，共享的词汇只提取一次 / Only selected stages run; shared vocabulary runs once
+        profile.sections = ["vocabulary", "review"]
+        processor = TEDTranscriptProcessor(profile)
+        calls = []
+        for name in ("extract_vocabulary", "extract_phrases", "generate_listening_exercises",
+                     "generate_shadowing_script", "generate_review_kit"):
+            original = getattr(processor, name)
+            setattr(processor, name, lambda *a, _n=name, _f=original, **k: calls.append(_n) or _f(*a, **k))
+        output = processor.generate_markdown_output(transcript)
+        
+        if sorted(calls) != ["extract_vocabulary", "generate_review_kit"]:
+            print(f"✗ 失败 (调用: {calls})")
+            return False
+        headings = [line for line in output.splitlines() if line.startswith("# ")]
+        if headings != ["# TED English Learning Package", "# 0. Parameter Echo (参数回显)",
+                        "# 2. Core Vocabulary (核心词汇表)", "# 9. Review Kit (巩固复习材料)"]:
+            print(f"✗ 失败 (章节: {headings})")
+            return False
+        
+        try:
+            select_sections(profile, ["vocabulary", "podcast"])
+            print("✗ 失败 (未知章节未报错)")
+            return False
+        except ValueError:
+            pass
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+
+def test_streaming_writer():
+    """测试流式 Markdown 输出 / Test streaming markdown writer"""
+    print("测试 15: 流式输出...", end=" ")
+    try:
+        import io
+        from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+        
+        with open("sample_transcript.txt", "r") as f:
+            transcript = f.read()
+        profile = LearnerProfile("B2", 8000, ["listening"], "bilingual", "plain_text", "complete")
+        processor = TEDTranscriptProcessor(profile)
+        
+        def without_timestamp(text):
+            return [line for line in text.splitlines() if not line.startswith("Generated:")]
+        
+        buffer = io.StringIO()
+        written = processor.write_markdown(transcript, buffer)
+        expected = processor.generate_markdown_output(transcript)
+        if written != len(buffer.getvalue()) or without_timestamp(buffer.getvalue()) != without_timestamp(expected):
+            print("✗ 失败 (流式输出与整体输出不一致)")
+            return False
+        
+        # 章节按需生成 / Sections are produced as the consumer asks for them
+        chunks = processor.iter_markdown(transcript)
+        next(chunks)
+        if len(list(chunks)) < 10:
+            print("✗ 失败 (未分块输出)")
+            return False
+        
+        # -o - 输出到 stdout，状态信息到 stderr / -o - streams to stdout, status to stderr
+        result = subprocess.run(
+            ["python3", "ted_cli.py", "-i", "sample_transcript.txt", "-o", "-"],
+            capture_output=True, text=True, timeout=30
+        )
+        if result.returncode != 0 or not result.stdout.startswith("# TED English Learning Package") \
+                or "# 9. Review Kit" not in result.stdout or "Processing transcript" not in result.stderr:
+            print("✗ 失败 (stdout 输出)")
+            return False
+        if Path("-").exists():
+            os.remove("-")
+            print("✗ 失败 (写入了名为 '-' 的文件)")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+
+def test_library_indexes():
+    """测试材料库索引 / Test material library indexes"""
+    print("测试 16: 材料库索引...", end=" ")
+    lib_file = Path("test_index_lib.json")
+    try:
+        from ted_material_library import MaterialLibrary
+        
+        if lib_file.exists():
+            lib_file.unlink()
+        lib = MaterialLibrary(str(lib_file))
+        a = lib.add_url("https://www.ted.com/talks/a_talk", "A")
+        b = lib.add_url("https://www.ted.com/talks/b_talk", "B")
+        c = lib.add_url("https://www.ted.com/talks/c_talk", "C")
+        
+        # 规范化后重复的 URL 被拒绝 / Duplicate URLs are rejected after normalization
+        try:
+            lib.add_url("http://TED.com/talks/a_talk/?language=en")
+            print("✗ 失败 (重复 URL 未被拒绝)")
+            return False
+        except ValueError:
+            pass
+        
+        # 查询参数区分不同视频 / Query parameters tell different videos apart
+        from ted_material_library import url_slug
+        v1 = lib.add_url("https://www.youtube.com/watch?v=abc123", "Video 1")
+        v2 = lib.add_url("https://www.youtube.com/watch?v=xyz789&utm_source=share", "Video 2")
+        if lib.find_by_url("https://youtu.be/xyz789?si=q") is not v2 or \
+                [url_slug(v['url']) for v in (v1, v2)] != ["watch_abc123", "watch_xyz789"]:
+            print("✗ 失败 (YouTube URL)")
+            return False
+        lib.remove_material(v1['id'])
+        lib.remove_material(v2['id'])
+        
+        # JSON 存储不索引转录，因此不读取 / JSON storage indexes no transcripts, so none is read
+        from unittest import mock
+        import ted_material_library
+        with mock.patch.object(ted_material_library, "read_transcript_text", return_value="") as read:
+            lib.mark_processed(b['id'], "b.txt", "b.md")
+        if read.called:
+            print("✗ 失败 (读取了不需要的转录)")
+            return False
+        lib.remove_material(a['id'])
+        if lib.get_material(a['id']) is not None or lib.get_material(c['id']) is not c:
+            print("✗ 失败 (按 ID 查找)")
+            return False
+        if [m['id'] for m in lib.get_unprocessed_materials()] != [c['id']]:
+            print("✗ 失败 (未处理列表)")
+            return False
+        
+        # 删除不扫描整个库 / Removal does not scan the whole library
+        import time
+        bulk = MaterialLibrary(str(lib_file.with_name("test_index_bulk.json")))
+        try:
+            added = bulk.add_urls(f"https://www.ted.com/talks/bulk_{i}" for i in range(20_000))
+            started = time.perf_counter()
+            with bulk.batch():
+                for material in added[::2]:
+                    bulk.remove_material(material['id'])
+            elapsed = time.perf_counter() - started
+            if len(bulk.get_all_materials()) != 10_000 or elapsed > 1.0 or \
+                    [m['id'] for m in bulk.get_all_materials()[:2]] != [added[1]['id'], added[3]['id']]:
+                print(f"✗ 失败 (删除 {elapsed:.2f} s)")
+                return False
+        finally:
+            bulk.close()
+            bulk.library_file.unlink(missing_ok=True)
+        
+        # 删除后可重新添加；重新加载后索引一致 / Removed URLs can be re-added; indexes survive reload
+        a2 = lib.add_url("https://ted.com/talks/a_talk", "A again")
+        reloaded = MaterialLibrary(str(lib_file))
+        if reloaded.find_by_url("https://www.ted.com/talks/a_talk")['id'] != a2['id'] \
+                or [m['id'] for m in reloaded.get_unprocessed_materials()] != [c['id'], a2['id']]:
+            print("✗ 失败 (重新加载)")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        if lib_file.exists():
+            lib_file.unlink()
+
+def test_sqlite_storage():
+    """测试 SQLite 存储后端与迁移 / Test SQLite storage backend and migration"""
+    print("测试 17: SQLite 存储...", end=" ")
+    workdir = Path(tempfile.mkdtemp(prefix="ted_sqlite_"))
+    try:
+        import json
+        from ted_material_library import MaterialLibrary
+        from ted_library_storage import migrate_json_to_sqlite
+        
+        old_format = [
+            {"id": 3, "url": "https://ted.com/talks/x", "title": "X", "description": "",
+             "date_added": "2025-01-01T00:00:00", "processed": True,
+             "transcript_file": "x.txt", "learning_package_file": "x.md", "speaker": "Ada"},
+        ]
+        (workdir / "old.json").write_text(json.dumps(old_format))
+        (workdir / "new.json").write_text(json.dumps({"materials": old_format, "next_id": 7}))
+        
+        # 两种 JSON 格式都能迁移 / Both JSON formats migrate
+        for name, expected_next_id in (("old", 4), ("new", 7)):
+            migrate_json_to_sqlite(workdir / f"{name}.json", workdir / f"{name}.db")
+            lib = MaterialLibrary(str(workdir / f"{name}.db"))
+            if lib.get_all_materials() != old_format or lib.next_id != expected_next_id:
+                print(f"✗ 失败 (迁移 {name})")
+                return False
+            lib.close()
+        try:
+            migrate_json_to_sqlite(workdir / "new.json", workdir / "new.db")
+            print("✗ 失败 (重复迁移未报错)")
+            return False
+        except ValueError:
+            pass
+        
+        # 两个进程共享同一数据库，ID 不冲突 / Two libraries on one database never reuse ids
+        first = MaterialLibrary(str(workdir / "new.db"))
+        second = MaterialLibrary(str(workdir / "new.db"))
+        a = first.add_url("https://ted.com/talks/a")
+        b = second.add_url("https://ted.com/talks/b")
+        first.mark_processed(a['id'], "a.txt", "a.md")
+        second.remove_material(3)
+        mode = first.storage.connection.execute("PRAGMA journal_mode").fetchone()[0]
+        first.close()
+        second.close()
+        
+        reopened = MaterialLibrary(str(workdir / "new.db"))
+        ids = [m['id'] for m in reopened.get_all_materials()]
+        if mode != "wal" or a['id'] == b['id'] or ids != [a['id'], b['id']] \
+                or not reopened.get_material(a['id'])['processed'] \
+                or [m['id'] for m in reopened.get_unprocessed_materials()] != [b['id']]:
+            print(f"✗ 失败 (共享数据库: {mode}, {ids})")
+            return False
+        reopened.close()
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_full_text_search():
+    """测试全文检索 (BM25) / Test full-text search with BM25"""
+    print("测试 18: 全文检索...", end=" ")
+    workdir = Path(tempfile.mkdtemp(prefix="ted_search_"))
+    try:
+        from ted_material_library import MaterialLibrary
+        
+        transcript = workdir / "ocean.srt"
+        transcript.write_text("1\n00:00:01,000 --> 00:00:03,000\nCoral reefs are bleaching.\n\n"
+                              "2\n00:00:03,500 --> 00:00:05,000\nReefs need cooler oceans.\n")
+        
+        for name in ("lib.json", "lib.db"):
+            lib = MaterialLibrary(str(workdir / name))
+            a = lib.add_url("https://ted.com/talks/a", "Why reefs matter", "Marine biology")
+            b = lib.add_url("https://ted.com/talks/b", "Climate and cities", "Urban heat")
+            c = lib.add_url("https://ted.com/talks/c", "Ocean stories", "A talk about the sea")
+            
+            # 转录文本在 mark_processed 后可检索 / Transcripts become searchable once processed
+            if lib.search_materials("bleaching"):
+                print(f"✗ 失败 ({name}: 未处理的转录已被索引)")
+                return False
+            lib.mark_processed(c['id'], str(transcript), "c.md")
+            hits = [m['id'] for m in lib.search_materials("coral reef")]
+            if hits[:2] != [a['id'], c['id']] and hits[:2] != [c['id'], a['id']] or b['id'] in hits:
+                print(f"✗ 失败 ({name}: {hits})")
+                return False
+            if [m['id'] for m in lib.search_materials("bleaching")] != [c['id']]:
+                print(f"✗ 失败 ({name}: 转录检索)")
+                return False
+            # 标题命中优先 / Title matches rank first
+            if lib.search_materials("reefs")[0]['id'] != a['id']:
+                print(f"✗ 失败 ({name}: 排序)")
+                return False
+            # 部分词回退到子串匹配 / Partial words fall back to substring matching
+            if [m['id'] for m in lib.search_materials("urba")] != [b['id']]:
+                print(f"✗ 失败 ({name}: 子串回退)")
+                return False
+            lib.remove_material(c['id'])
+            if lib.search_materials("bleaching"):
+                print(f"✗ 失败 ({name}: 删除后仍可检索)")
+                return False
+            lib.close()
+        
+        # 重新索引后的分数与新建索引一致 / Re-indexed documents score like a freshly built index
+        from ted_search import build_index
+        docs = {1: {"title": "coral reefs"}, 2: {"title": "reefs and fish"}, 3: {"title": "city heat"}}
+        churned = build_index(docs.items())
+        for _ in range(3):
+            churned.add(1, {"title": "coral reefs"})
+            churned.add(3, {"title": "coral city heat"})
+        docs[3] = {"title": "coral city heat"}
+        fresh = build_index(docs.items())
+        if churned.search("coral reefs") != fresh.search("coral reefs"):
+            print("✗ 失败 (重新索引后分数漂移)")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_library_batch_writes():
+    """测试批量写入与原子保存 / Test batched, atomic library writes"""
+    print("测试 19: 批量原子写入...", end=" ")
+    workdir = Path(tempfile.mkdtemp(prefix="ted_batch_lib_"))
+    try:
+        import json
+        from unittest import mock
+        from ted_material_library import MaterialLibrary
+        
+        for name in ("lib.json", "lib.db"):
+            path = workdir / name
+            lib = MaterialLibrary(str(path))
+            urls = [f"https://ted.com/talks/{i}" for i in range(200)]
+            with mock.patch.object(lib.storage, "apply", wraps=lib.storage.apply) as apply:
+                added = lib.add_urls(urls + ["https://www.ted.com/talks/5/"])  # 最后一个重复 / last one is a duplicate
+                with lib.batch():
+                    lib.mark_processed(added[0]['id'], None, "0.md")
+                    lib.remove_material(added[1]['id'])
+                    extra = lib.add_url("https://ted.com/talks/extra")
+                    lib.remove_material(extra['id'])
+            if len(added) != 200 or apply.call_count != 2:
+                print(f"✗ 失败 ({name}: {len(added)} 条, {apply.call_count} 次写入)")
+                return False
+            lib.close()
+            
+            reloaded = MaterialLibrary(str(path))
+            ids = [m['id'] for m in reloaded.get_all_materials()]
+            if len(ids) != 199 or added[1]['id'] in ids or extra['id'] in ids \
+                    or not reloaded.get_material(added[0]['id'])['processed']:
+                print(f"✗ 失败 ({name}: 重新加载)")
+                return False
+            reloaded.close()
+        
+        # 写入中途崩溃不会损坏原文件 / A crash mid-write leaves the old file intact
+        path = workdir / "lib.json"
+        before = path.read_text()
+        lib = MaterialLibrary(str(path))
+        with mock.patch("json.dump", side_effect=OSError("disk full")):
+            try:
+                lib.add_url("https://ted.com/talks/crash")
+            except OSError:
+                pass
+        if path.read_text() != before or [p.name for p in workdir.iterdir() if p.suffix == ".tmp"]:
+            print("✗ 失败 (非原子写入)")
+            return False
+        json.loads(before)
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_work_command():
+    """测试租约工作进程 / Test the lease-based `work` subcommand"""
+    print("测试 20: work 子命令...", end=" ")
+    workdir = Path(tempfile.mkdtemp(prefix="ted_work_"))
+    try:
+        from ted_material_library import MaterialLibrary
+        
+        db = workdir / "lib.db"
+        transcripts = workdir / "transcripts"
+        transcripts.mkdir()
+        sample = Path("sample_transcript.txt").read_text(encoding="utf-8")
+        lib = MaterialLibrary(str(db))
+        for i in range(4):
+            lib.add_url(f"https://www.ted.com/talks/talk_{i}", f"Talk {i}")
+            if i < 3:  # talk_3 没有字幕文件 / talk_3 has no transcript
+                (transcripts / f"talk_{i}.txt").write_text(sample, encoding="utf-8")
+        # 模拟崩溃的工作进程留下的过期租约 / An expired lease left by a crashed worker
+        lib.storage.claim("crashed:1", lease_seconds=-1)
+        lib.close()
+        
+        result = subprocess.run(
+            [sys.executable, "ted_cli.py", "work", "--library", str(db),
+             "--transcripts-dir", str(transcripts), "--output-dir", str(workdir / "out"),
+             "--workers", "2"],
+            capture_output=True, text=True, timeout=120
+        )
+        if result.returncode != 1 or "Throughput:" not in result.stdout \
+                or "1 waiting to retry" not in result.stdout:
+            print(f"✗ 失败: {result.stdout[-300:]} {result.stderr[-300:]}")
+            return False
+        
+        lib = MaterialLibrary(str(db))
+        processed = [m for m in lib.get_all_materials() if m['processed']]
+        attempts = dict(lib.storage.connection.execute("SELECT material_id, attempts FROM leases").fetchall())
+        lib.close()
+        if len(processed) != 3 or not all(Path(m['learning_package_file']).exists() for m in processed):
+            print(f"✗ 失败 (已处理 {len(processed)} 条)")
+            return False
+        # 已完成的租约被删除，失败的保留 / Finished leases are gone, the failed one remains
+        if attempts != {4: 1}:
+            print(f"✗ 失败 (租约 {attempts})")
+            return False
+        
+        # 两个工作进程与其他写入者共享一个库，互不覆盖 / Two workers and another writer share a library
+        from concurrent.futures import ThreadPoolExecutor
+        from unittest import mock
+        import sqlite3
+        import time
+        import ted_worker
+        from ted_learning_sop import LearnerProfile
+        
+        db2 = workdir / "shared.db"
+        lib = MaterialLibrary(str(db2))
+        for i in range(3):
+            lib.add_url(f"https://www.ted.com/talks/talk_{i}", f"Talk {i}")
+        lib.close()
+        render = ted_worker.render_file
+        def render_and_edit(source, *args):
+            # 渲染期间另一个进程改了标题 / Someone retitles the talk while it is rendered
+            other = MaterialLibrary(str(db2))
+            other.update_material(other.find_by_url(f"https://www.ted.com/talks/{source.stem}")['id'],
+                                  title=f"Edited {source.stem}")
+            other.close()
+            return render(source, *args)
+        options = ted_worker.WorkOptions(str(db2), str(transcripts), str(workdir / "out2"),
+                                         LearnerProfile("B2", 8000, ["vocabulary"], "english_only",
+                                                        "plain_text", "complete"))
+        with mock.patch.object(ted_worker, "render_file", render_and_edit), ThreadPoolExecutor(2) as pool:
+            runs = list(pool.map(lambda _: ted_worker.run_worker(options, progress=False), range(2)))
+        lib = MaterialLibrary(str(db2))
+        materials = lib.get_all_materials()
+        lib.close()
+        if sum(len(run) for run in runs) != 3 or not all(m['processed'] for m in materials) or \
+                [m['title'] for m in materials] != [f"Edited talk_{i}" for i in range(3)]:
+            print(f"✗ 失败 (并发写入 {[(m['title'], m['processed']) for m in materials]})")
+            return False
+        
+        # 租约被他人接管后，结果被丢弃 / A job whose lease was taken over drops its result
+        db3 = workdir / "lost.db"
+        lib = MaterialLibrary(str(db3))
+        lib.add_url("https://www.ted.com/talks/talk_0", "Talk 0")
+        lib.close()
+        def render_and_lose(source, *args):
+            with sqlite3.connect(str(db3)) as other:
+                other.execute("UPDATE leases SET worker = 'thief'")
+            time.sleep(0.3)
+            return render(source, *args)
+        options = ted_worker.WorkOptions(str(db3), str(transcripts), str(workdir / "out3"),
+                                         options.profile, lease_seconds=0.3, limit=1)
+        with mock.patch.object(ted_worker, "render_file", render_and_lose):
+            run = ted_worker.run_worker(options, progress=False)
+        lib = MaterialLibrary(str(db3))
+        lost = lib.get_all_materials()[0]['processed']
+        stolen = lib.storage.complete("not-the-holder", 1, "a.txt", "a.md")
+        owner = [tuple(row) for row in lib.storage.connection.execute("SELECT worker FROM leases")]
+        lib.close()
+        if [r.error for r in run] != [ted_worker.LEASE_LOST] or lost or stolen or \
+                owner != [("thief",)] or (workdir / "out3" / "talk_0.md").exists():
+            print(f"✗ 失败 (租约丢失 {[r.error for r in run]} {lost} {stolen} {owner})")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_transcript_fetcher():
+    """测试异步字幕抓取 / Test the asyncio transcript fetcher against a stub server"""
+    print("测试 21: 异步字幕抓取...", end=" ")
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    hits = {"connections": 0, "flaky": 0, "not_modified": 0}
+    
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # 保持连接 / keep-alive
+        
+        def setup(self):
+            hits["connections"] += 1
+            super().setup()
+        
+        def log_message(self, *args):
+            pass
+        
+        def _send(self, status, body=b"", headers=()):
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def do_GET(self):
+            if self.path == "/talks/plain_talk/transcript?language=en":
+                if self.headers.get("If-None-Match") == '"v1"':
+                    hits["not_modified"] += 1
+                    return self._send(304)
+                body = "<html><script>x()</script><p>Hello there.</p><p>Second line.</p></html>"
+                return self._send(200, body.encode(), [("Content-Type", "text/html; charset=utf-8"),
+                                                      ("ETag", '"v1"')])
+            if self.path == "/talks/flaky_talk/transcript?language=en":
+                hits["flaky"] += 1
+                if hits["flaky"] == 1:
+                    return self._send(503, headers=[("Retry-After", "0")])
+                return self._send(200, b"1\n00:00:01,000 --> 00:00:02,000\nHi.\n",
+                                  [("Content-Type", "application/x-subrip")])
+            if self.path == "/old/transcript?language=en":
+                return self._send(301, headers=[("Location", "/talks/moved.txt")])
+            if self.path == "/talks/moved.txt":
+                return self._send(200, b"Moved text.", [("Content-Type", "text/plain")])
+            self._send(404)
+    
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    workdir = Path(tempfile.mkdtemp(prefix="ted_fetch_"))
+    try:
+        from ted_material_library import MaterialLibrary
+        from ted_fetcher import fetch_transcripts
+        
+        base = f"http://127.0.0.1:{server.server_port}"
+        lib = MaterialLibrary(str(workdir / "lib.db"))
+        for slug in ("plain_talk", "flaky_talk", "missing_talk"):
+            lib.add_url(f"{base}/talks/{slug}")
+        lib.add_url(f"{base}/old", "Redirected")
+        out = workdir / "transcripts"
+        options = dict(output_dir=str(out), concurrency=2, per_host=2, rate=0, backoff=0.01)
+        
+        # 抓取期间另一进程完成了一个素材 / Another process completes a material meanwhile
+        other = MaterialLibrary(str(workdir / "lib.db"))
+        other.mark_processed(4, "", "old.md")
+        other.close()
+        results = {r.material_id: r for r in fetch_transcripts(lib, **options)}
+        statuses = [results[i].status for i in (1, 2, 3, 4)]
+        if statuses != ["fetched", "fetched", "failed", "fetched"] or results[2].attempts != 2 \
+                or results[3].attempts != 1:
+            print(f"✗ 失败 ({statuses}, {[r.error for r in results.values()]})")
+            return False
+        if (out / "plain_talk.txt").read_text() != "Hello there.\nSecond line.\n" \
+                or not (out / "flaky_talk.srt").exists() or not (out / "old.txt").exists():
+            print(f"✗ 失败 (文件 {sorted(p.name for p in out.iterdir())})")
+            return False
+        # 连接被复用 / connections were reused
+        if hits["connections"] > 2:
+            print(f"✗ 失败 ({hits['connections']} 个连接)")
+            return False
+        lib.close()
+        
+        # 重新打开后条件请求返回 304 / After reopening, the conditional request gets a 304
+        lib = MaterialLibrary(str(workdir / "lib.db"))
+        if lib.get_material(1)['transcript_file'] != str(out / "plain_talk.txt"):
+            print("✗ 失败 (transcript_file 未保存)")
+            return False
+        # 只写字幕字段，不覆盖他人的状态 / Only transcript fields are written, nobody's status is reverted
+        if not lib.get_material(4)['processed'] or lib.get_material(4)['transcript_file'] != str(out / "old.txt") \
+                or lib.get_material(1)['transcript_etag'] != '"v1"':
+            print("✗ 失败 (覆盖了其他进程的修改)")
+            return False
+        again = fetch_transcripts(lib, [lib.get_material(1)], **options)
+        lib.close()
+        if again[0].status != "not_modified" or hits["not_modified"] != 1:
+            print(f"✗ 失败 (条件请求 {again[0].status})")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_bilingual_alignment():
+    """测试中英字幕对齐 / Test en.srt / zh.srt alignment"""
+    print("测试 22: 中英字幕对齐...", end=" ")
+    workdir = Path(tempfile.mkdtemp(prefix="ted_bilingual_"))
+    try:
+        from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+        from ted_subtitles import Cue
+        from ted_bilingual import align_cues, BilingualTranscript
+        from ted_batch import collect_transcripts, run_batch
+        
+        def srt(cues):
+            stamp = lambda ms: f"00:00:{ms // 1000:02d},{ms % 1000:03d}"
+            return "\n".join(f"{i}\n{stamp(a)} --> {stamp(b)}\n{text}\n" for i, (a, b, text) in enumerate(cues, 1))
+        
+        english = [(0, 2000, "Resilience is something we can learn."),
+                   (2000, 4000, "It takes practice and patience."),
+                   (4000, 6500, "My mission is to make it meaningful.")]
+        chinese = [(40, 3950, "韧性是可以学习的，"), (3960, 3990, ""), (4100, 6400, "我的使命是让它有意义。"),
+                   (9000, 9500, "（掌声）")]
+        
+        # 一个中文字幕覆盖两个英文字幕；无对应的字幕单独成段
+        # One Chinese cue spans two English ones; unmatched cues stand alone
+        segments = list(align_cues((Cue(i, a, b, t) for i, (a, b, t) in enumerate(english)),
+                                   (Cue(i, a, b, t) for i, (a, b, t) in enumerate(chinese))))
+        if [(s.start_ms, s.chinese) for s in segments] != [(0, "韧性是可以学习的，"), (4000, "我的使命是让它有意义。"),
+                                                           (9000, "（掌声）")] \
+                or segments[0].english.count(".") != 2 or segments[2].english:
+            print(f"✗ 失败 ({segments})")
+            return False
+        
+        # 译文和词义进入学习包 / Translations and meanings reach the package
+        profile = LearnerProfile(level="B2", vocabulary_size=2000, goals=["vocabulary"],
+                                 output_language="bilingual", subtitle_format="srt", output_style="complete")
+        bilingual = BilingualTranscript.from_text(srt(english), srt(chinese), {"resilience": "韧性"})
+        processor = TEDTranscriptProcessor(profile)
+        output = processor.generate_markdown_output(srt(english), ["vocabulary"], translation=bilingual)
+        row = next((line for line in output.splitlines() if line.startswith("| resilience ")), "")
+        if "| 韧性 |" not in row or "<br>韧性是可以学习的，" not in row \
+                or "<br>我的使命是让它有意义。" not in output:
+            print(f"✗ 失败 (学习包 {row})")
+            return False
+        
+        # 批处理把 zh.srt 当作 en.srt 的译文 / Batch mode treats zh.srt as en.srt's translation
+        talk = workdir / "talks" / "my_talk"
+        talk.mkdir(parents=True)
+        (talk / "en.srt").write_text(srt(english), encoding="utf-8")
+        (talk / "zh.srt").write_text(srt(chinese), encoding="utf-8")
+        sources = collect_transcripts(str(workdir / "talks"))
+        results = run_batch(sources, str(workdir / "out"), profile)
+        if [p.name for p in sources] != ["en.srt"] or results[0].error \
+                or "<br>韧性是可以学习的，" not in (workdir / "out" / "my_talk.md").read_text(encoding="utf-8"):
+            print(f"✗ 失败 (批处理 {sources})")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_global_glossary():
+    """测试全局词汇表索引 / Test the merged, memory-mapped glossary"""
+    print("测试 23: 全局词汇表...", end=" ")
+    workdir = Path(tempfile.mkdtemp(prefix="ted_glossary_"))
+    try:
+        import json
+        import time
+        from ted_glossary import build_glossary, load_glossary_index
+        
+        # 20 万词条的基础词典 + 两个演讲词汇表 / A 200k-entry base plus two talk glossaries
+        base = workdir / "base.tsv"
+        with open(base, "w", encoding="utf-8") as f:
+            f.write("# word\tmeaning\n")
+            for i in range(200_000):
+                f.write(f"word{i:06d}\t词{i}\n")
+            f.write("Resilience\t韧性; 恢复力\n")
+        for talk, glossary in (("a", {"resilience": "复原力；韧性"}), ("b", {"mission": "使命"})):
+            (workdir / "ted" / talk).mkdir(parents=True)
+            (workdir / "ted" / talk / "glossary_zh.json").write_text(
+                json.dumps(glossary, ensure_ascii=False), encoding="utf-8")
+        index = workdir / "glossary.idx"
+        count = build_glossary(base, workdir / "ted", index)
+        
+        started = time.perf_counter()
+        glossary = load_glossary_index(index)
+        opened = time.perf_counter() - started
+        if count != 200_002 or opened > 0.010:
+            print(f"✗ 失败 ({count} 条, 打开 {opened * 1000:.1f} ms)")
+            return False
+        # 合并去重：基础词典的义项在前 / Merged and deduplicated, base senses first
+        if glossary.get("RESILIENCE") != "韧性；恢复力；复原力" or glossary.get("mission") != "使命" \
+                or glossary.lookup("nope", "word123456") != "词123456":
+            print(f"✗ 失败 ({glossary.get('resilience')})")
+            return False
+        
+        started = time.perf_counter()
+        for i in range(0, 200_000, 20):
+            glossary.get(f"word{i:06d}")
+        if time.perf_counter() - started > 1.0:
+            print("✗ 失败 (查询太慢)")
+            return False
+        
+        # 随仓库的词汇表为词汇表项提供中文释义 / The shipped glossary fills chinese_meaning
+        from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+        profile = LearnerProfile(level="B2", vocabulary_size=8000, goals=["vocabulary"],
+                                 output_language="bilingual", subtitle_format="plain_text",
+                                 output_style="complete")
+        with open("sample_transcript.txt", "r", encoding="utf-8") as f:
+            items = TEDTranscriptProcessor(profile).extract_vocabulary(f.read(), count=15)
+        if load_glossary_index() is None or not any(i.word == "ingenuity" and i.chinese_meaning for i in items):
+            print("✗ 失败 (词汇表未使用词汇表索引)")
+            return False
+        # 基础词典按词元收录，屈折形式经词形还原查到 / The base is lemma-keyed; inflections resolve by lemmatization
+        from ted_frequency import load_frequency_index
+        from ted_glossary import BASE_DICTIONARY, read_dictionary
+        base_words = [word for word, _ in read_dictionary(BASE_DICTIONARY)]
+        frequency = load_frequency_index()
+        if len(set(base_words)) != len(base_words) or \
+                any(frequency.lemma_rank(word)[0] != word for word in base_words) or \
+                load_glossary_index().get("revolutionized") != load_glossary_index().get("revolutionize"):
+            print("✗ 失败 (基础词典不是词元词典)")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+# `ted_cli.py --help` 的导入时间预算 / Import-time budget for `ted_cli.py --help`
+STARTUP_BUDGET_MS = 120
+
+def _import_times(*args):
+    """python -X importtime 的 模块 -> 自身微秒 / Module -> self µs from python -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", *args],
+                            capture_output=True, text=True, timeout=60)
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "cumulative" not in line:
+            own, _, name = line[len("import time:"):].split("|")
+            times[name.strip()] = int(own)
+    return times
+
+def test_startup_time():
+    """测试冷启动时间 / Test that heavy modules load lazily"""
+    print("测试 24: 冷启动时间...", end=" ")
+    try:
+        # --help 不加载处理器、批处理或对齐模块 / --help loads no processor, batch or alignment code
+        heavy = {"ted_learning_sop", "ted_batch", "ted_bilingual", "ted_glossary", "ted_phrases",
+                 "ted_frequency", "concurrent.futures", "dataclasses"}
+        runs = [_import_times("ted_cli.py", "--help") for _ in range(3)]
+        loaded = heavy & set(runs[0])
+        if loaded:
+            print(f"✗ 失败 (--help 导入了 {', '.join(sorted(loaded))})")
+            return False
+        # 取三次中最快的一次，减少噪声 / Best of three, to keep scheduler noise out
+        total_ms = min(sum(times.values()) for times in runs) / 1000
+        if total_ms > STARTUP_BUDGET_MS:
+            print(f"✗ 失败 ({total_ms:.0f} ms > {STARTUP_BUDGET_MS} ms)")
+            return False
+        
+        # 处理器本身也只在用到时才加载短语挖掘、对齐和词汇表 / The processor defers them too
+        loaded = {"ted_phrases", "ted_bilingual", "ted_glossary", "concurrent.futures", "csv"} \
+            & set(_import_times("-c", "import ted_learning_sop"))
+        if loaded:
+            print(f"✗ 失败 (ted_learning_sop 导入了 {', '.join(sorted(loaded))})")
+            return False
+        
+        print(f"✓ 通过 ({total_ms:.0f} ms)")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+
+def test_benchmark_suite():
+    """测试基准测试套件 / Test the pipeline benchmark harness"""
+    print("测试 25: 基准测试套件...", end=" ")
+    try:
+        from ted_benchmark import (STAGES, DURATIONS, FORMS, BASELINE, BenchmarkResult,
+                                   synthetic_transcript, run_benchmarks, compare, load_results)
+        from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+        
+        # 合成字幕：确定性、可解析、约 150 词/分钟 / Deterministic, parseable, ~150 words a minute
+        srt = synthetic_transcript(2, "srt")
+        profile = LearnerProfile(level="B2", vocabulary_size=8000, goals=["listening"],
+                                 output_language="english_only", subtitle_format="srt",
+                                 output_style="complete")
+        processor = TEDTranscriptProcessor(profile)
+        words = len(processor.clean_transcript(srt).split())
+        if srt != synthetic_transcript(2, "srt") or not 290 <= words <= 330 or not processor.cue_offsets:
+            print(f"✗ 失败 (合成字幕: {words} 词)")
+            return False
+        
+        results = run_benchmarks([1], FORMS, STAGES, repeat=2)
+        if len(results) != len(FORMS) * len(STAGES) or \
+                any(r.words_per_second <= 0 or len(r.times) != 2 for r in results) or \
+                max(r.peak_bytes for r in results) <= 0:
+            print("✗ 失败 (结果不完整)")
+            return False
+        
+        # 基线比较：慢一倍的结果会被标记，噪声内的不会 / Twice as slow is flagged, noise is not
+        timed = [BenchmarkResult("slower", 100, [0.020, 0.021]), BenchmarkResult("same", 100, [0.010, 0.011]),
+                 BenchmarkResult("noisy", 100, [0.016, 0.030])]
+        stored = {name: {"best": 0.010, "stdev": 0.001} for name in ("slower", "same", "noisy")}
+        flagged = [name for name, _, regressed in compare(timed, stored) if regressed]
+        if flagged != ["slower"]:
+            print(f"✗ 失败 (回归判断: {flagged})")
+            return False
+        
+        # 随仓库的基线覆盖所有时长、格式和阶段 / The shipped baseline covers the whole suite
+        names = {f"{form}/{minutes}min/{stage}" for form in FORMS for minutes in DURATIONS for stage in STAGES}
+        if not names <= set(load_results(BASELINE)):
+            print("✗ 失败 (基线不完整)")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+
+def test_stage_profiling():
+    """测试分阶段性能剖析 / Test per-stage profiling hooks"""
+    print("测试 26: 分阶段剖析...", end=" ")
+    workdir = Path(tempfile.mkdtemp(prefix="ted_profile_"))
+    try:
+        import json
+        from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+        from ted_profiling import StageHook, StageProfiler
+        from ted_batch import run_batch
+        
+        profile = LearnerProfile(level="B2", vocabulary_size=8000, goals=["listening"],
+                                 output_language="english_only", subtitle_format="plain_text",
+                                 output_style="complete")
+        with open("sample_transcript.txt", "r", encoding="utf-8") as f:
+            transcript = f.read()
+        
+        # 钩子看到成对的开始/结束调用 / Hooks see well-bracketed start/finish calls
+        class Recorder(StageHook):
+            def __init__(self):
+                self.events = []
+            def stage_started(self, stage):
+                self.events.append(("+", stage))
+            def stage_finished(self, stage):
+                self.events.append(("-", stage))
+        
+        processor = TEDTranscriptProcessor(profile)
+        recorder, profiler = Recorder(), StageProfiler(trace_memory=True)
+        processor.hooks += [recorder, profiler]
+        processor.generate_markdown_output(transcript)
+        open_stages = []
+        for sign, stage in recorder.events:
+            if sign == "+":
+                open_stages.append(stage)
+            elif not open_stages or open_stages.pop() != stage:
+                print(f"✗ 失败 (阶段嵌套错误: {stage})")
+                return False
+        
+        stats = profiler.stats
+        expected = {"clean", "tokenize", "difficulty", "extract.vocabulary", "extract.phrases",
+                    "generate.review", "render.vocabulary", "render.review"}
+        if not expected <= set(stats) or open_stages:
+            print(f"✗ 失败 (缺少阶段: {expected - set(stats)})")
+            return False
+        # 嵌套阶段计入父阶段的总时间，但不计入自身时间 / Nested time counts in Wall, not in Self
+        vocabulary, rendered = stats["extract.vocabulary"], stats["render.vocabulary"]
+        if rendered.wall < vocabulary.wall or rendered.self_wall > rendered.wall - vocabulary.wall + 1e-6 \
+                or vocabulary.peak <= 0 or vocabulary.cpu <= 0:
+            print("✗ 失败 (统计不一致)")
+            return False
+        
+        # 记录仍在占用的内存块数 / Blocks still allocated at the end of a stage are counted
+        counter = StageProfiler(trace_memory=True)
+        counter.stage_started("keep")
+        kept = [object() for _ in range(1000)]
+        counter.stage_finished("keep")
+        if not 1000 <= counter.stats["keep"].blocks < 1100 or "Blocks" not in counter.format_table() \
+                or counter.to_dict()["keep"]["blocks"] != counter.stats["keep"].blocks:
+            print(f"✗ 失败 (内存块 {counter.stats['keep'].blocks})")
+            return False
+        del kept
+        
+        # 批处理结果带有每个文件的阶段统计 / Batch results carry each file's stages
+        (workdir / "in").mkdir()
+        for name in ("a", "b"):
+            shutil.copy("sample_transcript.txt", workdir / "in" / f"{name}.txt")
+        results = run_batch(sorted((workdir / "in").iterdir()), str(workdir / "out"), profile, profiling="time")
+        total = StageProfiler()
+        for result in results:
+            total.merge(result.stages)
+        if total.stats["extract.vocabulary"].calls != 2:
+            print("✗ 失败 (批处理未合并)")
+            return False
+        
+        # CLI: --profile json 写出可聚合的 JSON / --profile json writes mergeable JSON
+        report = workdir / "profile.json"
+        result = subprocess.run(
+            [sys.executable, "ted_cli.py", "--input-dir", str(workdir / "in"), "--output-dir",
+             str(workdir / "cli"), "--profile", "json", "--profile-output", str(report)],
+            capture_output=True, text=True, timeout=120)
+        data = json.loads(report.read_text(encoding="utf-8")) if report.exists() else {}
+        if result.returncode != 0 or len(data.get("files", [])) != 2 or \
+                data["stages"]["clean"]["calls"] != 2:
+            print(f"✗ 失败 (CLI: {result.stderr.strip()[-200:]})")
+            return False
+        result = subprocess.run(
+            [sys.executable, "ted_cli.py", "-i", "sample_transcript.txt", "-o", str(workdir / "one.md"), "--profile"],
+            capture_output=True, text=True, timeout=120)
+        if result.returncode != 0 or "Stage profile:" not in result.stdout or "render.review" not in result.stdout:
+            print("✗ 失败 (CLI 表格)")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_corpus_stats():
+    """测试语料库统计存储 / Test the incremental corpus statistics store"""
+    print("测试 27: 语料库统计...", end=" ")
+    workdir = Path(tempfile.mkdtemp(prefix="ted_corpus_"))
+    try:
+        import time
+        from collections import Counter
+        from ted_corpus import CorpusStats
+        from ted_benchmark import synthetic_transcript
+        from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+        from ted_batch import run_batch
+        
+        profile = LearnerProfile(level="B2", vocabulary_size=8000, goals=["vocabulary"],
+                                 output_language="english_only", subtitle_format="plain_text",
+                                 output_style="complete")
+        processor = TEDTranscriptProcessor(profile)
+        corpus = CorpusStats(workdir / "corpus.db")
+        talks = {f"talk{i}": synthetic_transcript(3, seed=i) for i in range(8)}
+        for key, transcript in talks.items():
+            corpus.add_transcript(key, transcript, processor)
+        
+        # 文档频率与逐篇重新统计一致 / Document frequencies match a recount
+        def recount():
+            df = Counter()
+            for transcript in talks.values():
+                df.update(processor.lemma_counts(processor.clean_transcript(transcript))[0].keys())
+            return df
+        df = recount()
+        sample = list(df)[:200]
+        if len(corpus) != 8 or corpus.document_frequencies(sample) != {l: df[l] for l in sample}:
+            print("✗ 失败 (文档频率不一致)")
+            return False
+        
+        # 增量：未变则跳过，替换和删除会修正计数 / Unchanged is skipped; replace and remove adjust counts
+        if corpus.add_transcript("talk0", talks["talk0"], processor):
+            print("✗ 失败 (重复添加)")
+            return False
+        talks["talk0"] = synthetic_transcript(3, seed=100)
+        corpus.add_transcript("talk0", talks["talk0"], processor)
+        corpus.remove_talk("talk7")
+        del talks["talk7"]
+        df = recount()
+        if len(corpus) != 7 or corpus.document_frequencies(list(df)) != dict(df):
+            print("✗ 失败 (增量更新错误)")
+            return False
+        
+        # 语料库相对难度与 TF-IDF / Corpus-relative difficulty and TF-IDF
+        with open("sample_transcript.txt", "r", encoding="utf-8") as f:
+            transcript = f.read()
+        processor.corpus = corpus
+        clean = processor.clean_transcript(transcript)
+        counts, ranks, _ = processor.lemma_counts(clean)
+        started = time.perf_counter()
+        percentile = corpus.percentile(corpus.lexical_score(counts, ranks))
+        weights = corpus.tfidf(counts)
+        elapsed = time.perf_counter() - started
+        score, _ = processor.calculate_difficulty(clean)
+        if score != min(99, int(percentile)) or elapsed > 0.05 or \
+                max(weights, key=weights.get) in {l for l in df if df[l] == len(talks)}:
+            print(f"✗ 失败 (难度 {score}, 百分位 {percentile:.0f}, {elapsed * 1000:.1f} ms)")
+            return False
+        if len(processor.extract_vocabulary(clean, count=10)) != 10:
+            print("✗ 失败 (词汇选择)")
+            return False
+        corpus.close()
+        
+        # 批处理先把每个文件加入语料库 / Batch runs add every source to the corpus first
+        (workdir / "in").mkdir()
+        for i in range(3):
+            (workdir / "in" / f"t{i}.txt").write_text(synthetic_transcript(2, seed=50 + i), encoding="utf-8")
+        results = run_batch(sorted((workdir / "in").iterdir()), str(workdir / "out"), profile,
+                            corpus=str(workdir / "batch.db"))
+        corpus = CorpusStats(workdir / "batch.db")
+        if any(r.error for r in results) or len(corpus) != 3:
+            print("✗ 失败 (批处理语料库)")
+            return False
+        
+        # 语料库变化后缓存失效 / Cached packages are rebuilt once the corpus changes
+        from ted_batch import BuildCache
+        def cached_run():
+            cache = BuildCache(str(workdir / "out"))
+            results = run_batch(sorted((workdir / "in").iterdir()), str(workdir / "out"), profile,
+                                cache=cache, corpus=str(workdir / "batch.db"))
+            cache.save()
+            return [r.cached for r in results]
+        cached_run()
+        unchanged = cached_run()
+        corpus.add_transcript("elsewhere", synthetic_transcript(2, seed=99), processor)
+        if unchanged != [True] * 3 or cached_run() != [False] * 3:
+            print("✗ 失败 (语料库缓存键)")
+            return False
+        corpus.close()
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_difficulty_engine():
+    """测试可读性与难度引擎 / Test the readability and difficulty engine"""
+    print("测试 28: 可读性与难度引擎...", end=" ")
+    try:
+        import time
+        import ted_difficulty
+        from ted_difficulty import (DifficultyEngine, TalkFeatures, BANDS, BAND_WIDTH,
+                                    count_syllables, extract_features)
+        from ted_benchmark import synthetic_transcript
+        from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+        
+        if [count_syllables(w) for w in ("cat", "make", "table", "innovation", "walked")] != [1, 1, 2, 4, 1]:
+            print("✗ 失败 (音节计数)")
+            return False
+        
+        # 覆盖率在频段内插值，频段占比合计为 1 / Coverage interpolates within a band; band shares sum to 1
+        histogram = [0] * (BANDS + 1)
+        histogram[0], histogram[1], histogram[BANDS] = 60, 20, 20
+        engine = DifficultyEngine([TalkFeatures(100, 10, 150, 450, 40.0, histogram)])
+        coverage = [engine.coverage(v)[0] for v in (0, BAND_WIDTH, BAND_WIDTH * 3 // 2, 20000)]
+        shares = {name: values[0] for name, values in engine.band_shares().items()}
+        if [round(c, 6) for c in coverage] != [0.0, 0.6, 0.7, 0.8] or \
+                abs(sum(shares.values()) - 1) > 1e-9 or shares["K1"] != 0.8 or \
+                abs(engine.speech_rate()[0] - 150) > 1e-9 or \
+                abs(engine.flesch_kincaid()[0] - (0.39 * 10 + 11.8 * 1.5 - 15.59)) > 1e-9:
+            print(f"✗ 失败 (指标 {coverage}, {shares})")
+            return False
+        
+        # 字幕时间给出语速；词汇量越大覆盖率越高 / Cue timing gives speech rate; coverage grows with vocabulary
+        profile = LearnerProfile(level="B1 (CET-4 / IELTS 5-5.5 / TOEFL 50-70)", vocabulary_size=4000,
+                                 goals=["listening"], output_language="english_only",
+                                 subtitle_format="srt", output_style="complete")
+        processor = TEDTranscriptProcessor(profile)
+        talks = [synthetic_transcript(5, form="srt", seed=i) for i in range(3)]
+        features = [extract_features(processor, processor.clean_transcript(t)) for t in talks]
+        engine = DifficultyEngine(features)
+        rates = engine.speech_rate()
+        if any(not rate or abs(rate - 150) > 20 for rate in rates) or \
+                not engine.coverage(2000)[0] < engine.coverage(4000)[0] < engine.coverage(16000)[0]:
+            print(f"✗ 失败 (语速 {rates})")
+            return False
+        
+        # 可选 NumPy 与纯 Python 结果一致 / Optional NumPy and pure Python agree
+        # 每个引擎在构造时确定后端 / Each engine keeps the backend it was built with
+        numpy = ted_difficulty.np
+        ted_difficulty.np = None
+        try:
+            plain = DifficultyEngine(features)
+        finally:
+            ted_difficulty.np = numpy
+        vectorized = DifficultyEngine(features)
+        def metrics(engine):
+            return (engine.flesch_kincaid() + engine.coverage(5000) + engine.fit(profile)
+                    + [share for shares in engine.band_shares().values() for share in shares])
+        if any(abs(a - b) > 1e-9 for a, b in zip(metrics(plain), metrics(vectorized))):
+            print("✗ 失败 (NumPy 结果不一致)")
+            return False
+        
+        # 整个库的排序足够快 / Ranking a whole library is fast
+        library = DifficultyEngine(features * 3000)
+        started = time.perf_counter()
+        ranked = library.rank(profile, limit=10)
+        elapsed = time.perf_counter() - started
+        if len(ranked) != 10 or ranked[0][1] < ranked[-1][1] or elapsed > 1.0:
+            print(f"✗ 失败 (排序 {elapsed:.2f} s)")
+            return False
+        
+        # 参数回显显示可读性 / The parameter echo reports readability
+        output = processor.generate_markdown_output(talks[0])
+        if "**Readability (可读性)**: Flesch-Kincaid grade" not in output or "wpm" not in output:
+            print("✗ 失败 (参数回显)")
+            return False
+        
+        print("✓ 通过")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+
+def test_talk_recommender():
+    """测试素材推荐 / Test the talk recommender"""
+    print("测试 29: 素材推荐...", end=" ")
+    workdir = Path(tempfile.mkdtemp(prefix="ted_recommend_"))
+    try:
+        import time
+        from ted_material_library import MaterialLibrary
+        from ted_recommend import (ProfileStore, TalkRecommender, known_bitset, profiles_path,
+                                   update_profiles)
+        from ted_benchmark import synthetic_transcript
+        from ted_frequency import load_frequency_index
+        from ted_learning_sop import LearnerProfile
+        
+        library_file = workdir / "library.db"
+        library = MaterialLibrary(str(library_file))
+        for i in range(4):
+            transcript = workdir / f"t{i}.srt"
+            transcript.write_text(synthetic_transcript(2 + i, form="srt", seed=i), encoding="utf-8")
+            material = library.add_url(f"https://www.ted.com/talks/talk_{i}", f"Talk {i}")
+            if i < 3:
+                library.mark_processed(material['id'], str(transcript), "")
+        profile = LearnerProfile(level="B1", vocabulary_size=4000, goals=["listening"],
+                                 output_language="english_only", subtitle_format="auto",
+                                 output_style="complete")
+        
+        # 只推荐已处理的素材，按契合度排序 / Only processed materials, best fit first
+        ranked = library.recommend(profile, limit=None)
+        fits = [r.fit for _, r in ranked]
+        if [m['id'] for m, _ in ranked if not m['processed']] or len(ranked) != 3 or fits != sorted(fits, reverse=True):
+            print(f"✗ 失败 (推荐 {ranked})")
+            return False
+        
+        # 词汇画像只在转写变化时重算 / Profiles are recomputed only for changed transcripts
+        store = ProfileStore(profiles_path(library_file))
+        unchanged = update_profiles(library, store)
+        (workdir / "t1.srt").write_text(synthetic_transcript(6, form="srt", seed=9), encoding="utf-8")
+        changed = update_profiles(library, store)
+        library.remove_material(3)
+        removed = update_profiles(library, store)
+        if (unchanged, changed, removed, len(store)) != (0, 1, 1, 2):
+            print(f"✗ 失败 (画像更新 {unchanged}, {changed}, {removed})")
+            return False
+        
+        # 已知词位图的覆盖率与逐词计数一致 / Known-word coverage matches a brute-force count
+        profiles = store.load()
+        store.close()
+        lemmas = load_frequency_index().lemmas_by_rank()
+        known_words = lemmas[:3500] + lemmas[6000:6400]
+        known = known_bitset(known_words)
+        known_positions = set(range(3500)) | set(range(6000, 6400))
+        recommender = TalkRecommender(profiles)
+        coverage = recommender.coverage(profile.vocabulary_size, known)
+        for i, talk in enumerate(recommender.profiles):
+            expected = sum(n for lemma, n in zip(talk.lemmas, talk.counts) if lemma in known_positions) \
+                / sum(talk.features.histogram)
+            if abs(coverage[i] - expected) > 1e-9:
+                print(f"✗ 失败 (覆盖率 {coverage[i]:.4f} != {expected:.4f})")
+                return False
+        if recommender.coverage(4000, known_bitset(lemmas[:4000])) != recommender.coverage(4000):
+            print("✗ 失败 (词汇量前缀)")
+            return False
+        
+        # 5 万篇演讲的排序不到一秒 / Ranking 50k talks takes well under a second
+        many = TalkRecommender({i: profiles[list(profiles)[i % 2]] for i in range(50000)})
+        many.recommend(profile, known)  # builds the inverted index once
+        started = time.perf_counter()
+        top = many.recommend(profile, known, limit=10)
+        elapsed = time.perf_counter() - started
+        if len(top) != 10 or elapsed > 1.0:
+            print(f"✗ 失败 (5 万篇排序 {elapsed:.2f} s)")
+            return False
+        
+        # recommend 子命令 / The recommend subcommand
+        result = subprocess.run([sys.executable, "ted_cli.py", "recommend", "--library", str(library_file),
+                                 "--level", "B1", "--vocab", "4000"],
+                                capture_output=True, text=True, timeout=60)
+        if result.returncode != 0 or "Talk 0" not in result.stdout or "Talk 3" in result.stdout:
+            print(f"✗ 失败 (子命令: {result.stderr.strip()})")
+            return False
+        library.close()
+        
+        print(f"✓ 通过 ({elapsed * 1000:.0f} ms)")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_known_words():
+    """测试已知词学习者模型 / Test the known-word learner model"""
+    print("测试 30: 已知词模型...", end=" ")
+    workdir = Path(tempfile.mkdtemp(prefix="ted_known_"))
+    try:
+        import pickle
+        import sqlite3
+        import time
+        from dataclasses import replace
+        from ted_known_words import KnownWords, read_anki_reviews, rank_bitset, AGAIN, HARD, GOOD, EASY
+        from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+        from ted_batch import cache_key
+        
+        known = KnownWords.from_vocabulary_size(4000)
+        if len(known) != 4000 or "the" not in known or known.knows_rank(4001):
+            print("✗ 失败 (词汇量初始化)")
+            return False
+        
+        # 紧凑存储：内存与磁盘都在几 KB 以内 / Compact: a few KB in memory and on disk
+        path = workdir / "learner.known"
+        known.save(path)
+        if path.stat().st_size > 1024 or sys.getsizeof(known.bitmap) > 4096 or \
+                KnownWords.load(path).bitmap != known.bitmap or \
+                pickle.loads(pickle.dumps(known)).bitset != known.bitset:
+            print(f"✗ 失败 (存储 {path.stat().st_size} 字节)")
+            return False
+        
+        # 词汇提取跳过已知词 / Vocabulary extraction skips known words
+        profile = LearnerProfile(level="B1", vocabulary_size=4000, goals=["vocabulary"],
+                                 output_language="english_only", subtitle_format="plain_text",
+                                 output_style="complete", known_words=known)
+        processor = TEDTranscriptProcessor(profile)
+        with open("sample_transcript.txt", "r", encoding="utf-8") as f:
+            text = processor.clean_transcript(f.read())
+        before = [item.word for item in processor.extract_vocabulary(text, count=10)]
+        
+        # 从 Anki 复习记录更新 / Update from Anki review history
+        collection = workdir / "collection.anki2"
+        connection = sqlite3.connect(str(collection))
+        connection.executescript("""
+            CREATE TABLE notes (id INTEGER PRIMARY KEY, flds TEXT);
+            CREATE TABLE cards (id INTEGER PRIMARY KEY, nid INTEGER);
+            CREATE TABLE revlog (id INTEGER PRIMARY KEY, cid INTEGER, ease INTEGER);
+        """)
+        reviews = [(before[0], GOOD), (before[1], EASY), ("the", AGAIN), (before[2], HARD),
+                   ("the", AGAIN), ("the", GOOD)]
+        for i, (word, ease) in enumerate(reviews):
+            fields = f"<b>{word}</b>\x1fmeaning" if i % 2 else f"Fill in: a ____ idea\x1f{word} | an example"
+            connection.execute("INSERT INTO notes VALUES (?, ?)", (i, fields))
+            connection.execute("INSERT INTO cards VALUES (?, ?)", (i, i))
+            connection.execute("INSERT INTO revlog VALUES (?, ?, ?)", (1000 + i, i, ease))
+        connection.commit()
+        connection.close()
+        if list(read_anki_reviews(collection)) != reviews:
+            print(f"✗ 失败 (读取复习记录 {list(read_anki_reviews(collection))})")
+            return False
+        changed = known.apply_reviews(read_anki_reviews(collection))
+        after = [item.word for item in processor.extract_vocabulary(text, count=10)]
+        if changed != 4 or "the" not in known or before[0] in after or before[1] in after \
+                or before[2] not in after or len(after) != 10:
+            print(f"✗ 失败 (更新 {changed}, {after})")
+            return False
+        if cache_key(text, profile) == cache_key(text, replace(profile, known_words=KnownWords.load(path))):
+            print("✗ 失败 (缓存键)")
+            return False
+        
+        # 与演讲词集求交只需微秒 / Intersecting with a talk's lemma set takes microseconds
+        talk = rank_bitset(processor.lemma_counts(text)[1].values())
+        started = time.perf_counter()
+        for _ in range(1000):
+            shared = known.intersection(talk)
+        elapsed = (time.perf_counter() - started) / 1000
+        if elapsed > 50e-6 or bin(shared).count("1") > bin(talk).count("1"):
+            print(f"✗ 失败 (求交 {elapsed * 1e6:.1f} µs)")
+            return False
+        
+        # CLI 接受模型文件或词表 / The CLI takes a model file or a word list
+        words = workdir / "words.txt"
+        words.write_text("\n".join(before[:5]) + "\n", encoding="utf-8")
+        for known_file in (path, words):
+            output = workdir / "package.md"
+            result = subprocess.run([sys.executable, "ted_cli.py", "-i", "sample_transcript.txt",
+                                     "-o", str(output), "--known-words", str(known_file)],
+                                    capture_output=True, text=True, timeout=60)
+            if result.returncode != 0 or "**Known Words (已掌握词汇)**" not in output.read_text(encoding="utf-8"):
+                print(f"✗ 失败 (CLI: {result.stderr.strip()})")
+                return False
+        
+        print(f"✓ 通过 ({elapsed * 1e6:.1f} µs)")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def test_anki_export():
+    """测试 Anki 导出 / Test the Anki CSV and .apkg export"""
+    print("测试 31: Anki 导出...", end=" ")
+    workdir = Path(tempfile.mkdtemp(prefix="ted_anki_"))
+    try:
+        import csv
+        import json
+        import sqlite3
+        import tracemalloc
+        import zipfile
+        from ted_anki import MODEL_ID, export_cards, library_cards, note_guid, talk_cards, write_apkg
+        from ted_known_words import read_anki_reviews
+        from ted_material_library import MaterialLibrary
+        from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+        
+        profile = LearnerProfile(level="B2 (CET-6 / IELTS 6-6.5 / TOEFL 70-90)", vocabulary_size=8000,
+                                 goals=["vocabulary"], output_language="bilingual",
+                                 subtitle_format="plain_text", output_style="complete")
+        processor = TEDTranscriptProcessor(profile)
+        with open("sample_transcript.txt", "r", encoding="utf-8") as f:
+            transcript = f.read()
+        cards = list(talk_cards(processor, transcript))
+        
+        # GUID 稳定：同一个词在不同演讲中相同 / Stable GUIDs: the same word gets the same GUID everywhere
+        guids = [note_guid(card) for card in cards]
+        word_card = cards[0]
+        if len(set(guids)) != len(cards) or \
+                note_guid({**word_card, "Back": "new meaning", "Tags": "TED,talk::other"}) != guids[0]:
+            print("✗ 失败 (GUID)")
+            return False
+        
+        # 整个素材库导出，重复的词只保留一次 / Library export keeps each shared word once
+        library = MaterialLibrary(str(workdir / "library.json"))
+        for i in range(2):
+            (workdir / f"t{i}.txt").write_text(transcript, encoding="utf-8")
+            material = library.add_url(f"https://www.ted.com/talks/talk_{i}", f"Talk {i}")
+            library.mark_processed(material['id'], str(workdir / f"t{i}.txt"), "")
+        apkg = workdir / "library.apkg"
+        notes = export_cards(library_cards(library, profile), apkg)
+        with zipfile.ZipFile(apkg) as package:
+            if sorted(package.namelist()) != ["collection.anki2", "media"] or package.read("media") != b"{}":
+                print("✗ 失败 (.apkg 结构)")
+                return False
+            package.extract("collection.anki2", workdir)
+        connection = sqlite3.connect(str(workdir / "collection.anki2"))
+        models = json.loads(connection.execute("SELECT models FROM col").fetchone()[0])
+        stored = [row[0] for row in connection.execute("SELECT guid FROM notes ORDER BY id")]
+        card_count = connection.execute("SELECT count(*) FROM cards JOIN notes ON notes.id = cards.nid").fetchone()[0]
+        tags = connection.execute("SELECT tags FROM notes LIMIT 1").fetchone()[0]
+        
+        # 导出的牌组可被已知词模型读取 / The exported collection feeds the known-word model
+        connection.execute("INSERT INTO revlog VALUES (1, (SELECT min(id) FROM cards), -1, 3, 1, 0, 2500, 5000, 0)")
+        connection.commit()
+        reviewed = list(read_anki_reviews(workdir / "collection.anki2"))
+        connection.close()
+        if notes != len(cards) or stored != guids or card_count != notes or str(MODEL_ID) not in models \
+                or tags != " TED B2 talk::talk_0 " or reviewed != [(word_card['Front'], 3)]:
+            print(f"✗ 失败 (素材库导出 {notes} 条, {tags!r}, {reviewed})")
+            return False
+        
+        # CSV 带 GUID 头部，便于 Anki 更新而非重复 / CSV declares the GUID column so re-imports update
+        csv_path = workdir / "cards.csv"
+        export_cards(cards + cards, csv_path)
+        with open(csv_path, "r", encoding="utf-8", newline="") as f:
+            lines = f.read().splitlines()
+        rows = list(csv.reader(line for line in lines if not line.startswith("#")))
+        if "#guid column:1" not in lines or [row[0] for row in rows] != guids or rows[0][1] != word_card['Front']:
+            print("✗ 失败 (CSV)")
+            return False
+        
+        # 流式导出：内存不随卡片数量增长 / Streaming: memory does not grow with the number of cards
+        def synthetic(n):
+            for i in range(n):
+                word = "zq" + "".join(chr(97 + int(d)) for d in str(i))
+                yield {"Front": word, "Back": f"meaning {i}", "Tags": "TED,noun"}
+        peaks = []
+        for n in (500, 5000):
+            tracemalloc.start()
+            write_apkg(synthetic(n), workdir / f"synthetic{n}.apkg")
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        if peaks[1] > 2 * peaks[0] + 256 * 1024:
+            print(f"✗ 失败 (内存 {peaks[0] // 1024} KB -> {peaks[1] // 1024} KB)")
+            return False
+        
+        # CLI：单个文件与 anki 子命令 / CLI: single file and the anki subcommand
+        result = subprocess.run([sys.executable, "ted_cli.py", "-i", "sample_transcript.txt",
+                                 "-o", str(workdir / "package.md"), "--anki", str(workdir / "talk.apkg")],
+                                capture_output=True, text=True, timeout=60)
+        library_result = subprocess.run([sys.executable, "ted_cli.py", "anki", "--library",
+                                         str(workdir / "library.json"), "--output", str(workdir / "all.csv")],
+                                        capture_output=True, text=True, timeout=60)
+        if result.returncode != 0 or not (workdir / "talk.apkg").exists() or \
+                library_result.returncode != 0 or f"{len(cards)} notes written" not in library_result.stdout:
+            print(f"✗ 失败 (CLI: {result.stderr.strip()} {library_result.stderr.strip()})")
+            return False
+        
+        # 导出失败不能删掉已生成的学习包 / A failed export keeps the package already written
+        (workdir / "package.md").unlink()
+        failed = subprocess.run([sys.executable, "ted_cli.py", "-i", "sample_transcript.txt",
+                                 "-o", str(workdir / "package.md"), "--anki", str(workdir / "missing" / "c.csv")],
+                                capture_output=True, text=True, timeout=60)
+        if failed.returncode == 0 or "Error exporting Anki cards" not in failed.stderr or \
+                not (workdir / "package.md").exists():
+            print("✗ 失败 (导出失败删除了学习包)")
+            return False
+        
+        print(f"✓ 通过 ({notes} notes)")
+        return True
+    except Exception as e:
+        print(f"✗ 失败: {e}")
+        return False
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
 def main():
     """运行所有测试 / Run all tests"""
     print("=" * 60)
@@ -215,7 +1936,32 @@ def main():
         test_sample_processing,
         test_material_library,
         test_different_levels,
-        test_output_structure
+        test_output_structure,
+        test_batch_mode,
+        test_parallel_batch_mode,
+        test_incremental_cache,
+        test_subtitle_cues,
+        test_shared_tokenizer,
+        test_frequency_vocabulary,
+        test_phrase_mining,
+        test_section_selection,
+        test_streaming_writer,
+        test_library_indexes,
+        test_sqlite_storage,
+        test_full_text_search,
+        test_library_batch_writes,
+        test_work_command,
+        test_transcript_fetcher,
+        test_bilingual_alignment,
+        test_global_glossary,
+        test_startup_time,
+        test_benchmark_suite,
+        test_stage_profiling,
+        test_corpus_stats,
+        test_difficulty_engine,
+        test_talk_recommender,
+        test_known_words,
+        test_anki_export
     ]
     
     results = [test() for test in tests]
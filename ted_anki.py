@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Anki export for TED English Learning SOP System
+Writes the review kit's cards (generate_review_kit) for one talk or a whole
+material library as
+
+    .csv    Anki's CSV import format, with #guid/#tags header lines
+    .apkg   a native Anki package: a zip of collection.anki2 (an Anki
+            collection in SQLite) and its media map
+
+Every note gets a stable GUID derived from what it asks, not from the talk
+it came from: word cards are keyed by the word's lemma, fill-in cards by the
+lemma and the blanked sentence. The same word met in several talks is
+exported once, and re-importing an updated export makes Anki update the
+existing notes instead of adding duplicates.
+
+Cards are streamed: talks are processed one at a time, CSV rows and SQLite
+rows are written as they come, and GUIDs already written are remembered in
+SQLite (the collection itself, or a temporary database for CSV), so memory
+stays flat however many cards are exported.
+
+    python3 ted_anki.py transcript.txt cards.apkg
+    python3 ted_cli.py anki --library material_library.db --output ted.apkg
+"""
+
+import csv
+import hashlib
+import html
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from ted_known_words import KnownWords, card_word
+
+
+DEFAULT_DECK = "TED English"
+MODEL_NAME = "TED English Card"
+MODEL_ID = 1698700000001  # fixed, so every export shares one note type
+
+# base91 alphabet of Anki's own GUIDs
+_GUID_ALPHABET = ("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+                  "!#$%&()*+,-./:;<=>?@[]^_`{|}~")
+
+# Notes written to the collection per commit
+_CHUNK = 500
+
+
+def note_guid(card: Dict[str, str]) -> str:
+    """Stable Anki GUID of a review-kit card, the same in every talk that produces it"""
+    word = card_word(f"{card['Front']}\x1f{card['Back']}")
+    lemma = KnownWords.lemma_rank(word)[0] or word.lower()
+    key = f"context\t{lemma}\t{card['Front']}" if card['Front'].startswith("Fill in:") else f"word\t{lemma}"
+    number = int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big")
+    digits = []
+    while number:
+        number, digit = divmod(number, len(_GUID_ALPHABET))
+        digits.append(_GUID_ALPHABET[digit])
+    return "".join(reversed(digits)) or _GUID_ALPHABET[0]
+
+
+def anki_tags(card: Dict[str, str]) -> str:
+    """The card's comma-separated tags as Anki tags: space-separated, a level such as
+    "B2 (CET-6 / ...)" shortened to "B2", other spaces replaced by underscores"""
+    tags = (tag.split(" (", 1)[0].strip() for tag in card['Tags'].split(","))
+    return " ".join(tag.replace(" ", "_") for tag in tags if tag)
+
+
+def talk_cards(processor, transcript: str, tag: str = "", translation=None) -> Iterator[Dict[str, str]]:
+    """The review kit's cards for one transcript; tag (e.g. the talk's slug) is added to each"""
+    for card in processor.review_kit(transcript, translation).anki_cards:
+        yield {**card, "Tags": f"{card['Tags']},{tag}"} if tag else card
+
+
+def library_cards(library, profile, progress: Optional[Callable[[Dict], None]] = None) -> Iterator[Dict[str, str]]:
+    """Cards of every processed material with a transcript file, one talk at a time.
+
+    Each card is tagged with the material's URL slug.
+    """
+    from dataclasses import replace
+    from ted_batch import detect_format
+    from ted_learning_sop import TEDTranscriptProcessor
+    from ted_material_library import url_slug
+
+    processors = {}
+    for material in library.get_all_materials():
+        if not material['processed'] or not material['transcript_file']:
+            continue
+        path = Path(material['transcript_file'])
+        if not path.is_file():
+            continue
+        transcript = path.read_text(encoding="utf-8")
+        subtitle_format = detect_format(transcript)
+        processor = processors.setdefault(
+            subtitle_format, TEDTranscriptProcessor(replace(profile, subtitle_format=subtitle_format)))
+        yield from talk_cards(processor, transcript, f"talk::{url_slug(material['url'])}")
+        if progress:
+            progress(material)
+
+
+class _SeenGuids:
+    """GUIDs written so far, in a temporary on-disk SQLite database"""
+
+    def __init__(self):
+        self.connection = sqlite3.connect("")
+        self.connection.execute("CREATE TABLE seen (guid TEXT PRIMARY KEY) WITHOUT ROWID")
+
+    def add(self, guid: str) -> bool:
+        """False if guid was seen before"""
+        return self.connection.execute("INSERT OR IGNORE INTO seen VALUES (?)", (guid,)).rowcount == 1
+
+    def close(self):
+        self.connection.close()
+
+
+def write_csv(cards: Iterable[Dict[str, str]], file) -> int:
+    """Stream cards into a text file object as Anki CSV; returns notes written (duplicates skipped)"""
+    file.write("#separator:Comma\n#html:true\n#columns:GUID,Front,Back,Tags\n#guid column:1\n#tags column:4\n")
+    writer = csv.writer(file)
+    seen = _SeenGuids()
+    written = 0
+    try:
+        for card in cards:
+            guid = note_guid(card)
+            if seen.add(guid):
+                writer.writerow([guid, html.escape(card['Front'], quote=False),
+                                 html.escape(card['Back'], quote=False), anki_tags(card)])
+                written += 1
+    finally:
+        seen.close()
+    return written
+
+
+_COLLECTION_SCHEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null, scm integer not null,
+    ver integer not null, dty integer not null, usn integer not null, ls integer not null,
+    conf text not null, models text not null, decks text not null, dconf text not null, tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null, mod integer not null,
+    usn integer not null, tags text not null, flds text not null, sfld integer not null,
+    csum integer not null, flags integer not null, data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null, ord integer not null,
+    mod integer not null, usn integer not null, type integer not null, queue integer not null,
+    due integer not null, ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null, odid integer not null,
+    flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null, ease integer not null,
+    ivl integer not null, lastIvl integer not null, factor integer not null, time integer not null,
+    type integer not null
+);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn ON notes (usn);
+CREATE INDEX ix_cards_usn ON cards (usn);
+CREATE INDEX ix_revlog_usn ON revlog (usn);
+CREATE INDEX ix_cards_nid ON cards (nid);
+CREATE INDEX ix_cards_sched ON cards (did, queue, due);
+CREATE INDEX ix_revlog_cid ON revlog (cid);
+CREATE INDEX ix_notes_csum ON notes (csum);
+"""
+
+_CSS = ".card { font-family: arial; font-size: 20px; text-align: center; color: black; background-color: white; }"
+
+
+def deck_id(name: str) -> int:
+    """Stable deck id for a deck name (re-exports land in the same deck)"""
+    return 1 << 40 | int(hashlib.sha256(name.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _collection_config(deck: str, now: int) -> tuple:
+    """col row fields: conf, models, decks and dconf as JSON"""
+    did = deck_id(deck)
+    conf = {"activeDecks": [1], "curDeck": 1, "newSpread": 0, "collapseTime": 1200, "timeLim": 0,
+            "estTimes": True, "dueCounts": True, "curModel": None, "nextPos": 1,
+            "sortType": "noteFld", "sortBackwards": False, "addToCur": True}
+    field = {"sticky": False, "rtl": False, "font": "Arial", "size": 20, "media": []}
+    model = {
+        "id": MODEL_ID, "name": MODEL_NAME, "type": 0, "mod": now, "usn": -1, "sortf": 0, "did": did,
+        "flds": [{"name": "Front", "ord": 0, **field}, {"name": "Back", "ord": 1, **field}],
+        "tmpls": [{"name": "Card 1", "ord": 0, "qfmt": "{{Front}}",
+                   "afmt": "{{FrontSide}}\n\n<hr id=answer>\n\n{{Back}}",
+                   "did": None, "bqfmt": "", "bafmt": ""}],
+        "css": _CSS, "tags": [], "vers": [], "req": [[0, "any", [0]]],
+        "latexPre": "\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n\\usepackage{amssymb,amsmath}\n"
+                    "\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n",
+        "latexPost": "\\end{document}",
+    }
+
+    def deck_entry(deck_id_: int, name: str) -> Dict:
+        return {"id": deck_id_, "name": name, "desc": "", "conf": 1, "dyn": 0, "collapsed": False,
+                "extendNew": 10, "extendRev": 50, "mod": now, "usn": -1,
+                "newToday": [0, 0], "revToday": [0, 0], "lrnToday": [0, 0], "timeToday": [0, 0]}
+
+    decks = {"1": deck_entry(1, "Default"), str(did): deck_entry(did, deck)}
+    dconf = {"1": {"id": 1, "name": "Default", "mod": 0, "usn": 0, "maxTaken": 60, "autoplay": True,
+                   "timer": 0, "replayq": True, "dyn": False,
+                   "new": {"delays": [1, 10], "ints": [1, 4, 7], "initialFactor": 2500, "order": 1,
+                           "perDay": 20, "bury": True, "separate": True},
+                   "rev": {"perDay": 100, "ease4": 1.3, "fuzz": 0.05, "ivlFct": 1, "maxIvl": 36500,
+                           "minSpace": 1, "bury": True},
+                   "lapse": {"delays": [10], "mult": 0, "minInt": 1, "leechFails": 8, "leechAction": 0}}}
+    return tuple(json.dumps(value) for value in (conf, {str(MODEL_ID): model}, decks, dconf))
+
+
+def _field_checksum(text: str) -> int:
+    """Anki's duplicate-check checksum: first 8 hex digits of the SHA-1 of the plain sort field"""
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def write_apkg(cards: Iterable[Dict[str, str]], path, deck: str = DEFAULT_DECK) -> int:
+    """Stream cards into a native Anki package; returns notes written (duplicates skipped).
+
+    The collection is built in a temporary SQLite file (one note and one
+    new card per GUID) and then zipped with an empty media map.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    now = int(time.time())
+    did = deck_id(deck)
+    handle, collection = tempfile.mkstemp(suffix=".anki2", dir=path.parent)
+    os.close(handle)
+    try:
+        connection = sqlite3.connect(collection)
+        connection.executescript(_COLLECTION_SCHEMA)
+        connection.execute("INSERT INTO col VALUES (1, ?, ?, ?, 11, 0, 0, 0, ?, ?, ?, ?, '{}')",
+                           (now, now * 1000, now * 1000, *_collection_config(deck, now)))
+        # Unique while building, so repeated GUIDs are skipped in SQLite; dropped before packaging
+        connection.execute("CREATE UNIQUE INDEX build_guid ON notes (guid)")
+        next_id = now * 1000  # Anki ids are millisecond timestamps
+        written = 0
+        for card in cards:
+            front = html.escape(card['Front'], quote=False)
+            note = (next_id, note_guid(card), MODEL_ID, now, -1, f" {anki_tags(card)} ",
+                    f"{front}\x1f{html.escape(card['Back'], quote=False)}", card['Front'],
+                    _field_checksum(card['Front']), 0, "")
+            if connection.execute("INSERT OR IGNORE INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                  note).rowcount:
+                connection.execute("INSERT INTO cards VALUES (?, ?, ?, 0, ?, -1, 0, 0, ?, 0, 0, 0, 0, 0, 0, 0, 0, '')",
+                                   (next_id, next_id, did, now, written + 1))
+                written += 1
+                next_id += 1
+                if written % _CHUNK == 0:
+                    connection.commit()
+        connection.execute("DROP INDEX build_guid")
+        connection.commit()
+        connection.close()
+
+        temp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with zipfile.ZipFile(temp, "w", zipfile.ZIP_DEFLATED) as package:
+            package.write(collection, "collection.anki2")
+            package.writestr("media", "{}")
+        os.replace(temp, path)
+    finally:
+        os.unlink(collection)
+    return written
+
+
+def export_cards(cards: Iterable[Dict[str, str]], path, deck: str = DEFAULT_DECK) -> int:
+    """Write cards to path as .apkg, or as CSV for any other suffix ('-' for stdout)"""
+    if str(path) != "-" and Path(path).suffix.lower() == ".apkg":
+        return write_apkg(cards, path, deck)
+    if str(path) == "-":
+        return write_csv(cards, sys.stdout)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        return write_csv(cards, f)
+
+
+def main():
+    from ted_batch import detect_format
+    from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+
+    if len(sys.argv) != 3:
+        print(__doc__.strip())
+        return 1
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        transcript = f.read()
+    processor = TEDTranscriptProcessor(LearnerProfile(
+        level="B2", vocabulary_size=8000, goals=[], output_language="english_only",
+        subtitle_format=detect_format(transcript), output_style="complete"))
+    written = export_cards(talk_cards(processor, transcript), sys.argv[2])
+    print(f"{written} notes written to {sys.argv[2]}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+Batch driver for TED English Learning SOP System
+Processes a whole directory of transcripts inside a single interpreter so that
+startup, imports and processor construction are paid once per run.
+"""
+
+import hashlib
+import json
+import time
+from dataclasses import dataclass, asdict, replace
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile, GENERATOR_VERSION
+from ted_bilingual import SOURCE_LANGUAGE, BilingualTranscript, is_translation_file, translation_path_for
+
+
+TRANSCRIPT_SUFFIXES = (".txt", ".srt", ".vtt")
+
+
+@dataclass
+class BatchResult:
+    """Outcome of processing one transcript file"""
+    source: str
+    output: str
+    words: int
+    seconds: float
+    error: Optional[str] = None
+    cached: bool = False
+    stages: Optional[Dict[str, Dict]] = None  # StageProfiler.to_dict() when profiled
+
+
+def detect_format(transcript: str, requested: str = "auto") -> str:
+    """Resolve the subtitle format, auto-detecting SRT timestamps if asked"""
+    if requested != "auto":
+        return requested
+    # Simple heuristic: if contains SRT timestamp pattern, it's SRT
+    if "-->" in transcript and any(c.isdigit() for c in transcript[:100]):
+        return "srt"
+    return "plain_text"
+
+
+def collect_transcripts(input_dir: str) -> List[Path]:
+    """Find transcript files under a directory, in a stable order.
+    
+    Chinese subtitles sitting beside English ones (zh.srt next to en.srt)
+    are translations of that transcript, not transcripts of their own.
+    """
+    root = Path(input_dir)
+    return sorted(
+        p for p in root.rglob("*")
+        if p.is_file() and p.suffix.lower() in TRANSCRIPT_SUFFIXES and not is_translation_file(p)
+    )
+
+
+def output_path_for(source: Path, output_dir: str) -> Path:
+    """Map a transcript file to its learning package path (docs/ted/<id>/en.srt -> <id>.md)"""
+    stem = source.stem
+    if stem == SOURCE_LANGUAGE and source.parent.name:
+        stem = source.parent.name
+    return Path(output_dir) / f"{stem}.md"
+
+
+def translation_key(source: Path) -> str:
+    """Contents of the Chinese subtitles (and glossary) aligned with source, for cache_key"""
+    translation = translation_path_for(source)
+    if translation is None:
+        return ""
+    parts = []
+    for path in (translation, translation.with_name("glossary_zh.json")):
+        try:
+            parts.append(path.read_text(encoding='utf-8'))
+        except OSError:
+            parts.append("")
+    return "\0".join(parts)
+
+
+def cache_key(transcript: str, profile: LearnerProfile, translation: str = "",
+              corpus: str = "") -> str:
+    """Content address of a package: transcript as read (cue timings included,
+    since packages show them) + profile + generator version
+    + glossary (+ the aligned translation, if there is one, and the
+    fingerprint of the corpus it was scored against, see with_corpus)"""
+    from ted_glossary import load_glossary_index
+
+    digest = hashlib.sha256()
+    digest.update(GENERATOR_VERSION.encode('utf-8'))
+    digest.update(b"\0")
+    glossary = load_glossary_index()
+    if glossary is not None:
+        digest.update(glossary.fingerprint.encode('utf-8'))
+        digest.update(b"\0")
+    fields = asdict(profile)
+    if profile.known_words is not None:
+        fields['known_words'] = profile.known_words.fingerprint
+    digest.update(json.dumps(fields, sort_keys=True).encode('utf-8'))
+    digest.update(b"\0")
+    digest.update(transcript.encode('utf-8'))
+    if translation:
+        digest.update(b"\0")
+        digest.update(translation.encode('utf-8'))
+    return with_corpus(digest.hexdigest(), corpus)
+
+
+def with_corpus(key: str, corpus: str) -> str:
+    """A cache_key made corpus-relative: corpus is CorpusStats.fingerprint,
+    so packages are rebuilt whenever the corpus they were scored against changes"""
+    if not corpus:
+        return key
+    return hashlib.sha256(f"{key}\0corpus\0{corpus}".encode('utf-8')).hexdigest()
+
+
+class BuildCache:
+    """Incremental build cache stored alongside the generated packages.
+
+    Maps each output file name to the source it was built from and the
+    cache_key of that build. Outputs whose key still matches are skipped;
+    outputs whose source disappeared from the batch are pruned.
+    """
+
+    FILENAME = ".ted_build_cache.json"
+
+    def __init__(self, output_dir: str):
+        self.cache_file = Path(output_dir) / self.FILENAME
+        self.entries: Dict[str, Dict[str, str]] = self._load()
+        self.hits = 0
+        self.misses = 0
+        self.pruned: List[str] = []
+
+    def _load(self) -> Dict[str, Dict[str, str]]:
+        if self.cache_file.exists():
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('generator_version') == GENERATOR_VERSION:
+                    return data.get('entries', {})
+            except (OSError, ValueError):
+                pass
+        return {}
+
+    def save(self):
+        data = {
+            'generator_version': GENERATOR_VERSION,
+            'entries': dict(sorted(self.entries.items()))
+        }
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.cache_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+
+    def is_fresh(self, output_path: Path, key: str) -> bool:
+        entry = self.entries.get(output_path.name)
+        return entry is not None and entry['key'] == key and output_path.exists()
+
+    def record(self, output_path: Path, source: Path, key: str):
+        self.entries[output_path.name] = {'source': str(source), 'key': key}
+
+    def prune(self, live_outputs: List[Path]) -> List[str]:
+        """Delete outputs this cache built whose sources are no longer in the batch"""
+        live = {p.name for p in live_outputs}
+        for name in sorted(set(self.entries) - live):
+            stale = self.cache_file.parent / name
+            if stale.exists():
+                stale.unlink()
+            del self.entries[name]
+            self.pruned.append(str(stale))
+        return self.pruned
+
+
+def render_file(source: Path, profile: LearnerProfile,
+                processors: Dict[str, TEDTranscriptProcessor],
+                hook=None, corpus=None) -> Tuple[Optional[str], int, float, Optional[str]]:
+    """Generate one package in memory; returns (markdown, words, seconds, error).
+
+    hook (e.g. a ted_profiling.StageProfiler) is told about the stages of
+    this package only; corpus (a ted_corpus.CorpusStats) is given to new
+    processors for corpus-relative difficulty and vocabulary.
+    """
+    started = time.perf_counter()
+    try:
+        with open(source, 'r', encoding='utf-8') as f:
+            transcript = f.read()
+        words = len(transcript.split())
+
+        subtitle_format = detect_format(transcript, profile.subtitle_format)
+        processor = processors.get(subtitle_format)
+        if processor is None:
+            file_profile = profile
+            if subtitle_format != profile.subtitle_format:
+                file_profile = replace(profile, subtitle_format=subtitle_format)
+            processor = TEDTranscriptProcessor(file_profile)
+            processor.corpus = corpus
+            processors[subtitle_format] = processor
+
+        translation = translation_path_for(source)
+        bilingual = BilingualTranscript.from_files(source, translation) if translation else None
+        if hook is not None:
+            processor.hooks.append(hook)
+        try:
+            output = processor.generate_markdown_output(transcript, translation=bilingual)
+        finally:
+            if hook is not None:
+                processor.hooks.remove(hook)
+        return output, words, time.perf_counter() - started, None
+    except Exception as e:
+        return None, 0, time.perf_counter() - started, str(e)
+
+
+def _render_profiled(source: Path, profile: LearnerProfile, processors: Dict[str, TEDTranscriptProcessor],
+                     profiling: Optional[str], corpus=None):
+    """render_file plus the package's stage profile (None unless profiling is "time" or "memory")"""
+    if profiling is None:
+        return render_file(source, profile, processors, corpus=corpus), None
+    from ted_profiling import StageProfiler
+    profiler = StageProfiler(trace_memory=profiling == "memory")
+    return render_file(source, profile, processors, profiler, corpus), profiler.to_dict()
+
+
+# Per-process state for pool workers, set up once by _init_worker
+_worker_profile: Optional[LearnerProfile] = None
+_worker_profiling: Optional[str] = None
+_worker_corpus = None
+_worker_processors: Dict[str, TEDTranscriptProcessor] = {}
+
+
+def _init_worker(profile: LearnerProfile, profiling: Optional[str] = None, corpus: Optional[str] = None):
+    global _worker_profile, _worker_profiling, _worker_corpus
+    _worker_profile = profile
+    _worker_profiling = profiling
+    if corpus is not None:
+        from ted_corpus import CorpusStats
+        _worker_corpus = CorpusStats(corpus)
+    _worker_processors.clear()
+
+
+def _render_in_worker(source: Path):
+    return _render_profiled(source, _worker_profile, _worker_processors, _worker_profiling, _worker_corpus)
+
+
+def _chunksize(task_count: int, workers: int) -> int:
+    """Hand each worker a few chunks so IPC is amortized but load stays balanced"""
+    return max(1, task_count // (workers * 4))
+
+
+def run_batch(sources: List[Path], output_dir: str, profile: LearnerProfile,
+              progress: Optional[Callable[[BatchResult], None]] = None,
+              workers: int = 1, cache: Optional[BuildCache] = None,
+              profiling: Optional[str] = None, corpus: Optional[str] = None) -> List[BatchResult]:
+    """Generate a learning package for every source.
+
+    With workers > 1 the CPU-bound generation is fanned out over a process
+    pool; outputs are still written by this process in input order, so the
+    result list and the files on disk do not depend on scheduling. With a
+    cache, sources whose cache_key is unchanged are skipped entirely.
+    profiling="time" (or "memory", adding tracemalloc) records each
+    generated package's stage profile in BatchResult.stages. With a corpus
+    (path of a ted_corpus.CorpusStats database), every source is first added
+    to the corpus, so packages of one run are all scored against the same
+    corpus, and then generated with corpus-relative difficulty and vocabulary.
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    claimed: Dict[Path, Path] = {}
+    tasks = []
+    results = []
+
+    for source in sources:
+        output_path = output_path_for(source, output_dir)
+        duplicate_of = claimed.get(output_path)
+        if duplicate_of is None:
+            claimed[output_path] = source
+        tasks.append((source, output_path, duplicate_of))
+
+    stats = None
+    if corpus is not None:
+        from ted_corpus import CorpusStats
+        stats = CorpusStats(corpus)
+
+    # Resolve cache hits (and update the corpus) up front so only changed inputs reach the workers
+    keys: Dict[Path, str] = {}
+    fresh = set()
+    if cache is not None or stats is not None:
+        cleaners: Dict[str, TEDTranscriptProcessor] = {}
+        for source, output_path, duplicate_of in tasks:
+            if duplicate_of is not None:
+                continue
+            try:
+                with open(source, 'r', encoding='utf-8') as f:
+                    transcript = f.read()
+            except OSError:
+                continue  # reported as an error by the render step
+            subtitle_format = detect_format(transcript, profile.subtitle_format)
+            file_profile = replace(profile, subtitle_format=subtitle_format)
+            if stats is not None:
+                cleaner = cleaners.setdefault(subtitle_format, TEDTranscriptProcessor(file_profile))
+                counts, ranks, _ = cleaner.lemma_counts(cleaner.clean_transcript(transcript))
+                stats.add_talk(str(source), counts, ranks)
+            if cache is not None:
+                keys[source] = cache_key(transcript, file_profile, translation_key(source))
+        if cache is not None:
+            # Only now is the corpus complete; every package of the run is scored against it
+            corpus_fingerprint = stats.fingerprint if stats is not None else ""
+            output_paths = {source: output_path for source, output_path, _ in tasks}
+            for source, key in keys.items():
+                keys[source] = with_corpus(key, corpus_fingerprint)
+                if cache.is_fresh(output_paths[source], keys[source]):
+                    fresh.add(source)
+
+    pending = [source for source, _, duplicate_of in tasks
+               if duplicate_of is None and source not in fresh]
+    if workers > 1 and len(pending) > 1:
+        from concurrent.futures import ProcessPoolExecutor  # only pay for it when fanning out
+        executor = ProcessPoolExecutor(
+            max_workers=min(workers, len(pending)),
+            initializer=_init_worker,
+            initargs=(profile, profiling, corpus)
+        )
+        rendered = executor.map(_render_in_worker, pending,
+                                chunksize=_chunksize(len(pending), workers))
+    else:
+        executor = None
+        processors: Dict[str, TEDTranscriptProcessor] = {}
+        rendered = (_render_profiled(source, profile, processors, profiling, stats) for source in pending)
+
+    try:
+        for source, output_path, duplicate_of in tasks:
+            if duplicate_of is not None:
+                result = BatchResult(
+                    source=str(source),
+                    output=str(output_path),
+                    words=0,
+                    seconds=0.0,
+                    error=f"duplicate output name (already generated from {duplicate_of})"
+                )
+            elif source in fresh:
+                cache.hits += 1
+                result = BatchResult(
+                    source=str(source),
+                    output=str(output_path),
+                    words=0,
+                    seconds=0.0,
+                    cached=True
+                )
+            else:
+                (output, words, seconds, error), stages = next(rendered)
+                if output is not None:
+                    started = time.perf_counter()
+                    try:
+                        with open(output_path, 'w', encoding='utf-8') as f:
+                            f.write(output)
+                    except Exception as e:
+                        error = str(e)
+                    seconds += time.perf_counter() - started
+                if cache is not None:
+                    cache.misses += 1
+                    if error is None and source in keys:
+                        cache.record(output_path, source, keys[source])
+                result = BatchResult(
+                    source=str(source),
+                    output=str(output_path),
+                    words=words,
+                    seconds=seconds,
+                    error=error,
+                    stages=stages
+                )
+            results.append(result)
+            if progress:
+                progress(result)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if stats is not None:
+            stats.close()
+
+    if cache is not None:
+        cache.prune([output_path for _, output_path, _ in tasks])
+        cache.save()
+
+    return results
+
+
+def format_result(result: BatchResult) -> str:
+    """Format a single per-file timing line"""
+    if result.error:
+        return f"  ✗ {result.source}: {result.error}"
+    if result.cached:
+        return f"  = {result.source} -> {result.output} (unchanged, cached)"
+    return (f"  ✓ {result.source} -> {result.output} "
+            f"({result.words} words, {result.seconds * 1000:.1f} ms)")
+
+
+def format_summary(results: List[BatchResult], elapsed: float,
+                   cache: Optional[BuildCache] = None) -> str:
+    """Summarize a batch run with overall throughput"""
+    succeeded = [r for r in results if not r.error and not r.cached]
+    failed = sum(1 for r in results if r.error)
+    words = sum(r.words for r in succeeded)
+    elapsed = max(elapsed, 1e-9)
+
+    lines = [
+        f"Generated {len(succeeded)}/{len(results)} files ({words} words) in {elapsed:.2f} s",
+        f"Throughput: {len(succeeded) / elapsed:.1f} files/s, {words / elapsed:.0f} words/s"
+    ]
+    if succeeded:
+        slowest = max(succeeded, key=lambda r: r.seconds)
+        lines.append(f"Slowest: {slowest.source} ({slowest.seconds * 1000:.1f} ms)")
+    if cache is not None:
+        lines.append(f"Cache: {cache.hits} hits, {cache.misses} misses, "
+                     f"{len(cache.pruned)} stale outputs pruned")
+        for path in cache.pruned:
+            lines.append(f"  - pruned {path}")
+    if failed:
+        lines.append(f"Failed: {failed}")
+    return "\n".join(lines)
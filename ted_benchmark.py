@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for TED English Learning SOP System
+Times each stage of the transcript pipeline on synthetic talks from one
+minute to three hours long, as plain text and as SRT, and reports pyperf-style
+"mean +- std dev" timings with throughput (words/s) and peak memory.
+
+Each stage runs on a fresh processor whose earlier stages (cleaning,
+tokenizing) are already done, so its time is its own; generate_markdown_output
+is timed end to end. Peak memory comes from a separate tracemalloc run so the
+tracing overhead does not skew the timings.
+
+Run the default suite and compare it with the stored baseline:
+    python3 ted_benchmark.py
+A shorter run, saved for later comparison:
+    python3 ted_benchmark.py --durations 1 10 --repeat 5 --output results.json
+Record a new baseline (after an intended performance change):
+    python3 ted_benchmark.py --save-baseline
+"""
+
+import argparse
+import gc
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from itertools import accumulate
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from ted_frequency import load_frequency_index
+from ted_learning_sop import GENERATOR_VERSION, LearnerProfile, TEDTranscriptProcessor
+from ted_tokenizer import tokenize
+
+
+_ROOT = Path(__file__).resolve().parent
+BASELINE = _ROOT / "data" / "benchmarks" / "baseline.json"
+SAMPLE_TRANSCRIPT = _ROOT / "sample_transcript.txt"
+
+SPEAKING_RATE = 150  # words per minute, as TEDTranscriptProcessor.estimate_duration assumes
+DURATIONS = (1, 10, 30, 60, 180)  # minutes
+FORMS = ("plain", "srt")
+STAGES = ("clean_transcript", "tokenize", "segment_by_meaning", "calculate_difficulty",
+          "extract_vocabulary", "extract_phrases", "generate_markdown_output")
+
+_WORDS_PER_CUE = 10  # 4 seconds of speech at SPEAKING_RATE
+
+
+def _srt_time(ms: int) -> str:
+    return f"{ms // 3_600_000:02d}:{ms // 60_000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+
+def _sentences(word_count: int, seed: int) -> Iterable[str]:
+    """Sentences totalling about word_count words.
+
+    Words are drawn from the frequency list with Zipfian weights, so the
+    vocabulary looks like speech (a few words everywhere, a long tail of rare
+    ones); every fifth sentence is taken from the sample talk, which keeps real
+    phrases and discourse markers in the mix for the phrase miner.
+    """
+    rng = random.Random(seed)
+    lemmas = load_frequency_index().lemmas_by_rank()
+    weights = list(accumulate(1.0 / (rank + 2.7) for rank in range(len(lemmas))))
+    with open(SAMPLE_TRANSCRIPT, "r", encoding="utf-8") as f:
+        sample = tokenize(" ".join(f.read().split())).sentences
+
+    written = 0
+    while written < word_count:
+        if sample and rng.random() < 0.2:
+            sentence = sample[rng.randrange(len(sample))]
+        else:
+            words = rng.choices(lemmas, cum_weights=weights, k=rng.randint(6, 24))
+            if len(words) > 12 and rng.random() < 0.5:
+                words[rng.randrange(3, len(words) - 3)] += ","
+            sentence = " ".join(words).capitalize() + rng.choice(".....?!")
+        written += len(sentence.split())
+        yield sentence
+
+
+def synthetic_transcript(minutes: float, form: str = "plain", seed: int = 0) -> str:
+    """A deterministic talk of minutes × SPEAKING_RATE words, as plain text or SRT"""
+    if form not in FORMS:
+        raise ValueError(f"Unknown form: {form} (expected one of {', '.join(FORMS)})")
+    sentences = _sentences(int(minutes * SPEAKING_RATE), seed)
+    if form == "plain":
+        paragraphs, paragraph = [], []
+        for sentence in sentences:
+            paragraph.append(sentence)
+            if len(paragraph) == 6:
+                paragraphs.append(" ".join(paragraph))
+                paragraph = []
+        if paragraph:
+            paragraphs.append(" ".join(paragraph))
+        return "\n\n".join(paragraphs) + "\n"
+
+    words = " ".join(sentences).split()
+    cue_ms = _WORDS_PER_CUE * 60_000 // SPEAKING_RATE
+    cues = []
+    for number, i in enumerate(range(0, len(words), _WORDS_PER_CUE), 1):
+        start = (number - 1) * cue_ms
+        cues.append(f"{number}\n{_srt_time(start)} --> {_srt_time(start + cue_ms - 40)}\n"
+                    f"{' '.join(words[i:i + _WORDS_PER_CUE])}\n")
+    return "\n".join(cues)
+
+
+def _stage_call(stage: str, profile: LearnerProfile, transcript: str) -> Callable[[], object]:
+    """A fresh processor with the stage's inputs prepared; returns the call to time"""
+    processor = TEDTranscriptProcessor(profile)
+    if stage == "clean_transcript":
+        return lambda: processor.clean_transcript(transcript)
+    if stage == "generate_markdown_output":
+        return lambda: processor.generate_markdown_output(transcript)
+    clean = processor.clean_transcript(transcript)
+    if stage == "tokenize":
+        return lambda: tokenize(clean)
+    processor.tokenize(clean)
+    method = getattr(processor, stage)
+    return lambda: method(clean)
+
+
+@dataclass
+class BenchmarkResult:
+    """Timings of one stage on one synthetic transcript"""
+    name: str  # "<form>/<minutes>min/<stage>"
+    words: int
+    times: List[float] = field(default_factory=list)  # seconds per run
+    peak_bytes: int = 0  # traced by tracemalloc during one extra run
+
+    @property
+    def mean(self) -> float:
+        return statistics.fmean(self.times)
+
+    @property
+    def best(self) -> float:
+        return min(self.times)
+
+    @property
+    def stdev(self) -> float:
+        return statistics.stdev(self.times) if len(self.times) > 1 else 0.0
+
+    @property
+    def words_per_second(self) -> float:
+        return self.words / self.mean if self.mean else 0.0
+
+    def to_dict(self) -> Dict:
+        return {"words": self.words, "times": self.times, "mean": self.mean, "best": self.best, "stdev": self.stdev,
+                "words_per_second": self.words_per_second, "peak_bytes": self.peak_bytes}
+
+
+def run_stage(name: str, stage: str, profile: LearnerProfile, transcript: str, words: int,
+              repeat: int = 3) -> BenchmarkResult:
+    """Time stage `repeat` times, then measure its peak memory in one traced run"""
+    result = BenchmarkResult(name, words)
+    for _ in range(repeat):
+        call = _stage_call(stage, profile, transcript)
+        gc.collect()
+        started = time.perf_counter()
+        call()
+        result.times.append(time.perf_counter() - started)
+
+    call = _stage_call(stage, profile, transcript)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        call()
+        result.peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def run_benchmarks(durations: Iterable[float] = DURATIONS, forms: Iterable[str] = FORMS,
+                   stages: Iterable[str] = STAGES, repeat: int = 3,
+                   progress: Optional[Callable[[BenchmarkResult], None]] = None) -> List[BenchmarkResult]:
+    """Benchmark every stage on every (form, duration) transcript"""
+    stages = list(stages)
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+    profile = LearnerProfile(
+        level="B2 (CET-6 / IELTS 6-6.5 / TOEFL 70-90)", vocabulary_size=8000,
+        goals=["listening", "speaking", "vocabulary"], output_language="bilingual",
+        subtitle_format="plain_text", output_style="complete"
+    )
+    # Warm-up: load the frequency index and glossary, compile regexes
+    _stage_call("generate_markdown_output", profile, synthetic_transcript(1))()
+
+    results = []
+    for form in forms:
+        for minutes in durations:
+            transcript = synthetic_transcript(minutes, form)
+            processor = TEDTranscriptProcessor(profile)
+            words = len(processor.tokenize(processor.clean_transcript(transcript)))
+            for stage in stages:
+                result = run_stage(f"{form}/{minutes:g}min/{stage}", stage, profile, transcript, words, repeat)
+                results.append(result)
+                if progress:
+                    progress(result)
+    return results
+
+
+def _format_seconds(seconds: float) -> str:
+    for unit, scale in (("sec", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds * 1e9:.3g} ns"
+
+
+def format_benchmark(result: BenchmarkResult) -> str:
+    return (f"{result.name}: Mean +- std dev: {_format_seconds(result.mean)} +- "
+            f"{_format_seconds(result.stdev)}  ({result.words_per_second:,.0f} words/s, "
+            f"peak {result.peak_bytes / 1e6:.1f} MB)")
+
+
+def results_document(results: List[BenchmarkResult]) -> Dict:
+    return {
+        "metadata": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "generator_version": GENERATOR_VERSION,
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "benchmarks": {result.name: result.to_dict() for result in results},
+    }
+
+
+def save_results(results: List[BenchmarkResult], path) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results_document(results), f, indent=2)
+        f.write("\n")
+
+
+def load_results(path) -> Dict[str, Dict]:
+    """name -> stored benchmark of a results file ({} if there is none)"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("benchmarks", {})
+    except FileNotFoundError:
+        return {}
+
+
+def compare(results: List[BenchmarkResult], baseline: Dict[str, Dict],
+            max_regression: float = 0.5) -> List[Tuple[str, float, bool]]:
+    """(name, best time / baseline best time, regressed) for results with a baseline entry.
+
+    Fastest runs are compared, as timeit recommends: slower runs mostly
+    measure other load on the machine. A result regresses if it is more than
+    max_regression slower than the baseline and the gap is wider than both
+    runs' standard deviations.
+    """
+    rows = []
+    for result in results:
+        stored = baseline.get(result.name)
+        if not stored or not stored.get("best"):
+            continue
+        ratio = result.best / stored["best"]
+        noise = result.stdev + stored.get("stdev", 0.0)
+        regressed = ratio > 1 + max_regression and result.best - stored["best"] > noise
+        rows.append((result.name, ratio, regressed))
+    return rows
+
+
+def format_comparison(name: str, ratio: float, regressed: bool) -> str:
+    change = "no change" if abs(ratio - 1) < 0.05 else \
+        f"{ratio:.2f}x slower" if ratio > 1 else f"{1 / ratio:.2f}x faster"
+    return f"{name}: {change}{'  REGRESSION' if regressed else ''}"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the transcript pipeline on synthetic talks",
+        epilog="Results are compared with data/benchmarks/baseline.json when it exists."
+    )
+    parser.add_argument("--durations", nargs="+", type=float, default=list(DURATIONS),
+                        help="Talk lengths in minutes (default: 1 10 30 60 180)")
+    parser.add_argument("--forms", nargs="+", choices=FORMS, default=list(FORMS),
+                        help="Transcript forms (default: plain srt)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES),
+                        help="Stages to time (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark (default: 3)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", default=str(BASELINE),
+                        help="Baseline results to compare with (default: data/benchmarks/baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store these results as the new baseline instead of comparing")
+    parser.add_argument("--max-regression", type=float, default=0.5,
+                        help="Fail if a benchmark is this much slower than the baseline (default: 0.5)")
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat must be >= 1")
+
+    results = run_benchmarks(args.durations, args.forms, args.stages, args.repeat,
+                             progress=lambda result: print(format_benchmark(result), flush=True))
+    if args.output:
+        save_results(results, args.output)
+    if args.save_baseline:
+        save_results(results, args.baseline)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    rows = compare(results, load_results(args.baseline), args.max_regression)
+    if not rows:
+        print(f"\nNo baseline to compare with ({args.baseline}); record one with --save-baseline")
+        return 0
+    print(f"\nCompared with {args.baseline}:")
+    for row in rows:
+        print(format_comparison(*row))
+    regressions = sum(regressed for _, _, regressed in rows)
+    if regressions:
+        print(f"\n{regressions} benchmark{'s' if regressions != 1 else ''} regressed "
+              f"by more than {args.max_regression:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
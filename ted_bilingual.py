@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Bilingual subtitle alignment for TED English Learning SOP System
+Merges an English and a Chinese cue stream (docs/ted/<id>/en.srt and zh.srt)
+into bilingual segments by time overlap.
+
+Both streams are walked once with two pointers, like the merge step of a
+merge sort: the cue that starts first is taken next and either joins the
+current segment (if it overlaps it enough) or closes it and opens a new one.
+A long Chinese cue spanning three English ones therefore becomes one segment
+with three English lines, and work stays linear in the number of cues, so
+multi-hour files align in a single streaming pass.
+"""
+
+import json
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from ted_subtitles import Cue, iter_cues
+
+
+# Subtitle file names that mark a language: en.srt / zh.srt, or talk.en.srt / talk.zh.srt
+SOURCE_LANGUAGE = "en"
+TRANSLATION_LANGUAGE = "zh"
+_SUBTITLE_SUFFIXES = (".srt", ".vtt")
+
+
+class BilingualSegment(NamedTuple):
+    """English and Chinese text covering the same stretch of the talk"""
+    start_ms: int
+    end_ms: int
+    english: str
+    chinese: str
+
+
+def _join_chinese(parts: List[str]) -> str:
+    """Chinese lines run together, except where both sides of a break are Latin words"""
+    text = parts[0]
+    for part in parts[1:]:
+        if text[-1:].isascii() and text[-1:].isalnum() and part[:1].isascii() and part[:1].isalnum():
+            text += " "
+        text += part
+    return text
+
+
+def align_cues(english: Iterable[Cue], chinese: Iterable[Cue],
+               min_overlap: float = 0.5) -> Iterator[BilingualSegment]:
+    """Group time-ordered English and Chinese cues into bilingual segments.
+
+    A cue joins the current segment if it overlaps the segment by at least
+    min_overlap of the shorter of the two spans; otherwise it starts a new
+    one. Cues without a partner become one-language segments. Only the
+    segment being built is held in memory.
+    """
+    streams = (iter(english), iter(chinese))
+    heads: List[Optional[Cue]] = [next(stream, None) for stream in streams]
+    start = end = 0
+    lines: List[List[str]] = [[], []]
+
+    def segment() -> BilingualSegment:
+        return BilingualSegment(start, end, " ".join(lines[0]),
+                                _join_chinese(lines[1]) if lines[1] else "")
+
+    while heads[0] is not None or heads[1] is not None:
+        # Two pointers: advance whichever stream has the earlier cue
+        side = 0 if heads[1] is None or (heads[0] is not None and heads[0].start_ms <= heads[1].start_ms) else 1
+        cue = heads[side]
+        heads[side] = next(streams[side], None)
+        if not cue.text:
+            continue
+
+        if lines[0] or lines[1]:
+            overlap = min(end, cue.end_ms) - max(start, cue.start_ms)
+            shorter = max(1, min(end - start, cue.end_ms - cue.start_ms))
+            if overlap >= min_overlap * shorter:
+                lines[side].append(cue.text)
+                end = max(end, cue.end_ms)
+                continue
+            yield segment()
+            lines = [[], []]
+        start, end = cue.start_ms, cue.end_ms
+        lines[side].append(cue.text)
+
+    if lines[0] or lines[1]:
+        yield segment()
+
+
+def align_files(english_path, chinese_path, min_overlap: float = 0.5) -> Iterator[BilingualSegment]:
+    """Align two subtitle files, reading both incrementally"""
+    with open(english_path, 'r', encoding='utf-8') as en, open(chinese_path, 'r', encoding='utf-8') as zh:
+        yield from align_cues(iter_cues(en), iter_cues(zh), min_overlap)
+
+
+def translation_path_for(source) -> Optional[Path]:
+    """The Chinese subtitle file next to an English one (en.srt -> zh.srt, talk.en.vtt -> talk.zh.vtt)"""
+    source = Path(source)
+    if source.suffix.lower() not in _SUBTITLE_SUFFIXES:
+        return None
+    stem = source.stem
+    if stem == SOURCE_LANGUAGE:
+        names = [f"{TRANSLATION_LANGUAGE}{suffix}" for suffix in _SUBTITLE_SUFFIXES]
+    elif stem.endswith(f".{SOURCE_LANGUAGE}"):
+        base = stem[:-len(SOURCE_LANGUAGE)]
+        names = [f"{base}{TRANSLATION_LANGUAGE}{suffix}" for suffix in _SUBTITLE_SUFFIXES]
+    else:
+        return None
+    return next((source.with_name(n) for n in names if source.with_name(n).is_file()), None)
+
+
+def is_translation_file(path) -> bool:
+    """True for zh.srt / talk.zh.srt when the matching English file sits beside it"""
+    path = Path(path)
+    if path.suffix.lower() not in _SUBTITLE_SUFFIXES:
+        return False
+    stem = path.stem
+    if stem == TRANSLATION_LANGUAGE:
+        base = SOURCE_LANGUAGE
+    elif stem.endswith(f".{TRANSLATION_LANGUAGE}"):
+        base = stem[:-len(TRANSLATION_LANGUAGE)] + SOURCE_LANGUAGE
+    else:
+        return False
+    return any(path.with_name(base + suffix).is_file() for suffix in _SUBTITLE_SUFFIXES)
+
+
+def load_glossary(path) -> Dict[str, str]:
+    """word -> Chinese meaning from a glossary_zh.json; {} if missing or unreadable"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {str(k).lower(): str(v) for k, v in data.items()} if isinstance(data, dict) else {}
+
+
+class BilingualTranscript:
+    """Aligned segments of one talk, looked up by time.
+
+    Segment times are kept in arrays and the Chinese text in a list, so a
+    multi-hour talk costs a few bytes per segment besides the text itself.
+    ``glossary`` holds the talk's word meanings (glossary_zh.json beside the
+    Chinese subtitles), if any.
+    """
+
+    def __init__(self, segments: Iterable[BilingualSegment], glossary: Optional[Dict[str, str]] = None):
+        self.starts = array('q')
+        self.ends = array('q')
+        self.chinese: List[str] = []
+        for segment in segments:
+            self.starts.append(segment.start_ms)
+            self.ends.append(segment.end_ms)
+            self.chinese.append(segment.chinese)
+        self.glossary = glossary or {}
+
+    def __len__(self) -> int:
+        return len(self.chinese)
+
+    @classmethod
+    def from_text(cls, english: str, chinese: str, glossary: Optional[Dict[str, str]] = None) -> "BilingualTranscript":
+        return cls(align_cues(iter_cues(english.splitlines()), iter_cues(chinese.splitlines())), glossary)
+
+    @classmethod
+    def from_files(cls, english_path, chinese_path, glossary_path=None) -> "BilingualTranscript":
+        """Align two files; glossary_path defaults to glossary_zh.json beside the Chinese file"""
+        if glossary_path is None:
+            glossary_path = Path(chinese_path).with_name("glossary_zh.json")
+        return cls(align_files(english_path, chinese_path), load_glossary(glossary_path))
+
+    def translation_between(self, start_ms: int, end_ms: int) -> str:
+        """Chinese text of the segments from the one playing at start_ms to the one playing at end_ms"""
+        first = max(0, bisect_right(self.starts, start_ms) - 1)
+        if self.ends and self.ends[first] <= start_ms and first + 1 < len(self.ends):
+            first += 1  # start_ms falls in a gap; the next segment is the one being said
+        last = max(first, bisect_right(self.starts, end_ms) - 1)
+        parts = [text for text in self.chinese[first:last + 1] if text]
+        return _join_chinese(parts) if parts else ""
@@ -4,12 +4,502 @@ Command-line interface for TED English Learning SOP System
 """
 
 import argparse
+import os
 import sys
+import time
 from pathlib import Path
-from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+from ted_sections import SECTIONS
+
+# The processor, batch runner and subtitle alignment are imported by the modes
+# that use them, so `--help` and argument errors return without loading them
+
+
+# Map level to description
+LEVEL_DESCRIPTIONS = {
+    "A1": "A1 (Beginner)",
+    "A2": "A2 (Elementary)",
+    "B1": "B1 (Intermediate / CET-4)",
+    "B2": "B2 (Upper-Intermediate / CET-6 / IELTS 6-6.5 / TOEFL 70-90)",
+    "C1": "C1 (Advanced / IELTS 7-8 / TOEFL 90-110)",
+    "C2": "C2 (Expert / TOEFL 110+)"
+}
+
+
+def add_profile_arguments(parser):
+    """Learner profile options shared by the single-file, batch and work modes"""
+    parser.add_argument(
+        "--level",
+        default="B2",
+        choices=["A1", "A2", "B1", "B2", "C1", "C2"],
+        help="Learner's CEFR level (default: B2)"
+    )
+    
+    parser.add_argument(
+        "--vocab",
+        type=int,
+        default=8000,
+        help="Learner's vocabulary size (default: 8000)"
+    )
+    
+    parser.add_argument(
+        "--goals",
+        nargs="+",
+        default=["listening", "speaking", "vocabulary"],
+        choices=["listening", "speaking", "vocabulary", "grammar", "writing", "presentation"],
+        help="Learning goals (default: listening speaking vocabulary)"
+    )
+    
+    parser.add_argument(
+        "--lang",
+        default="bilingual",
+        choices=["bilingual", "english_only"],
+        help="Output language preference (default: bilingual)"
+    )
+    
+    parser.add_argument(
+        "--format",
+        default="auto",
+        choices=["auto", "srt", "plain_text"],
+        help="Input subtitle format (default: auto-detect)"
+    )
+    
+    parser.add_argument(
+        "--style",
+        default="complete",
+        choices=["complete", "simplified"],
+        help="Output style (default: complete)"
+    )
+    
+    parser.add_argument(
+        "--sections",
+        nargs="+",
+        choices=list(SECTIONS),
+        help="Only build these sections (overrides --style; the parameter echo is always included)"
+    )
+    
+    parser.add_argument(
+        "--known-words",
+        help="Learner's known-word model (see ted_known_words.py) or word list, one word per line; "
+             "vocabulary extraction skips these words"
+    )
+
+
+def profile_from_args(args, subtitle_format=None):
+    from ted_learning_sop import LearnerProfile
+    known_words = None
+    if args.known_words:
+        from ted_known_words import KnownWords
+        try:
+            known_words = KnownWords.load(args.known_words)
+        except (OSError, ValueError) as e:
+            print(f"Error: Cannot load known words: {e}", file=sys.stderr)
+            sys.exit(1)
+    return LearnerProfile(
+        level=LEVEL_DESCRIPTIONS[args.level],
+        vocabulary_size=args.vocab,
+        goals=args.goals,
+        output_language=args.lang,
+        subtitle_format=subtitle_format or args.format,
+        output_style=args.style,
+        sections=args.sections,
+        known_words=known_words
+    )
+
+
+def emit_profile(args, profiler, log=sys.stdout, **fields):
+    """Print (or write to --profile-output) a StageProfiler as a table or JSON"""
+    text = profiler.to_json(**fields) if args.profile == "json" else profiler.format_table("Stage profile:")
+    if args.profile_output:
+        with open(args.profile_output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+        print(f"Profile written to {args.profile_output}", file=log)
+    else:
+        print(text, file=log)
+
+
+def profiling_mode(args):
+    """The run_batch profiling argument for --profile/--profile-memory"""
+    if not args.profile:
+        return None
+    return "memory" if args.profile_memory else "time"
+
+
+def run_batch_mode(args, profile):
+    """Process every transcript under --input-dir with a single processor"""
+    from ted_batch import BuildCache, collect_transcripts, run_batch, format_result, format_summary
+
+    input_dir = Path(args.input_dir)
+    if not input_dir.is_dir():
+        print(f"Error: Input directory not found: {args.input_dir}", file=sys.stderr)
+        sys.exit(1)
+
+    sources = collect_transcripts(args.input_dir)
+    if not sources:
+        print(f"No transcripts found in {args.input_dir}")
+        return
+
+    print(f"Processing {len(sources)} transcripts from {args.input_dir} -> {args.output_dir} "
+          f"({args.workers} worker{'s' if args.workers != 1 else ''})")
+    cache = None if args.no_cache else BuildCache(args.output_dir)
+    started = time.perf_counter()
+    results = run_batch(
+        sources, args.output_dir, profile,
+        progress=lambda result: print(format_result(result)),
+        workers=args.workers,
+        cache=cache,
+        profiling=profiling_mode(args),
+        corpus=args.corpus
+    )
+    print()
+    print(format_summary(results, time.perf_counter() - started, cache))
+    
+    if args.profile:
+        from ted_profiling import StageProfiler
+        # Stage totals over every generated package; JSON also lists each file's stages
+        total = StageProfiler(trace_memory=args.profile_memory)
+        for result in results:
+            if result.stages:
+                total.merge(result.stages)
+        print()
+        emit_profile(args, total, files=[{"source": r.source, "stages": r.stages}
+                                         for r in results if r.stages])
+
+    if any(r.error for r in results):
+        sys.exit(1)
+
+
+def run_work_mode(argv):
+    """`ted_cli.py work`: drain the pending materials of a SQLite library"""
+    from ted_batch import format_summary
+    from ted_worker import WorkOptions, lease_report, run_workers
+
+    parser = argparse.ArgumentParser(
+        prog="ted_cli.py work",
+        description="Claim pending materials from a SQLite material library, generate their "
+                    "learning packages and mark them processed. Safe to run from several "
+                    "processes or machines sharing the database.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  # Drain the library with one worker per CPU core
+  python3 ted_cli.py work --library material_library.db --workers 0
+
+  Each material is leased for --lease seconds and the lease is renewed by a
+  heartbeat while it is processed. If a worker dies, its lease expires and
+  another worker retries the material, up to --max-attempts times.
+  Transcripts are read from the material's transcript_file, or found in
+  --transcripts-dir as <url-slug>.txt/.srt/.vtt or <id>.txt/.srt/.vtt.
+        """
+    )
+    parser.add_argument(
+        "--library",
+        default="material_library.db",
+        help="SQLite material library (default: material_library.db)"
+    )
+    parser.add_argument(
+        "--transcripts-dir",
+        default="data/transcripts",
+        help="Directory searched for transcripts (default: data/transcripts)"
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="docs",
+        help="Directory for generated packages (default: docs)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes (0 = one per CPU core, default: 1)"
+    )
+    parser.add_argument(
+        "--lease",
+        type=float,
+        default=300.0,
+        help="Lease length in seconds, renewed every third of it (default: 300)"
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        help="Give up on a material after this many failed or abandoned attempts (default: 3)"
+    )
+    parser.add_argument(
+        "--retry-delay",
+        type=float,
+        default=60.0,
+        help="Seconds before a failed material may be claimed again (default: 60)"
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        help="Stop each worker after this many materials (default: drain the library)"
+    )
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.workers < 0:
+        parser.error("--workers must be >= 0")
+    if args.workers == 0:
+        args.workers = os.cpu_count() or 1
+    if args.lease <= 0:
+        parser.error("--lease must be > 0")
+    if not Path(args.library).exists():
+        print(f"Error: Library not found: {args.library}", file=sys.stderr)
+        sys.exit(1)
+
+    options = WorkOptions(
+        library_file=args.library,
+        transcripts_dir=args.transcripts_dir,
+        output_dir=args.output_dir,
+        profile=profile_from_args(args),
+        lease_seconds=args.lease,
+        max_attempts=args.max_attempts,
+        retry_delay=args.retry_delay,
+        limit=args.limit
+    )
+    print(f"Working on {args.library} -> {args.output_dir} "
+          f"({args.workers} worker{'s' if args.workers != 1 else ''})", flush=True)
+    started = time.perf_counter()
+    try:
+        results = run_workers(options, args.workers)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    print()
+    print(format_summary(results, time.perf_counter() - started))
+    print(lease_report(args.library, args.max_attempts))
+
+    if any(r.error for r in results):
+        sys.exit(1)
+
+
+def run_fetch_mode(argv):
+    """`ted_cli.py fetch`: download transcripts for the library's pending materials"""
+    import asyncio
+    from ted_fetcher import TranscriptFetcher, format_fetch_result
+    from ted_material_library import MaterialLibrary
+
+    parser = argparse.ArgumentParser(
+        prog="ted_cli.py fetch",
+        description="Download transcripts for the unprocessed materials of a material library "
+                    "and record them as the materials' transcript_file.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  # Fetch transcripts, then generate packages for them
+  python3 ted_cli.py fetch --library material_library.db
+  python3 ted_cli.py work --library material_library.db
+
+  Connections are kept alive and shared (--concurrency in total, --per-host per
+  host), each host gets at most --rate requests per second, and failures are
+  retried --retries times with exponential backoff. Transcripts fetched before
+  are revalidated with ETag / Last-Modified and only rewritten if they changed.
+        """
+    )
+    parser.add_argument(
+        "--library",
+        default="material_library.db",
+        help="Material library, .json or .db (default: material_library.db)"
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="data/transcripts",
+        help="Directory for downloaded transcripts (default: data/transcripts)"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Connections open at once (default: 8)"
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        default=4,
+        help="Connections open at once to one host (default: 4)"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=2.0,
+        help="Requests per second per host, 0 for no limit (default: 2)"
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="Retries after a connection error, timeout, 429 or 5xx (default: 3)"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=30.0,
+        help="Seconds to wait for a connection or response (default: 30)"
+    )
+    args = parser.parse_args(argv)
+
+    if args.concurrency < 1 or args.per_host < 1:
+        parser.error("--concurrency and --per-host must be >= 1")
+    if args.retries < 0:
+        parser.error("--retries must be >= 0")
+    if not Path(args.library).exists():
+        print(f"Error: Library not found: {args.library}", file=sys.stderr)
+        sys.exit(1)
+
+    library = MaterialLibrary(args.library)
+    try:
+        pending = library.get_unprocessed_materials()
+        print(f"Fetching {len(pending)} transcripts -> {args.output_dir}", flush=True)
+        fetcher = TranscriptFetcher(
+            library, args.output_dir,
+            concurrency=args.concurrency, per_host=args.per_host, rate=args.rate,
+            retries=args.retries, timeout=args.timeout
+        )
+        started = time.perf_counter()
+        results = asyncio.run(fetcher.fetch_all(pending, lambda r: print(format_fetch_result(r), flush=True)))
+        elapsed = max(time.perf_counter() - started, 1e-9)
+    finally:
+        library.close()
+
+    counts = {status: sum(1 for r in results if r.status == status)
+              for status in ("fetched", "not_modified", "failed")}
+    print()
+    print(f"Fetched {counts['fetched']}, not modified {counts['not_modified']}, "
+          f"failed {counts['failed']} in {elapsed:.2f} s")
+    if fetcher.pool is not None:
+        print(f"HTTP: {fetcher.pool.requests} requests over "
+              f"{fetcher.pool.connections_opened} connections")
+    if counts['failed']:
+        sys.exit(1)
+
+
+def run_recommend_mode(argv):
+    """`ted_cli.py recommend`: the library's processed talks that best suit a learner"""
+    from ted_material_library import MaterialLibrary
+
+    parser = argparse.ArgumentParser(
+        prog="ted_cli.py recommend",
+        description="Rank the processed materials of a library by predicted vocabulary "
+                    "coverage and difficulty fit for a learner.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  # The ten best talks for an intermediate learner
+  python3 ted_cli.py recommend --library material_library.db --level B1 --vocab 4000
+
+  # Use the words the learner actually knows (see ted_known_words.py)
+  python3 ted_cli.py recommend --library material_library.db --level B1 --known-words learner.known
+
+  Lexical profiles of new or changed transcripts are computed first and kept
+  in <library>.profiles.db, so later runs only rank.
+        """
+    )
+    parser.add_argument(
+        "--library",
+        default="material_library.db",
+        help="Material library, .json or .db (default: material_library.db)"
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=10,
+        help="Number of talks to recommend (default: 10)"
+    )
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.limit < 1:
+        parser.error("--limit must be >= 1")
+    if not Path(args.library).exists():
+        print(f"Error: Library not found: {args.library}", file=sys.stderr)
+        sys.exit(1)
+    profile = profile_from_args(args)
+    library = MaterialLibrary(args.library)
+    try:
+        recommendations = library.recommend(profile, args.limit)
+    finally:
+        library.close()
+    if not recommendations:
+        print("No processed materials to recommend.")
+        return
+    print(f"{'Fit':>5} {'Coverage':>9}  Material")
+    for material, recommendation in recommendations:
+        print(f"{recommendation.fit:>5.1f} {recommendation.coverage:>9.1%}  "
+              f"[{material['id']}] {material['title'] or material['url']}")
+
+
+def run_anki_mode(argv):
+    """`ted_cli.py anki`: export the Anki cards of every processed material in a library"""
+    from ted_anki import DEFAULT_DECK, export_cards, library_cards
+    from ted_material_library import MaterialLibrary
+
+    parser = argparse.ArgumentParser(
+        prog="ted_cli.py anki",
+        description="Export the review-kit Anki cards of every processed material in a library "
+                    "as one Anki package (.apkg) or CSV file.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  # One deck for the whole library
+  python3 ted_cli.py anki --library material_library.db --output ted.apkg
+
+  # CSV for Anki's File > Import
+  python3 ted_cli.py anki --library material_library.db --output ted.csv
+
+  Every note has a stable GUID (word cards by lemma, fill-in cards by lemma
+  and sentence), so a word shared by several talks is exported once and
+  importing a newer export updates the existing notes. Talks are processed
+  one at a time and cards are streamed, so memory stays flat.
+        """
+    )
+    parser.add_argument(
+        "--library",
+        default="material_library.db",
+        help="Material library, .json or .db (default: material_library.db)"
+    )
+    parser.add_argument(
+        "--output",
+        required=True,
+        help="Output file: .apkg for an Anki package, CSV otherwise ('-' for stdout)"
+    )
+    parser.add_argument(
+        "--deck",
+        default=DEFAULT_DECK,
+        help=f"Deck name in the .apkg (default: {DEFAULT_DECK})"
+    )
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if not Path(args.library).exists():
+        print(f"Error: Library not found: {args.library}", file=sys.stderr)
+        sys.exit(1)
+    log = sys.stderr if args.output == "-" else sys.stdout
+    library = MaterialLibrary(args.library)
+    started = time.perf_counter()
+    try:
+        notes = export_cards(library_cards(library, profile_from_args(args),
+                                           lambda m: print(f"  [{m['id']}] {m['title'] or m['url']}", file=log)),
+                             args.output, args.deck)
+    finally:
+        library.close()
+    print(f"{notes} notes written to {args.output} in {time.perf_counter() - started:.2f} s", file=log)
+
+
+# Subcommands, dispatched on the first argument
+SUBCOMMANDS = {
+    "work": run_work_mode,
+    "fetch": run_fetch_mode,
+    "recommend": run_recommend_mode,
+    "anki": run_anki_mode,
+}
 
 
 def main():
+    if sys.argv[1:2] and sys.argv[1] in SUBCOMMANDS:
+        SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+    
     parser = argparse.ArgumentParser(
         description="Generate comprehensive English learning materials from TED transcripts",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -27,6 +517,44 @@ Examples:
   # English-only output
   python3 ted_cli.py -i transcript.txt -o output.md --lang english_only
 
+  # Stream the package to stdout (status messages go to stderr)
+  python3 ted_cli.py -i transcript.txt -o - | less
+
+  # Bilingual package from aligned English and Chinese subtitles
+  python3 ted_cli.py -i docs/ted/gN9dlisaQVM/en.srt -o output.md --translation docs/ted/gN9dlisaQVM/zh.srt
+
+  # Only the vocabulary table and listening exercises
+  python3 ted_cli.py -i transcript.txt -o output.md --sections vocabulary listening
+
+  --style simplified keeps the overview and vocabulary plus the sections that
+  serve --goals; --style complete (default) builds all ten sections.
+
+  # Which stages are slow? Per-stage wall/CPU time (add --profile-memory for tracemalloc)
+  python3 ted_cli.py -i transcript.txt -o output.md --profile
+
+  # Batch mode: every transcript in a directory, one process
+  python3 ted_cli.py --input-dir data/transcripts --output-dir docs
+
+  # Batch mode spread over all CPU cores
+  python3 ted_cli.py --input-dir data/transcripts --output-dir docs --workers 0
+
+  Batch mode keeps an incremental build cache in <output-dir>/.ted_build_cache.json:
+  unchanged transcripts are skipped and packages whose transcript was removed
+  are pruned. Use --no-cache to force a full rebuild.
+
+  # Download transcripts for pending library materials (see: ted_cli.py fetch -h)
+  python3 ted_cli.py fetch --library material_library.db
+
+  # Drain the pending materials of a SQLite library (see: ted_cli.py work -h)
+  python3 ted_cli.py work --library material_library.db --workers 4
+
+  # Which processed talks suit a learner best? (see: ted_cli.py recommend -h)
+  python3 ted_cli.py recommend --library material_library.db --level B1 --vocab 4000
+
+  # Anki cards: for one talk, or for the whole library (see: ted_cli.py anki -h)
+  python3 ted_cli.py -i transcript.txt -o output.md --anki cards.apkg
+  python3 ted_cli.py anki --library material_library.db --output ted.apkg
+
 Learner Levels:
   A1-A2: Beginner (vocab: 1000-2000)
   B1: Intermediate / CET-4 (vocab: 4000-6000)
@@ -36,65 +564,104 @@ Learner Levels:
         """
     )
     
-    # Required arguments
+    # Input / output (single file or batch directory)
     parser.add_argument(
         "-i", "--input",
-        required=True,
         help="Input transcript file (plain text or SRT format)"
     )
     
     parser.add_argument(
         "-o", "--output",
-        required=True,
-        help="Output markdown file for learning package"
+        help="Output markdown file for learning package ('-' for stdout)"
     )
     
-    # Optional arguments
     parser.add_argument(
-        "--level",
-        default="B2",
-        choices=["A1", "A2", "B1", "B2", "C1", "C2"],
-        help="Learner's CEFR level (default: B2)"
+        "--translation",
+        help="Chinese subtitles (SRT/VTT) aligned with an SRT/VTT input by time "
+             "(default: zh.srt beside en.srt, or talk.zh.srt beside talk.en.srt)"
     )
     
     parser.add_argument(
-        "--vocab",
+        "--anki",
+        help="Also export the package's Anki cards to this file: .apkg for an Anki package, "
+             "CSV otherwise"
+    )
+    
+    parser.add_argument(
+        "--input-dir",
+        help="Batch mode: process every .txt/.srt/.vtt transcript under this directory "
+             "(zh.srt files beside en.srt are used as their translations)"
+    )
+    
+    parser.add_argument(
+        "--output-dir",
+        default="docs",
+        help="Batch mode: directory for generated packages (default: docs)"
+    )
+    
+    # Learner profile
+    add_profile_arguments(parser)
+    
+    parser.add_argument(
+        "--workers",
         type=int,
-        default=8000,
-        help="Learner's vocabulary size (default: 8000)"
+        default=1,
+        help="Batch mode: worker processes for package generation (0 = one per CPU core, default: 1)"
     )
     
     parser.add_argument(
-        "--goals",
-        nargs="+",
-        default=["listening", "speaking", "vocabulary"],
-        choices=["listening", "speaking", "vocabulary", "grammar", "writing", "presentation"],
-        help="Learning goals (default: listening speaking vocabulary)"
+        "--no-cache",
+        action="store_true",
+        help="Batch mode: regenerate every package, ignoring the incremental build cache"
     )
     
     parser.add_argument(
-        "--lang",
-        default="bilingual",
-        choices=["bilingual", "english_only"],
-        help="Output language preference (default: bilingual)"
+        "--corpus",
+        help="Corpus statistics database (created if missing): each talk is added to it, and "
+             "difficulty and vocabulary are judged relative to the corpus (see ted_corpus.py)"
     )
     
+    # Stage profiling
     parser.add_argument(
-        "--format",
-        default="auto",
-        choices=["auto", "srt", "plain_text"],
-        help="Input subtitle format (default: auto-detect)"
+        "--profile",
+        nargs="?",
+        const="table",
+        choices=["table", "json"],
+        help="Time each stage (clean, tokenize, extract.*, generate.*, render.*) and print "
+             "a table, or JSON for aggregating a batch run (default: table)"
     )
     
     parser.add_argument(
-        "--style",
-        default="complete",
-        choices=["complete", "simplified"],
-        help="Output style (default: complete)"
+        "--profile-memory",
+        action="store_true",
+        help="With --profile: also trace allocations per stage with tracemalloc (slower)"
+    )
+    
+    parser.add_argument(
+        "--profile-output",
+        help="With --profile: write the profile to this file instead of the console"
     )
     
     args = parser.parse_args()
     
+    if args.workers < 0:
+        parser.error("--workers must be >= 0")
+    if args.workers == 0:
+        args.workers = os.cpu_count() or 1
+    if (args.profile_memory or args.profile_output) and not args.profile:
+        parser.error("--profile-memory and --profile-output need --profile")
+    
+    if args.input_dir:
+        if args.input or args.output or args.translation or args.anki:
+            parser.error("--input-dir cannot be combined with -i/--input, -o/--output, --translation "
+                         "or --anki (see: ted_cli.py anki -h)")
+        profile = profile_from_args(args)
+        run_batch_mode(args, profile)
+        return
+    
+    if not args.input or not args.output:
+        parser.error("-i/--input and -o/--output are required (or use --input-dir)")
+    
     # Validate input file
     input_path = Path(args.input)
     if not input_path.exists():
@@ -109,60 +676,87 @@ Learner Levels:
         print(f"Error reading input file: {e}", file=sys.stderr)
         sys.exit(1)
     
-    # Map level to description
-    level_descriptions = {
-        "A1": "A1 (Beginner)",
-        "A2": "A2 (Elementary)",
-        "B1": "B1 (Intermediate / CET-4)",
-        "B2": "B2 (Upper-Intermediate / CET-6 / IELTS 6-6.5 / TOEFL 70-90)",
-        "C1": "C1 (Advanced / IELTS 7-8 / TOEFL 90-110)",
-        "C2": "C2 (Expert / TOEFL 110+)"
-    }
-    
+    from ted_batch import detect_format
+    from ted_bilingual import BilingualTranscript, translation_path_for
+    from ted_learning_sop import TEDTranscriptProcessor
+
     # Auto-detect format if needed
-    subtitle_format = args.format
-    if subtitle_format == "auto":
-        # Simple heuristic: if contains SRT timestamp pattern, it's SRT
-        if "-->" in transcript and any(c.isdigit() for c in transcript[:100]):
-            subtitle_format = "srt"
-        else:
-            subtitle_format = "plain_text"
+    subtitle_format = detect_format(transcript, args.format)
+    
+    translation_path = Path(args.translation) if args.translation else translation_path_for(input_path)
+    bilingual = None
+    if translation_path is not None:
+        if not translation_path.exists():
+            print(f"Error: Translation file not found: {translation_path}", file=sys.stderr)
+            sys.exit(1)
+        bilingual = BilingualTranscript.from_files(input_path, translation_path)
     
     # Create learner profile
-    profile = LearnerProfile(
-        level=level_descriptions[args.level],
-        vocabulary_size=args.vocab,
-        goals=args.goals,
-        output_language=args.lang,
-        subtitle_format=subtitle_format,
-        output_style=args.style
-    )
+    profile = profile_from_args(args, subtitle_format)
+    
+    # Status goes to stderr when the package itself is streamed to stdout
+    to_stdout = args.output == "-"
+    log = sys.stderr if to_stdout else sys.stdout
     
     # Process transcript
-    print(f"Processing transcript: {args.input}")
-    print(f"Learner level: {args.level}")
-    print(f"Vocabulary size: {args.vocab}")
-    print(f"Goals: {', '.join(args.goals)}")
-    print(f"Generating learning package...")
+    print(f"Processing transcript: {args.input}", file=log)
+    print(f"Learner level: {args.level}", file=log)
+    print(f"Vocabulary size: {args.vocab}", file=log)
+    print(f"Goals: {', '.join(args.goals)}", file=log)
+    if bilingual is not None:
+        print(f"Translation: {translation_path} ({len(bilingual)} aligned segments)", file=log)
+    print(f"Generating learning package...", file=log)
     
+    output_path = Path(args.output)
     try:
         processor = TEDTranscriptProcessor(profile)
-        output = processor.generate_markdown_output(transcript)
+        if args.corpus:
+            from ted_corpus import CorpusStats
+            processor.corpus = CorpusStats(args.corpus)
+            processor.corpus.add_transcript(str(input_path), transcript, processor)
+        profiler = None
+        if args.profile:
+            from ted_profiling import StageProfiler
+            profiler = StageProfiler(trace_memory=args.profile_memory)
+            processor.hooks.append(profiler)
         
-        # Write output
-        output_path = Path(args.output)
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(output)
+        # Stream sections straight to the destination as they are built
+        if to_stdout:
+            processor.write_markdown(transcript, sys.stdout, translation=bilingual)
+            sys.stdout.flush()
+        else:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                processor.write_markdown(transcript, f, translation=bilingual)
         
-        print(f"\n✓ Learning package generated successfully!")
-        print(f"  Output: {args.output}")
-        print(f"  Duration: {processor.duration:.1f} minutes")
-        print(f"  Difficulty: {processor.difficulty_score}/100")
+        print(f"\n✓ Learning package generated successfully!", file=log)
+        print(f"  Output: {'<stdout>' if to_stdout else args.output}", file=log)
+        print(f"  Duration: {processor.duration:.1f} minutes", file=log)
+        print(f"  Difficulty: {processor.difficulty_score}/100", file=log)
+        if processor.corpus is not None:
+            print(f"  Corpus: {len(processor.corpus)} talks ({args.corpus})", file=log)
+        if profiler is not None:
+            print(file=log)
+            emit_profile(args, profiler, log, source=args.input)
         
+    except BrokenPipeError:
+        # The reader (e.g. `| head`) went away; silence the flush at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
     except Exception as e:
+        if not to_stdout and output_path.exists():
+            output_path.unlink()  # don't leave a half-written package behind
         print(f"Error generating learning package: {e}", file=sys.stderr)
         sys.exit(1)
-
+    
+    # A separate step: a failed export must not cost the package just written
+    if args.anki:
+        try:
+            from ted_anki import export_cards, talk_cards
+            notes = export_cards(talk_cards(processor, transcript, translation=bilingual), args.anki)
+            print(f"  Anki: {notes} notes ({args.anki})", file=log)
+        except Exception as e:
+            print(f"Error exporting Anki cards: {e}", file=sys.stderr)
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()
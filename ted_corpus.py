@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Corpus statistics for TED English Learning SOP System
+A persistent store of what the processed talks have in common, so difficulty
+and vocabulary can be judged against the rest of the corpus instead of each
+talk in isolation:
+
+    lemmas  document frequency and total count of every content-word lemma
+    talks   per-talk lemma-count vector (packed), token count and lexical
+            score (mean log2 general-English rank of the talk's words)
+
+The store is a SQLite database in WAL mode (several batch workers can share
+it). Adding a talk updates the document frequencies by its own lemmas only,
+and re-adding an unchanged talk is a no-op, so the corpus grows incrementally
+as transcripts are processed. Queries cost O(talk length): TF-IDF looks up
+the talk's lemmas only, and a score's percentile rank is a binary search in
+the sorted talk scores, cached until another writer changes the database.
+
+    python3 ted_corpus.py add corpus.db data/transcripts/*.srt
+    python3 ted_corpus.py info corpus.db
+    python3 ted_corpus.py terms corpus.db data/transcripts/talk.srt
+"""
+
+import hashlib
+import math
+import sqlite3
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ted_frequency import load_frequency_index
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lemmas (
+    id INTEGER PRIMARY KEY,
+    lemma TEXT NOT NULL UNIQUE,
+    df INTEGER NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS talks (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    digest TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    score REAL NOT NULL,
+    vector BLOB NOT NULL
+);
+"""
+
+# Talks a corpus needs before its percentiles mean anything
+MIN_TALKS = 5
+
+# SQLite's default limit on host parameters is 999
+_CHUNK = 500
+
+
+def lexical_score(counts: Dict[str, int], ranks: Dict[str, Optional[int]]) -> float:
+    """Token-weighted mean log2 frequency rank of a talk's content lemmas.
+
+    Intrinsic to the talk (it does not depend on the corpus), so scores stay
+    comparable as the corpus grows; unlisted words count as twice the
+    frequency list's length.
+    """
+    unlisted = len(load_frequency_index()) * 2
+    total = sum(counts.values())
+    if not total:
+        return 0.0
+    return sum(n * math.log2(ranks.get(lemma) or unlisted) for lemma, n in counts.items()) / total
+
+
+def _digest(counts: Dict[str, int]) -> str:
+    digest = hashlib.sha256()
+    for lemma in sorted(counts):
+        digest.update(f"{lemma}\t{counts[lemma]}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _pack(pairs: Iterable[Tuple[int, int]]) -> bytes:
+    """(lemma id, count) pairs as one flat uint32 array"""
+    vector = array("I")
+    for lemma_id, n in sorted(pairs):
+        vector.append(lemma_id)
+        vector.append(n)
+    return vector.tobytes()
+
+
+def _unpack(blob: bytes) -> List[Tuple[int, int]]:
+    vector = array("I")
+    vector.frombytes(blob)
+    return list(zip(vector[0::2], vector[1::2]))
+
+
+class CorpusStats:
+    """Document frequencies, lemma counts and talk vectors in a SQLite file"""
+
+    lexical_score = staticmethod(lexical_score)
+
+    def __init__(self, path, timeout: float = 30.0, min_talks: int = MIN_TALKS):
+        self.path = Path(path)
+        self.min_talks = min_talks
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode; transactions are opened explicitly in _transaction
+        self.connection = sqlite3.connect(str(self.path), timeout=timeout, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_SCHEMA)
+        # Sorted talk scores for percentile ranks, valid while data_version is unchanged
+        self._scores: Optional[array] = None
+        self._scores_version: Optional[int] = None
+
+    def close(self):
+        self.connection.close()
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, rolled back on error"""
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+        self._scores = None
+
+    def _sorted_scores(self) -> array:
+        # data_version changes whenever another connection commits
+        version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        if self._scores is None or version != self._scores_version:
+            self._scores = array("d", (row[0] for row in
+                                       self.connection.execute("SELECT score FROM talks ORDER BY score")))
+            self._scores_version = version
+        return self._scores
+
+    def __len__(self) -> int:
+        return len(self._sorted_scores())
+
+    def __contains__(self, key: str) -> bool:
+        return self.connection.execute("SELECT 1 FROM talks WHERE key = ?", (key,)).fetchone() is not None
+
+    # -- updates -------------------------------------------------------------
+
+    def _subtract(self, connection, vector: bytes):
+        connection.executemany("UPDATE lemmas SET df = df - 1, count = count - ? WHERE id = ?",
+                               ((n, lemma_id) for lemma_id, n in _unpack(vector)))
+
+    def add_talk(self, key: str, counts: Dict[str, int], ranks: Dict[str, Optional[int]]) -> bool:
+        """Add or replace a talk's lemma counts; False if it is stored unchanged.
+
+        A replaced talk's old counts are taken out of the document
+        frequencies first, in the same transaction.
+        """
+        digest = _digest(counts)
+        with self._transaction() as connection:
+            row = connection.execute("SELECT digest, vector FROM talks WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                if row[0] == digest:
+                    return False
+                self._subtract(connection, row[1])
+            connection.executemany(
+                "INSERT INTO lemmas (lemma, df, count) VALUES (?, 1, ?) "
+                "ON CONFLICT (lemma) DO UPDATE SET df = df + 1, count = count + excluded.count",
+                counts.items()
+            )
+            ids = self._lemma_ids(connection, list(counts))
+            vector = _pack((ids[lemma], n) for lemma, n in counts.items())
+            connection.execute(
+                "INSERT INTO talks (key, digest, tokens, score, vector) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET digest = excluded.digest, tokens = excluded.tokens, "
+                "score = excluded.score, vector = excluded.vector",
+                (key, digest, sum(counts.values()), lexical_score(counts, ranks), vector)
+            )
+        return True
+
+    def add_transcript(self, key: str, transcript: str, processor) -> bool:
+        """Clean and count a transcript with processor (a TEDTranscriptProcessor) and add it"""
+        counts, ranks, _ = processor.lemma_counts(processor.clean_transcript(transcript))
+        return self.add_talk(key, counts, ranks)
+
+    def remove_talk(self, key: str) -> bool:
+        with self._transaction() as connection:
+            row = connection.execute("SELECT vector FROM talks WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False
+            self._subtract(connection, row[0])
+            connection.execute("DELETE FROM talks WHERE key = ?", (key,))
+        return True
+
+    # -- queries -------------------------------------------------------------
+
+    @staticmethod
+    def _lemma_ids(connection, lemmas: List[str]) -> Dict[str, int]:
+        ids = {}
+        for i in range(0, len(lemmas), _CHUNK):
+            chunk = lemmas[i:i + _CHUNK]
+            ids.update(connection.execute(
+                f"SELECT lemma, id FROM lemmas WHERE lemma IN ({', '.join('?' * len(chunk))})", chunk))
+        return ids
+
+    def document_frequencies(self, lemmas: Iterable[str]) -> Dict[str, int]:
+        """lemma -> number of talks using it (0 for lemmas the corpus has not seen)"""
+        lemmas = list(lemmas)
+        found: Dict[str, int] = {}
+        for i in range(0, len(lemmas), _CHUNK):
+            chunk = lemmas[i:i + _CHUNK]
+            found.update(self.connection.execute(
+                f"SELECT lemma, df FROM lemmas WHERE lemma IN ({', '.join('?' * len(chunk))})", chunk))
+        return {lemma: found.get(lemma, 0) for lemma in lemmas}
+
+    def lemma_count(self, lemma: str) -> int:
+        """Occurrences of lemma across all talks"""
+        row = self.connection.execute("SELECT count FROM lemmas WHERE lemma = ?", (lemma,)).fetchone()
+        return row[0] if row else 0
+
+    def idf(self, lemmas: Iterable[str]) -> Dict[str, float]:
+        """Smoothed inverse document frequency, log((1 + N) / (1 + df)) + 1"""
+        talks = len(self)
+        return {lemma: math.log((1 + talks) / (1 + df)) + 1
+                for lemma, df in self.document_frequencies(lemmas).items()}
+
+    def tfidf(self, counts: Dict[str, int]) -> Dict[str, float]:
+        """TF-IDF weight of each lemma of a talk (term frequency relative to the talk's length)"""
+        total = sum(counts.values()) or 1
+        return {lemma: counts[lemma] / total * weight for lemma, weight in self.idf(counts).items()}
+
+    def percentile(self, score: float) -> float:
+        """Percentile rank (0-100) of a lexical score among the corpus talks (ties count half)"""
+        scores = self._sorted_scores()
+        if not scores:
+            return 50.0
+        below, upto = bisect_left(scores, score), bisect_right(scores, score)
+        return 100.0 * (below + (upto - below) / 2) / len(scores)
+
+    def talk_counts(self, key: str) -> Optional[Dict[str, int]]:
+        """The stored lemma counts of a talk (None if it is not in the corpus)"""
+        row = self.connection.execute("SELECT vector FROM talks WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        pairs = _unpack(row[0])
+        names = {}
+        ids = [lemma_id for lemma_id, _ in pairs]
+        for i in range(0, len(ids), _CHUNK):
+            chunk = ids[i:i + _CHUNK]
+            names.update(self.connection.execute(
+                f"SELECT id, lemma FROM lemmas WHERE id IN ({', '.join('?' * len(chunk))})", chunk))
+        return {names[lemma_id]: n for lemma_id, n in pairs}
+
+    @property
+    def fingerprint(self) -> str:
+        """Changes whenever a talk is added, replaced or removed (part of the batch cache key)"""
+        digest = hashlib.sha256()
+        for key, talk_digest in self.connection.execute("SELECT key, digest FROM talks ORDER BY key"):
+            digest.update(f"{key}\t{talk_digest}\n".encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    def summary(self) -> Dict[str, float]:
+        talks, tokens = self.connection.execute("SELECT count(*), coalesce(sum(tokens), 0) FROM talks").fetchone()
+        lemmas = self.connection.execute("SELECT count(*) FROM lemmas WHERE df > 0").fetchone()[0]
+        return {"talks": talks, "tokens": tokens, "lemmas": lemmas}
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) < 2 or args[0] not in ("add", "info", "terms"):
+        print(__doc__.strip())
+        return 1
+    from ted_batch import detect_format
+    from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+
+    corpus = CorpusStats(args[1])
+    try:
+        if args[0] == "info":
+            summary = corpus.summary()
+            print(f"{summary['talks']} talks, {summary['tokens']} content words, {summary['lemmas']} lemmas")
+            return 0
+        processors: Dict[str, TEDTranscriptProcessor] = {}
+        for path in args[2:]:
+            with open(path, "r", encoding="utf-8") as f:
+                transcript = f.read()
+            subtitle_format = detect_format(transcript)
+            processor = processors.setdefault(subtitle_format, TEDTranscriptProcessor(LearnerProfile(
+                level="B2", vocabulary_size=8000, goals=[], output_language="english_only",
+                subtitle_format=subtitle_format, output_style="complete")))
+            if args[0] == "add":
+                changed = corpus.add_transcript(str(path), transcript, processor)
+                print(f"{'added' if changed else 'unchanged'}\t{path}")
+            else:
+                counts, ranks, _ = processor.lemma_counts(processor.clean_transcript(transcript))
+                weights = corpus.tfidf(counts)
+                print(f"{path}: lexical score {lexical_score(counts, ranks):.2f}, "
+                      f"percentile {corpus.percentile(lexical_score(counts, ranks)):.0f}")
+                for lemma in sorted(weights, key=weights.get, reverse=True)[:15]:
+                    print(f"  {lemma:<20} {weights[lemma]:.4f}")
+    finally:
+        corpus.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Readability and difficulty engine for TED English Learning SOP System
+Scores talks with explainable metrics instead of one opaque number:
+
+    Flesch-Kincaid grade   from words per sentence and syllables per word
+    frequency bands        share of words in K1, K2, K3-5, K6-10, K11-20 and
+                           off the frequency list (lexical sophistication =
+                           share beyond K2)
+    coverage               share of words within the learner's vocabulary_size
+                           (about 95% is needed to follow a talk unaided)
+    speech rate            words per minute, from SRT/VTT cue timing
+
+Each talk is reduced once, in O(talk length), to a fixed-size TalkFeatures
+row: word, sentence, syllable and letter counts, speech time and a histogram
+of its words over frequency-rank bands of BAND_WIDTH. The metrics are then
+arithmetic on those rows, so DifficultyEngine scores a whole library at once;
+with NumPy installed the rows form one matrix and every metric is a single
+vectorized expression, and without it the same numbers come from a plain
+loop. Coverage at any vocabulary size interpolates within its rank band.
+
+    python3 ted_difficulty.py --level B2 --vocab 8000 data/transcripts/*.txt
+"""
+
+import re
+import sys
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional; the pure-Python path computes the same metrics
+    np = None
+
+from ted_frequency import load_frequency_index, normalize_token
+
+
+BAND_WIDTH = 500
+BANDS = 40  # ranks 1-20000; one more column counts words beyond that or off the list
+FREQUENCY_BANDS = (("K1", 1000), ("K2", 2000), ("K3-5", 5000), ("K6-10", 10000), ("K11-20", 20000))
+OFF_LIST = "off-list"
+
+# Comprehension needs about 95% of the words to be known, and 98% makes for easy
+# listening; above 99% a talk has next to nothing left to teach
+TARGET_COVERAGE = 0.95
+EASY_COVERAGE = 0.99
+# Fit points lost per coverage point short / over, per grade off and per wpm too fast
+COVERAGE_PENALTY, EASY_PENALTY, GRADE_PENALTY, RATE_PENALTY = 5.0, 2.0, 4.0, 0.2
+# Per CEFR level: Flesch-Kincaid grade and speech rate (words/minute) a learner handles well
+LEVEL_TARGETS = {
+    "A1": (2.0, 100), "A2": (4.0, 115), "B1": (6.0, 130),
+    "B2": (8.0, 150), "C1": (11.0, 165), "C2": (14.0, 180),
+}
+
+_VOWEL_GROUPS = re.compile(r"[aeiouy]+")
+
+
+def count_syllables(word: str) -> int:
+    """Vowel-group estimate of a word's syllables (silent final -e and -ed dropped)"""
+    word = word.lower()
+    groups = len(_VOWEL_GROUPS.findall(word))
+    if groups > 1 and word.endswith("e") and not word.endswith(("le", "ee", "ye")):
+        groups -= 1
+    elif groups > 1 and word.endswith("ed") and not word.endswith(("ted", "ded")):
+        groups -= 1
+    return max(1, groups)
+
+
+def _band(rank: Optional[int]) -> int:
+    if rank is None or rank > BANDS * BAND_WIDTH:
+        return BANDS
+    return (rank - 1) // BAND_WIDTH
+
+
+@dataclass
+class TalkFeatures:
+    """Everything the metrics need from one talk, in a fixed size"""
+    words: int
+    sentences: int
+    syllables: int
+    letters: int
+    speech_seconds: float  # 0.0 without cue timing
+    histogram: List[int]  # words per rank band (BANDS + 1 columns, the last one off-list)
+
+
+def extract_features(processor, text: str, ranks: Optional[Counter] = None) -> TalkFeatures:
+    """Reduce a cleaned transcript to TalkFeatures using processor's tokens and cue timing.
+
+    Syllables and frequency ranks are looked up once per distinct word form.
+    If ranks is given, it also receives the number of words at each frequency
+    rank (None for unlisted words), e.g. for ted_recommend's lexical profiles.
+    """
+    tokens = processor.tokenize(text)
+    frequency = load_frequency_index()
+    histogram = [0] * (BANDS + 1)
+    words = syllables = letters = 0
+    for token, n in Counter(tokens.tokens).items():
+        word = normalize_token(token)
+        if not any(c.isalpha() for c in word):
+            continue
+        words += n
+        syllables += n * count_syllables(word)
+        letters += n * sum(c.isalpha() for c in word)
+        rank = frequency.lemma_rank(word)[1]
+        histogram[_band(rank)] += n
+        if ranks is not None:
+            ranks[rank] += n
+    sentences = sum(1 for count in tokens.sentence_token_counts if count)
+
+    # Cues hold start times only: stretch the first-to-last span by one average cue
+    starts = processor.cue_starts_ms
+    speech_seconds = 0.0
+    if len(starts) > 1 and starts[-1] > starts[0]:
+        speech_seconds = (starts[-1] - starts[0]) / 1000 * len(starts) / (len(starts) - 1)
+    return TalkFeatures(words, sentences, syllables, letters, speech_seconds, histogram)
+
+
+def level_code(profile) -> str:
+    """"B2" from a LearnerProfile level such as "B2 (CET-6 / IELTS 6-6.5 / TOEFL 70-90)" """
+    code = profile.level.split()[0][:2].upper() if profile.level else ""
+    return code if code in LEVEL_TARGETS else "B2"
+
+
+@dataclass
+class DifficultyReport:
+    """The metrics of one talk for one learner"""
+    flesch_kincaid: float
+    coverage: float  # share of words within the learner's vocabulary_size
+    bands: Dict[str, float]  # share of words per frequency band
+    sophistication: float  # share of words beyond K2
+    speech_rate: Optional[float]  # words per minute (None without cue timing)
+    fit: float  # 0-100, how well the talk suits the learner
+
+    def summary(self) -> str:
+        rate = f", {self.speech_rate:.0f} wpm" if self.speech_rate else ""
+        return (f"Flesch-Kincaid grade {self.flesch_kincaid:.1f}, {self.coverage:.1%} coverage, "
+                f"{self.sophistication:.1%} beyond K2{rate}, fit {self.fit:.0f}/100")
+
+
+class DifficultyEngine:
+    """Metrics for many talks at once; every method returns one value per talk"""
+
+    def __init__(self, features: Sequence[TalkFeatures]):
+        self.features = list(features)
+        # The backend is fixed here: the matrices below exist only if NumPy did
+        self._np = np
+        if np is not None:
+            self._histograms = np.array([f.histogram for f in self.features], dtype=np.float64) \
+                .reshape(len(self.features), BANDS + 1)
+            self._counts = np.array([(f.words, f.sentences, f.syllables, f.speech_seconds)
+                                     for f in self.features], dtype=np.float64).reshape(len(self.features), 4)
+
+    def __len__(self) -> int:
+        return len(self.features)
+
+    def flesch_kincaid(self) -> List[float]:
+        np = self._np
+        if np is not None:
+            words = np.maximum(self._counts[:, 0], 1)
+            sentences = np.maximum(self._counts[:, 1], 1)
+            return (0.39 * words / sentences + 11.8 * self._counts[:, 2] / words - 15.59).tolist()
+        return [0.39 * max(f.words, 1) / max(f.sentences, 1) + 11.8 * f.syllables / max(f.words, 1) - 15.59
+                for f in self.features]
+
+    def coverage(self, vocabulary_size: int) -> List[float]:
+        """Share of each talk's words ranked within vocabulary_size"""
+        full, partial = divmod(min(max(vocabulary_size, 0), BANDS * BAND_WIDTH), BAND_WIDTH)
+        fraction = partial / BAND_WIDTH
+        np = self._np
+        if np is not None:
+            known = self._histograms[:, :full].sum(axis=1)
+            if full < BANDS:
+                known += self._histograms[:, full] * fraction
+            return (known / np.maximum(self._histograms.sum(axis=1), 1)).tolist()
+        result = []
+        for f in self.features:
+            known = sum(f.histogram[:full]) + (f.histogram[full] * fraction if full < BANDS else 0)
+            result.append(known / max(sum(f.histogram), 1))
+        return result
+
+    def band_shares(self) -> Dict[str, List[float]]:
+        """Share of each talk's words per frequency band (K1, K2, ..., off-list)"""
+        edges, start = [], 0
+        for name, limit in FREQUENCY_BANDS:
+            edges.append((name, start, limit // BAND_WIDTH))
+            start = limit // BAND_WIDTH
+        edges.append((OFF_LIST, start, BANDS + 1))
+        np = self._np
+        if np is not None:
+            totals = np.maximum(self._histograms.sum(axis=1), 1)
+            return {name: (self._histograms[:, a:b].sum(axis=1) / totals).tolist() for name, a, b in edges}
+        shares: Dict[str, List[float]] = {name: [] for name, _, _ in edges}
+        for f in self.features:
+            total = max(sum(f.histogram), 1)
+            for name, a, b in edges:
+                shares[name].append(sum(f.histogram[a:b]) / total)
+        return shares
+
+    def sophistication(self) -> List[float]:
+        """Share of words beyond the 2000 most frequent (lexical frequency profile)"""
+        return [1.0 - c for c in self.coverage(2000)]
+
+    def speech_rate(self) -> List[Optional[float]]:
+        return [f.words / (f.speech_seconds / 60) if f.speech_seconds else None for f in self.features]
+
+    def fit(self, profile, coverage: Optional[Sequence[float]] = None) -> List[float]:
+        """0-100 match to a LearnerProfile.
+
+        Points off per percentage point of coverage below TARGET_COVERAGE
+        and above EASY_COVERAGE (nothing left to learn), per grade away from
+        the level's Flesch-Kincaid grade and per word/minute faster than the
+        level's speech rate. coverage overrides the vocabulary_size coverage
+        (ted_recommend passes coverage of a learner's known-word set).
+        """
+        grade, rate = LEVEL_TARGETS[level_code(profile)]
+        if coverage is None:
+            coverage = self.coverage(profile.vocabulary_size)
+        grades = self.flesch_kincaid()
+        np = self._np
+        if np is not None:
+            coverage, grades = np.array(coverage), np.array(grades)
+            minutes = self._counts[:, 3] / 60
+            rates = np.divide(self._counts[:, 0], minutes, out=np.zeros_like(minutes), where=minutes > 0)
+            penalty = (COVERAGE_PENALTY * 100 * np.maximum(0, TARGET_COVERAGE - coverage)
+                       + EASY_PENALTY * 100 * np.maximum(0, coverage - EASY_COVERAGE)
+                       + GRADE_PENALTY * np.abs(grades - grade)
+                       + RATE_PENALTY * np.maximum(0, rates - rate))
+            return np.clip(100 - penalty, 0, 100).tolist()
+        result = []
+        for c, g, r in zip(coverage, grades, self.speech_rate()):
+            penalty = (COVERAGE_PENALTY * 100 * max(0.0, TARGET_COVERAGE - c)
+                       + EASY_PENALTY * 100 * max(0.0, c - EASY_COVERAGE)
+                       + GRADE_PENALTY * abs(g - grade) + RATE_PENALTY * max(0.0, (r or 0.0) - rate))
+            result.append(min(100.0, max(0.0, 100 - penalty)))
+        return result
+
+    def rank(self, profile, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """(talk index, fit) pairs, best fit first"""
+        fits = self.fit(profile)
+        order = sorted(range(len(fits)), key=lambda i: (-fits[i], i))
+        return [(i, fits[i]) for i in order[:limit]]
+
+    def report(self, i: int, profile) -> DifficultyReport:
+        """All metrics of talk i (computed for that talk alone)"""
+        engine = DifficultyEngine([self.features[i]]) if len(self) > 1 else self
+        return DifficultyReport(
+            flesch_kincaid=engine.flesch_kincaid()[0],
+            coverage=engine.coverage(profile.vocabulary_size)[0],
+            bands={name: values[0] for name, values in engine.band_shares().items()},
+            sophistication=engine.sophistication()[0],
+            speech_rate=engine.speech_rate()[0],
+            fit=engine.fit(profile)[0],
+        )
+
+
+def main():
+    import argparse
+    from ted_batch import detect_format
+    from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+
+    parser = argparse.ArgumentParser(description="Rank transcripts by difficulty fit for a learner")
+    parser.add_argument("transcripts", nargs="+", help="Transcript files (plain text or SRT/VTT)")
+    parser.add_argument("--level", default="B2", choices=sorted(LEVEL_TARGETS), help="CEFR level (default: B2)")
+    parser.add_argument("--vocab", type=int, default=8000, help="Vocabulary size (default: 8000)")
+    args = parser.parse_args()
+
+    profile = LearnerProfile(level=args.level, vocabulary_size=args.vocab, goals=[],
+                             output_language="english_only", subtitle_format="auto", output_style="complete")
+    processor = TEDTranscriptProcessor(profile)
+    features = []
+    for path in args.transcripts:
+        with open(path, "r", encoding="utf-8") as f:
+            transcript = f.read()
+        processor.profile.subtitle_format = detect_format(transcript)
+        features.append(extract_features(processor, processor.clean_transcript(transcript)))
+    engine = DifficultyEngine(features)
+    for i, fit in engine.rank(profile):
+        print(f"{fit:5.1f}  {args.transcripts[i]}: {engine.report(i, profile).summary()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
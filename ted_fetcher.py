@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Transcript fetcher for the TED Material Library
+Downloads the transcripts of pending library materials with asyncio, over a
+bounded pool of keep-alive HTTP/1.1 connections (standard library only).
+
+Requests to each host are rate limited with a token bucket, transient
+failures (connection errors, timeouts, 429 and 5xx responses) are retried
+with exponential backoff, and a transcript that was downloaded before is
+revalidated with If-None-Match / If-Modified-Since, so an unchanged one costs
+a 304 and no rewrite. Transcripts are written to data/transcripts/<slug>.txt
+(.srt/.vtt for subtitles) in worker threads, off the event loop. Only the
+materials' transcript fields are written back, UPDATE_CHUNK materials per
+library write, so workers processing the same library lose nothing.
+"""
+
+import asyncio
+import os
+import random
+import ssl
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+from ted_batch import TRANSCRIPT_SUFFIXES
+from ted_material_library import MaterialLibrary, url_slug
+from ted_subtitles import looks_like_subtitles
+
+
+USER_AGENT = "ted-learning-sop-fetcher/1.0"
+
+# Responses worth retrying; anything else (404, 403, ...) fails at once
+RETRY_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+REDIRECT_STATUSES = frozenset({301, 302, 303, 307, 308})
+MAX_REDIRECTS = 5
+
+# Downloaded transcripts whose library fields are written in one transaction
+UPDATE_CHUNK = 16
+
+
+class HTTPError(Exception):
+    pass
+
+
+@dataclass
+class Response:
+    status: int
+    headers: Dict[str, str]  # lowercase names
+    body: bytes
+    url: str
+
+    @property
+    def content_type(self) -> str:
+        return self.headers.get('content-type', '').split(';')[0].strip().lower()
+
+    def text(self) -> str:
+        charset = 'utf-8'
+        for param in self.headers.get('content-type', '').split(';')[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'charset':
+                charset = value.strip().strip('"') or charset
+        return self.body.decode(charset, errors='replace')
+
+
+@dataclass
+class FetchResult:
+    """Outcome of fetching one material's transcript"""
+    material_id: int
+    url: str
+    status: str  # "fetched", "not_modified" or "failed"
+    path: Optional[str] = None
+    size: int = 0
+    seconds: float = 0.0
+    attempts: int = 0
+    error: Optional[str] = None
+
+
+async def _read_response(reader: asyncio.StreamReader, method: str) -> Tuple[int, Dict[str, str], bytes, bool]:
+    """Read one HTTP/1.x response; returns (status, headers, body, keep_alive)"""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionResetError("Connection closed by server")
+    parts = line.decode('latin-1').split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+        raise HTTPError(f"Malformed status line: {line[:80]!r}")
+    version, status = parts[0], int(parts[1])
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode('latin-1').partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    keep_alive = version == "HTTP/1.1" and headers.get('connection', '').lower() != 'close'
+    if method == "HEAD" or status in (204, 304) or status < 200:
+        body = b""
+    elif 'chunked' in headers.get('transfer-encoding', '').lower():
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass  # trailers
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b"".join(chunks)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()  # delimited by the server closing the connection
+        keep_alive = False
+
+    encoding = headers.get('content-encoding', '').lower()
+    if encoding in ('gzip', 'deflate'):
+        body = zlib.decompress(body, 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS)
+    return status, headers, body, keep_alive
+
+
+class ConnectionPool:
+    """Keep-alive HTTP/1.1 connections, at most ``limit`` in use overall and
+    ``limit_per_host`` per host. Idle connections are reused; a reused one
+    that the server has meanwhile closed is replaced transparently.
+    """
+
+    def __init__(self, limit: int = 8, limit_per_host: int = 4, timeout: float = 30.0):
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(limit)
+        self._host_slots: Dict[Tuple[str, str, int], asyncio.Semaphore] = {}
+        self._idle: Dict[Tuple[str, str, int], List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]] = {}
+        self._ssl: Optional[ssl.SSLContext] = None
+        self.connections_opened = 0
+        self.requests = 0
+
+    async def _open(self, scheme: str, host: str, port: int):
+        if scheme == "https" and self._ssl is None:
+            self._ssl = ssl.create_default_context()
+        connection = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=self._ssl if scheme == "https" else None),
+            self.timeout
+        )
+        self.connections_opened += 1
+        return connection
+
+    @staticmethod
+    def _close(connection):
+        connection[1].close()
+
+    async def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None) -> Response:
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Unsupported URL: {url}")
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        host_header = parts.hostname if parts.port is None else f"{parts.hostname}:{port}"
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {host_header}", f"User-Agent: {USER_AGENT}",
+                 "Accept-Encoding: gzip, deflate", "Connection: keep-alive"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        payload = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+        host_slots = self._host_slots.setdefault(key, asyncio.Semaphore(self.limit_per_host))
+        idle = self._idle.setdefault(key, [])
+        async with self._slots, host_slots:
+            while True:
+                reused = bool(idle)
+                connection = idle.pop() if reused else await self._open(*key)
+                reader, writer = connection
+                try:
+                    writer.write(payload)
+                    await writer.drain()
+                    status, response_headers, body, keep_alive = await asyncio.wait_for(
+                        _read_response(reader, method), self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    self._close(connection)
+                    if reused:
+                        continue  # the server dropped an idle connection; try a fresh one
+                    raise
+                except BaseException:
+                    self._close(connection)
+                    raise
+                self.requests += 1
+                if keep_alive and len(idle) < self.limit_per_host:
+                    idle.append(connection)
+                else:
+                    self._close(connection)
+                return Response(status, response_headers, body, url)
+
+    async def close(self):
+        for connections in self._idle.values():
+            for connection in connections:
+                self._close(connection)
+                try:
+                    await connection[1].wait_closed()
+                except (OSError, ssl.SSLError):
+                    pass
+        self._idle.clear()
+
+
+class RateLimiter:
+    """Token bucket per host: ``rate`` requests per second, bursts of ``burst``"""
+
+    def __init__(self, rate: float = 2.0, burst: int = 4):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # host -> (tokens, updated)
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def acquire(self, host: str):
+        if self.rate <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        # Waiters for one host queue on its lock, so they are served in order
+        async with self._locks.setdefault(host, asyncio.Lock()):
+            tokens, updated = self._buckets.get(host, (float(self.burst), loop.time()))
+            now = loop.time()
+            tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                await asyncio.sleep((1 - tokens) / self.rate)
+                now, tokens = loop.time(), 1.0
+            self._buckets[host] = (tokens - 1, now)
+
+
+class _TextExtractor(HTMLParser):
+    """Visible text of an HTML page, one line per block element"""
+
+    _SKIP = {"script", "style", "noscript", "head", "nav", "header", "footer"}
+    _BLOCKS = {"p", "div", "br", "li", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "tr"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines: List[str] = []
+        self._current: List[str] = []
+        self._skipping = 0
+
+    def _break(self):
+        line = " ".join("".join(self._current).split())
+        if line:
+            self.lines.append(line)
+        self._current = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIP:
+            self._skipping += 1
+        elif tag in self._BLOCKS:
+            self._break()
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIP:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in self._BLOCKS:
+            self._break()
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self._current.append(data)
+
+
+def html_to_text(html: str) -> str:
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    extractor._break()
+    return "\n".join(extractor.lines) + "\n"
+
+
+def transcript_url_for(url: str) -> str:
+    """Where a talk's transcript is fetched from.
+
+    URLs that already point at a transcript file are used as they are;
+    talk pages get their English transcript page.
+    """
+    path = urlsplit(url).path
+    if path.lower().endswith(TRANSCRIPT_SUFFIXES):
+        return url
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{parts.path.rstrip('/')}/transcript?language=en"
+
+
+def transcript_content(response: Response) -> Tuple[str, str]:
+    """(text, file suffix) of a transcript response: subtitles are kept as they are, HTML is reduced to text"""
+    text = response.text()
+    content_type = response.content_type
+    if content_type == "text/vtt" or text.lstrip("\ufeff \r\n").startswith("WEBVTT"):
+        return text, ".vtt"
+    if content_type in ("application/x-subrip", "text/srt") or looks_like_subtitles(text):
+        return text, ".srt"
+    if content_type in ("text/html", "application/xhtml+xml"):
+        return html_to_text(text), ".txt"
+    return text, ".txt"
+
+
+def _retry_after(response: Response) -> Optional[float]:
+    value = response.headers.get('retry-after', '')
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None  # HTTP-date form: use the normal backoff
+
+
+class TranscriptFetcher:
+    """Fetches transcripts for library materials and records them in the library"""
+
+    def __init__(self, library: MaterialLibrary, output_dir: str = "data/transcripts",
+                 concurrency: int = 8, per_host: int = 4, rate: float = 2.0, burst: int = 4,
+                 retries: int = 3, backoff: float = 0.5, max_backoff: float = 30.0,
+                 timeout: float = 30.0, transcript_url: Callable[[str], str] = transcript_url_for):
+        self.library = library
+        self.output_dir = Path(output_dir)
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.transcript_url = transcript_url
+        self.pool: Optional[ConnectionPool] = None
+        self._updates: Dict[int, Dict] = {}  # material id -> transcript fields not yet written
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff with jitter: backoff * 2^attempt * [0.5, 1.5)"""
+        return min(self.max_backoff, self.backoff * (2 ** attempt) * (0.5 + random.random()))
+
+    async def _get(self, url: str, headers: Dict[str, str], limiter: RateLimiter) -> Response:
+        """GET following redirects; every hop counts against its host's rate limit"""
+        for _ in range(MAX_REDIRECTS + 1):
+            await limiter.acquire(urlsplit(url).netloc.lower())
+            response = await self.pool.request("GET", url, headers)
+            location = response.headers.get('location')
+            if response.status not in REDIRECT_STATUSES or not location:
+                return response
+            url = urljoin(url, location)
+        raise HTTPError(f"Too many redirects: {url}")
+
+    def _conditional_headers(self, material: Dict) -> Dict[str, str]:
+        """Validators from the last download, if its file is still there"""
+        headers = {}
+        if material.get('transcript_file') and Path(material['transcript_file']).is_file():
+            if material.get('transcript_etag'):
+                headers['If-None-Match'] = material['transcript_etag']
+            if material.get('transcript_last_modified'):
+                headers['If-Modified-Since'] = material['transcript_last_modified']
+        return headers
+
+    def _write(self, material: Dict, response: Response) -> Tuple[Path, int]:
+        """Write the transcript atomically (blocking; run in a worker thread)"""
+        text, suffix = transcript_content(response)
+        path = self.output_dir / f"{url_slug(material['url']) or material['id']}{suffix}"
+        temp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp, path)
+        return path, len(text)
+
+    async def _save(self, material: Dict, response: Response) -> Tuple[Path, int]:
+        """Write the transcript off the event loop and point the material at it"""
+        path, size = await asyncio.to_thread(self._write, material, response)
+        self._updates[material['id']] = {
+            'transcript_file': str(path),
+            'transcript_etag': response.headers.get('etag'),
+            'transcript_last_modified': response.headers.get('last-modified'),
+        }
+        if len(self._updates) >= UPDATE_CHUNK:
+            self._flush_updates()
+        return path, size
+
+    def _flush_updates(self):
+        """Write the pending transcript fields (only those) in one library write"""
+        if self._updates:
+            updates, self._updates = self._updates, {}
+            self.library.update_materials(updates)
+
+    async def fetch_one(self, material: Dict, limiter: RateLimiter) -> FetchResult:
+        started = time.perf_counter()
+        result = FetchResult(material['id'], self.transcript_url(material['url']), "failed")
+        headers = self._conditional_headers(material)
+        for attempt in range(self.retries + 1):
+            result.attempts += 1
+            delay = None
+            try:
+                response = await self._get(result.url, headers, limiter)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, HTTPError, zlib.error) as e:
+                result.error = str(e) or type(e).__name__
+            else:
+                if response.status == 304:
+                    result.status, result.path, result.error = "not_modified", material['transcript_file'], None
+                    break
+                if 200 <= response.status < 300:
+                    try:
+                        path, result.size = await self._save(material, response)
+                    except OSError as e:
+                        result.error = str(e)
+                        break
+                    result.status, result.path, result.error = "fetched", str(path), None
+                    break
+                result.error = f"HTTP {response.status}"
+                if response.status not in RETRY_STATUSES:
+                    break
+                delay = _retry_after(response)
+            if attempt < self.retries:
+                await asyncio.sleep(self._backoff_delay(attempt) if delay is None
+                                    else min(delay, self.max_backoff))
+        result.seconds = time.perf_counter() - started
+        return result
+
+    async def fetch_all(self, materials: Optional[List[Dict]] = None,
+                        progress: Optional[Callable[[FetchResult], None]] = None) -> List[FetchResult]:
+        """Fetch transcripts for materials (default: all unprocessed ones), in input order"""
+        if materials is None:
+            materials = self.library.get_unprocessed_materials()
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.pool = ConnectionPool(self.concurrency, self.per_host, self.timeout)
+        limiter = RateLimiter(self.rate, self.burst)
+
+        async def run(material):
+            result = await self.fetch_one(material, limiter)
+            if progress is not None:
+                progress(result)
+            return result
+
+        try:
+            return list(await asyncio.gather(*(run(m) for m in materials)))
+        finally:
+            self._flush_updates()  # also after a crash, for the transcripts already on disk
+            await self.pool.close()
+
+
+def fetch_transcripts(library: MaterialLibrary, materials: Optional[List[Dict]] = None,
+                      progress: Optional[Callable[[FetchResult], None]] = None, **options) -> List[FetchResult]:
+    """Synchronous entry point: run a TranscriptFetcher (options as its constructor) to completion"""
+    fetcher = TranscriptFetcher(library, **options)
+    return asyncio.run(fetcher.fetch_all(materials, progress))
+
+
+def format_fetch_result(result: FetchResult) -> str:
+    if result.status == "failed":
+        return f"  ✗ [{result.material_id}] {result.url}: {result.error} ({result.attempts} attempts)"
+    if result.status == "not_modified":
+        return f"  = [{result.material_id}] {result.path} (not modified)"
+    return (f"  ✓ [{result.material_id}] {result.url} -> {result.path} "
+            f"({result.size} chars, {result.seconds * 1000:.0f} ms)")
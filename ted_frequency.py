@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+General-English word frequency ranks for TED English Learning SOP System
+Lemma ranks live in a memory-mapped SortedStringIndex (data/frequency/en_lemmas.idx),
+so looking up a word costs a binary search over the mapped file rather than
+loading a large dict at startup.
+
+Rebuild the index from a frequency-ordered word list (one word per line):
+    python3 ted_frequency.py build wordlist.txt
+Dump the ranked lemmas:
+    python3 ted_frequency.py dump | head
+"""
+
+import struct
+import sys
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from ted_index import SortedStringIndex, write_index
+
+
+FREQUENCY_INDEX = Path(__file__).resolve().parent / "data" / "frequency" / "en_lemmas.idx"
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been
+before being below between both but by can could did do does doing down during
+each few for from further had has have having he her here hers herself him
+himself his how i if in into is it its itself just let me more most my myself
+no nor not now of off on once only or other our ours ourselves out over own
+same she should so some such than that the their theirs them themselves then
+there these they this those through to too under until up very was we were
+what when where which while who whom why will with would you your yours
+yourself yourselves also may might must shall us yet ever every
+i'm you're we're they're it's that's there's what's let's don't doesn't didn't
+isn't aren't wasn't weren't can't couldn't won't wouldn't shouldn't i've you've
+we've they've i'll you'll we'll they'll i'd you'd we'd they'd he's she's
+""".split())
+
+# Forms the suffix rules would get wrong, and common irregular inflections
+_IRREGULAR = {
+    "is": "be", "am": "be", "are": "be", "was": "be", "were": "be", "been": "be", "being": "be",
+    "has": "have", "had": "have", "having": "have",
+    "does": "do", "did": "do", "done": "do", "doing": "do",
+    "goes": "go", "went": "go", "gone": "go",
+    "made": "make", "said": "say", "says": "say", "took": "take", "taken": "take",
+    "came": "come", "saw": "see", "seen": "see", "knew": "know", "known": "know",
+    "got": "get", "gotten": "get", "gave": "give", "given": "give", "found": "find",
+    "thought": "think", "told": "tell", "became": "become", "left": "leave",
+    "felt": "feel", "brought": "bring", "began": "begin", "begun": "begin",
+    "kept": "keep", "held": "hold", "wrote": "write", "written": "write",
+    "stood": "stand", "heard": "hear", "meant": "mean", "met": "meet", "ran": "run",
+    "paid": "pay", "sat": "sit", "spoke": "speak", "spoken": "speak", "lost": "lose",
+    "built": "build", "sent": "send", "spent": "spend", "grew": "grow", "grown": "grow",
+    "drew": "draw", "drawn": "draw", "chose": "choose", "chosen": "choose",
+    "taught": "teach", "bought": "buy", "caught": "catch", "fought": "fight",
+    "sought": "seek", "understood": "understand", "led": "lead", "fell": "fall",
+    "fallen": "fall", "broke": "break", "broken": "break", "won": "win",
+    "children": "child", "men": "man", "women": "woman", "feet": "foot", "teeth": "tooth",
+    "mice": "mouse", "lives": "life", "wives": "wife", "knives": "knife", "leaves": "leaf",
+    "better": "good", "best": "good", "worse": "bad", "worst": "bad",
+}
+_NOT_INFLECTED = frozenset("""
+news means series species politics physics mathematics economics ethics
+glasses thanks always perhaps sometimes whereas nevertheless across
+morning evening wedding ceiling during nothing something anything everything
+thing things king spring string bring sing ring wing
+wicked naked sacred hundred indeed
+""".split())
+
+_RANK = struct.Struct("<I")
+_PUNCTUATION = ".,;:!?\"()[]{}<>—–-…“”‘’*_/\\"
+
+
+def normalize_token(token: str) -> str:
+    """Strip surrounding punctuation and possessive 's from a lowercase token"""
+    word = token.strip(_PUNCTUATION).replace("’", "'").strip("'")
+    if word.endswith("'s") and word not in STOPWORDS:
+        word = word[:-2]
+    return word
+
+
+def is_word(word: str) -> bool:
+    """Alphabetic word, optionally with internal apostrophes or hyphens"""
+    return len(word) > 1 and word.replace("'", "").replace("-", "").isalpha()
+
+
+def lemma_candidates(word: str) -> List[str]:
+    """Possible base forms of an inflected word, most likely first"""
+    if word in _IRREGULAR:
+        return [_IRREGULAR[word]]
+    if word in _NOT_INFLECTED or len(word) < 4:
+        return []
+    candidates = []
+    if word.endswith("ies") and len(word) > 4:
+        candidates.append(word[:-3] + "y")
+    elif word.endswith("es"):
+        candidates += [word[:-1], word[:-2]]
+    elif word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        candidates.append(word[:-1])
+    elif word.endswith("ied") and len(word) > 4:
+        candidates.append(word[:-3] + "y")
+    elif word.endswith("ed") and len(word) > 4:
+        candidates += [word[:-2], word[:-1]]
+        if word[-3] == word[-4]:
+            candidates.append(word[:-3])
+    elif word.endswith("ing") and len(word) > 5:
+        candidates += [word[:-3], word[:-3] + "e"]
+        if word[-4] == word[-5]:
+            candidates.append(word[:-4])
+    return [c for c in candidates if len(c) >= 3 or c in ("be", "do", "go")]
+
+
+def lemmatize(word: str, known) -> str:
+    """Map an inflected word to a base form found in ``known`` (or return it unchanged)"""
+    for candidate in lemma_candidates(word):
+        if candidate in known:
+            # Follow chains such as workings -> working -> work
+            return lemmatize(candidate, known)
+    return word
+
+
+class FrequencyIndex:
+    """Lemma -> general-English frequency rank (1 = most frequent)"""
+
+    def __init__(self, index: SortedStringIndex):
+        self.index = index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, lemma: str) -> bool:
+        return lemma in self.index
+
+    def rank(self, lemma: str) -> Optional[int]:
+        value = self.index.get(lemma)
+        return _RANK.unpack(value)[0] if value is not None else None
+
+    def lemma_rank(self, word: str) -> Tuple[str, Optional[int]]:
+        """Lemmatize a normalized word and return (lemma, rank or None if unlisted)"""
+        rank = self.rank(word) if word not in _IRREGULAR else None
+        if rank is not None:
+            return word, rank
+        for candidate in lemma_candidates(word):
+            lemma, rank = self.lemma_rank(candidate)
+            if rank is not None:
+                return lemma, rank
+        return word, None
+
+    def lemmas_by_rank(self) -> List[str]:
+        ranked = sorted((_RANK.unpack(value)[0], key) for key, value in self.index.items())
+        return [key for _, key in ranked]
+
+
+def rank_lemmas(words: Iterable[str]) -> List[str]:
+    """Collapse a frequency-ordered word list into frequency-ordered lemmas"""
+    ordered = [w for w in (normalize_token(w.strip().lower()) for w in words) if is_word(w)]
+    surface = set(ordered)
+    lemmas = {}
+    for word in ordered:
+        lemma = lemmatize(word, surface)
+        if lemma not in lemmas:
+            lemmas[lemma] = len(lemmas) + 1
+    return list(lemmas)
+
+
+def build_frequency_index(words: Iterable[str], path=FREQUENCY_INDEX) -> int:
+    """Compile a frequency-ordered word list into the lemma rank index"""
+    lemmas = rank_lemmas(words)
+    write_index(path, ((lemma, _RANK.pack(rank)) for rank, lemma in enumerate(lemmas, 1)),
+                value_width=_RANK.size)
+    return len(lemmas)
+
+
+_loaded: Optional[FrequencyIndex] = None
+
+
+def load_frequency_index(path=None) -> FrequencyIndex:
+    """Open the shipped frequency index (memory-mapped once per process)"""
+    global _loaded
+    if path is not None:
+        return FrequencyIndex(SortedStringIndex.open(path))
+    if _loaded is None:
+        _loaded = FrequencyIndex(SortedStringIndex.open(FREQUENCY_INDEX))
+    return _loaded
+
+
+def main():
+    if len(sys.argv) >= 3 and sys.argv[1] == "build":
+        with open(sys.argv[2], "r", encoding="utf-8") as f:
+            count = build_frequency_index(f)
+        print(f"Wrote {count} lemmas to {FREQUENCY_INDEX}")
+    elif len(sys.argv) == 2 and sys.argv[1] == "dump":
+        for rank, lemma in enumerate(load_frequency_index().lemmas_by_rank(), 1):
+            print(f"{rank}\t{lemma}")
+    else:
+        print(__doc__.strip())
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
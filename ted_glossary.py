@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Global English -> Chinese glossary for TED English Learning SOP System
+Merges a base dictionary (data/glossary/base_zh.tsv, or any larger one such as
+an ECDICT export) with every talk's docs/ted/<id>/glossary_zh.json into one
+deduplicated glossary, compiled to a memory-mapped SortedStringIndex
+(data/glossary/zh_glossary.idx). Opening it maps the file without parsing it,
+and a lookup is a binary search, so even a 200k-entry dictionary costs
+nothing at startup.
+
+Rebuild after adding or editing glossaries:
+    python3 ted_glossary.py build [--base dictionary.tsv|.csv|.json] [--talks docs/ted]
+Look words up:
+    python3 ted_glossary.py lookup resilience fluency
+"""
+
+import csv
+import json
+import re
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ted_frequency import lemma_candidates
+from ted_index import SortedStringIndex, write_index
+
+
+_ROOT = Path(__file__).resolve().parent
+GLOSSARY_INDEX = _ROOT / "data" / "glossary" / "zh_glossary.idx"
+BASE_DICTIONARY = _ROOT / "data" / "glossary" / "base_zh.tsv"
+TALKS_DIR = _ROOT / "docs" / "ted"
+TALK_GLOSSARY = "glossary_zh.json"
+
+# Senses within a meaning are separated by a full-width or ASCII semicolon
+SENSE_SEPARATOR = "；"
+_SENSES = re.compile(r"\s*[；;]\s*")
+
+
+def normalize_key(word: str) -> str:
+    return " ".join(word.lower().split())
+
+
+def read_dictionary(path) -> Iterator[Tuple[str, str]]:
+    """(word, meaning) pairs from a .json object, an ECDICT-style .csv
+    (word and translation columns) or a word<TAB>meaning .tsv ('#' comments)"""
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".json":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError(f"{path}: expected a JSON object of word -> meaning")
+        yield from ((str(word), str(meaning)) for word, meaning in data.items())
+        return
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if suffix == ".csv":
+            for row in csv.DictReader(f):
+                # ECDICT puts one sense per line, often prefixed with a part of speech
+                yield row.get("word", ""), SENSE_SEPARATOR.join((row.get("translation") or "").splitlines())
+            return
+        for line in f:
+            if line.startswith("#") or "\t" not in line:
+                continue
+            word, meaning = line.rstrip("\n").split("\t", 1)
+            yield word, meaning
+
+
+def talk_glossaries(talks_dir=TALKS_DIR) -> List[Path]:
+    """Every docs/ted/<id>/glossary_zh.json, in a stable order"""
+    return sorted(Path(talks_dir).glob(f"*/{TALK_GLOSSARY}"))
+
+
+def merge_glossaries(sources: Iterable[Iterable[Tuple[str, str]]]) -> Dict[str, str]:
+    """Merge (word, meaning) streams: words are normalized, and each word keeps
+    every distinct sense in first-seen order (so earlier sources lead)"""
+    senses: Dict[str, List[str]] = {}
+    for source in sources:
+        for word, meaning in source:
+            key = normalize_key(word)
+            if not key:
+                continue
+            known = senses.setdefault(key, [])
+            for sense in _SENSES.split(meaning.strip()):
+                if sense and sense not in known:
+                    known.append(sense)
+    return {word: SENSE_SEPARATOR.join(parts) for word, parts in senses.items() if parts}
+
+
+def build_glossary(base=BASE_DICTIONARY, talks_dir=TALKS_DIR, path=GLOSSARY_INDEX) -> int:
+    """Compile the base dictionary and all talk glossaries into the index; returns its size"""
+    sources = [read_dictionary(base)] if base is not None and Path(base).exists() else []
+    sources += [read_dictionary(glossary) for glossary in talk_glossaries(talks_dir)]
+    merged = merge_glossaries(sources)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    write_index(path, ((word, meaning.encode("utf-8")) for word, meaning in merged.items()))
+    return len(merged)
+
+
+class Glossary:
+    """Word -> Chinese meaning, looked up in a mapped SortedStringIndex"""
+
+    def __init__(self, index: SortedStringIndex):
+        self.index = index
+        self._fingerprint: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, word: str) -> bool:
+        return normalize_key(word) in self.index
+
+    def get(self, word: str) -> Optional[str]:
+        """Meaning of word, or of its base form if only that is listed
+        (revolutionized -> revolutionize): entries are keyed by lemma"""
+        key = normalize_key(word)
+        value = self.index.get(key)
+        if value is None and " " not in key:
+            for candidate in lemma_candidates(key):
+                value = self.index.get(candidate)
+                if value is not None:
+                    break
+        return value.decode("utf-8") if value is not None else None
+
+    def lookup(self, *words: str) -> str:
+        """Meaning of the first of words that is in the glossary ('' if none is)"""
+        for word in words:
+            meaning = self.get(word)
+            if meaning:
+                return meaning
+        return ""
+
+    @property
+    def fingerprint(self) -> str:
+        """Content hash, so cached packages are rebuilt when the glossary changes"""
+        if self._fingerprint is None:
+            self._fingerprint = self.index.digest()
+        return self._fingerprint
+
+
+_loaded: Dict[Path, Optional[Glossary]] = {}
+
+
+def load_glossary_index(path=None) -> Optional[Glossary]:
+    """Open the compiled glossary (memory-mapped once per process); None if it was never built"""
+    path = Path(path) if path is not None else GLOSSARY_INDEX
+    if path not in _loaded:
+        _loaded[path] = Glossary(SortedStringIndex.open(path)) if path.exists() else None
+    return _loaded[path]
+
+
+def main():
+    args = sys.argv[1:]
+    if args[:1] == ["build"]:
+        options = {"--base": BASE_DICTIONARY, "--talks": TALKS_DIR}
+        rest = args[1:]
+        while len(rest) >= 2 and rest[0] in options:
+            options[rest[0]] = Path(rest[1])
+            rest = rest[2:]
+        if rest:
+            print(__doc__.strip())
+            return 1
+        count = build_glossary(options["--base"], options["--talks"])
+        print(f"Wrote {count} entries to {GLOSSARY_INDEX}")
+    elif args[:1] == ["lookup"] and len(args) > 1:
+        glossary = load_glossary_index()
+        if glossary is None:
+            print(f"No glossary at {GLOSSARY_INDEX}; run: python3 ted_glossary.py build")
+            return 1
+        for word in args[1:]:
+            print(f"{word}\t{glossary.get(word) or '-'}")
+    else:
+        print(__doc__.strip())
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
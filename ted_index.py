@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped sorted string index for TED English Learning SOP System
+A compact read-only key/value file (sorted UTF-8 keys plus offset arrays) that
+is opened with mmap and searched in place, so large word lists do not have to
+be parsed into a dict at startup.
+
+File layout (little-endian):
+    magic        8 bytes  b"TEDIDX01"
+    count        u32      number of keys
+    value_width  u32      0 = variable-length values, N = fixed N-byte values
+    key_offsets  u32 * (count + 1)
+    val_offsets  u32 * (count + 1)      (only when value_width == 0)
+    keys         concatenated UTF-8 keys, sorted bytewise
+    values       concatenated values
+"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
+
+
+MAGIC = b"TEDIDX01"
+_HEADER = struct.Struct("<8sII")
+
+
+class SortedStringIndex:
+    """Read-only view over an index file, searched by binary search"""
+
+    def __init__(self, buffer, path: Optional[Path] = None):
+        self.path = path
+        self._buffer = buffer
+        magic, self.count, self.value_width = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a TED index file: {path or '<memory>'}")
+
+        view = memoryview(buffer)
+        position = _HEADER.size
+        self._key_offsets = self._u32_array(view, position, self.count + 1)
+        position += 4 * (self.count + 1)
+        if self.value_width == 0:
+            self._value_offsets = self._u32_array(view, position, self.count + 1)
+            position += 4 * (self.count + 1)
+        else:
+            self._value_offsets = None
+        self._keys_base = position
+        self._values_base = position + self._key_offsets[self.count]
+        self._view = view
+
+    @staticmethod
+    def _u32_array(view: memoryview, position: int, length: int):
+        chunk = view[position:position + 4 * length]
+        if sys.byteorder == "little":
+            return chunk.cast("I")  # zero-copy view into the mapped file
+        values = array("I", chunk.tobytes())
+        values.byteswap()
+        return values
+
+    @classmethod
+    def open(cls, path) -> "SortedStringIndex":
+        """Memory-map an index file"""
+        path = Path(path)
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, path)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def key_at(self, i: int) -> bytes:
+        offsets = self._key_offsets
+        base = self._keys_base
+        return self._view[base + offsets[i]:base + offsets[i + 1]].tobytes()
+
+    def value_at(self, i: int) -> bytes:
+        if self._value_offsets is None:
+            start = self._values_base + i * self.value_width
+            return self._view[start:start + self.value_width].tobytes()
+        offsets = self._value_offsets
+        base = self._values_base
+        return self._view[base + offsets[i]:base + offsets[i + 1]].tobytes()
+
+    def find(self, key: str) -> int:
+        """Position of key, or -1 if absent"""
+        target = key.encode("utf-8")
+        offsets = self._key_offsets
+        buffer = self._buffer
+        base = self._keys_base
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            probe = buffer[base + offsets[mid]:base + offsets[mid + 1]]
+            if probe < target:
+                low = mid + 1
+            elif probe > target:
+                high = mid
+            else:
+                return mid
+        return -1
+
+    def get(self, key: str) -> Optional[bytes]:
+        i = self.find(key)
+        return self.value_at(i) if i >= 0 else None
+
+    def __contains__(self, key: str) -> bool:
+        return self.find(key) >= 0
+
+    def items(self) -> Iterator[Tuple[str, bytes]]:
+        for i in range(self.count):
+            yield self.key_at(i).decode("utf-8"), self.value_at(i)
+
+    def digest(self) -> str:
+        """SHA-256 of the whole index file, e.g. to notice that it was rebuilt"""
+        import hashlib
+        return hashlib.sha256(self._buffer).hexdigest()
+
+    def close(self):
+        """Release every view into the buffer, then unmap it (a mapped buffer
+        cannot be closed while any memoryview over it is alive)"""
+        for offsets in (self._key_offsets, self._value_offsets):
+            if isinstance(offsets, memoryview):
+                offsets.release()
+        self._view.release()
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+
+def build_index(entries: Iterable[Tuple[str, bytes]], value_width: int = 0) -> bytes:
+    """Serialize (key, value) pairs into the index format; later duplicates win"""
+    merged = {}
+    for key, value in entries:
+        if value_width and len(value) != value_width:
+            raise ValueError(f"Value for {key!r} is {len(value)} bytes, expected {value_width}")
+        merged[key.encode("utf-8")] = value
+    keys = sorted(merged)
+
+    key_offsets = array("I", [0])
+    value_offsets = array("I", [0])
+    for key in keys:
+        key_offsets.append(key_offsets[-1] + len(key))
+        value_offsets.append(value_offsets[-1] + len(merged[key]))
+    if sys.byteorder != "little":
+        key_offsets.byteswap()
+        value_offsets.byteswap()
+
+    parts = [_HEADER.pack(MAGIC, len(keys), value_width), key_offsets.tobytes()]
+    if value_width == 0:
+        parts.append(value_offsets.tobytes())
+    parts.append(b"".join(keys))
+    parts.append(b"".join(merged[key] for key in keys))
+    return b"".join(parts)
+
+
+def write_index(path, entries: Iterable[Tuple[str, bytes]], value_width: int = 0):
+    """Build an index and write it atomically"""
+    path = Path(path)
+    data = build_index(entries, value_width)
+    temp = path.with_name(path.name + ".tmp")
+    with open(temp, "wb") as f:
+        f.write(data)
+    os.replace(temp, path)
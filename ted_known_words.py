@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Known-word learner model for TED English Learning SOP System
+LearnerProfile.vocabulary_size only says how many words a learner knows;
+KnownWords says which. It is a bitmap over the frequency list in rank order
+(bit rank - 1 is set if the learner knows the lemma of that rank), so:
+
+    size         one bit per listed lemma: about 2.5 KB in memory, and
+                 usually well under 1 KB on disk (zlib), per learner
+    lookups      a lemma's rank, then one bit test
+    intersection a talk's lemmas as the same kind of bitset (rank_bitset)
+                 AND the learner's bitset, a single integer operation
+
+Lemmas off the frequency list (rarer words, compounds) have no bit; the few
+a learner knows are kept in a small set next to the bitmap.
+
+A model starts from a vocabulary size (the most frequent lemmas) or a word
+list and learns from Anki: a card answered Good or Easy marks its word
+known, a card answered Again marks it unknown, and Hard changes nothing.
+extract_vocabulary skips known words when the profile has a model, and
+ted_recommend ranks talks by the learner's actual coverage.
+
+    python3 ted_known_words.py init learner.known --vocab 4000
+    python3 ted_known_words.py update learner.known ~/Anki2/User\\ 1/collection.anki2
+    python3 ted_known_words.py info learner.known
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import struct
+import sys
+import zlib
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
+
+from ted_frequency import is_word, load_frequency_index, normalize_token
+
+
+_MAGIC = b"TEDKNOWN1\n"
+_HEADER = struct.Struct(">I")  # lemmas in the frequency list the bitmap was built for
+
+# Anki answer buttons (revlog.ease)
+AGAIN, HARD, GOOD, EASY = 1, 2, 3, 4
+
+_TAGS = re.compile(r"<[^>]+>")
+
+
+def rank_bitset(ranks: Iterable[Optional[int]]) -> int:
+    """Bitset (bit rank - 1) of frequency ranks, e.g. a talk's lemmas; None is skipped"""
+    bitmap = bytearray((len(load_frequency_index()) + 7) // 8)
+    for rank in ranks:
+        if rank is not None:
+            bitmap[(rank - 1) >> 3] |= 1 << ((rank - 1) & 7)
+    return int.from_bytes(bitmap, "little")
+
+
+class KnownWords:
+    """The lemmas one learner knows, as a bitmap over frequency ranks"""
+
+    __slots__ = ("bitmap", "extra", "_bitset")
+
+    def __init__(self, bitmap: Optional[bytes] = None, extra: Iterable[str] = ()):
+        size = (len(load_frequency_index()) + 7) // 8
+        if bitmap is not None and len(bitmap) != size:
+            raise ValueError(f"Known-word bitmap has {len(bitmap)} bytes, expected {size}")
+        self.bitmap = bytearray(bitmap) if bitmap is not None else bytearray(size)
+        self.extra = set(extra)  # known lemmas that are not on the frequency list
+        self._bitset: Optional[int] = None
+
+    @classmethod
+    def from_vocabulary_size(cls, vocabulary_size: int) -> "KnownWords":
+        """The vocabulary_size most frequent lemmas"""
+        known = cls()
+        full, rest = divmod(min(max(vocabulary_size, 0), len(load_frequency_index())), 8)
+        known.bitmap[:full] = b"\xff" * full
+        if rest:
+            known.bitmap[full] = (1 << rest) - 1
+        return known
+
+    @classmethod
+    def from_words(cls, words: Iterable[str]) -> "KnownWords":
+        known = cls()
+        for word in words:
+            known.add(word)
+        return known
+
+    @classmethod
+    def load(cls, path) -> "KnownWords":
+        """Read a saved model, or a plain word list (one word per line)"""
+        data = Path(path).read_bytes()
+        if not data.startswith(_MAGIC):
+            return cls.from_words(line for line in data.decode("utf-8").splitlines() if line.strip())
+        lemmas, = _HEADER.unpack_from(data, len(_MAGIC))
+        if lemmas != len(load_frequency_index()):
+            raise ValueError(f"{path} was built for a frequency list of {lemmas} lemmas, "
+                             f"not {len(load_frequency_index())}")
+        payload = zlib.decompress(data[len(_MAGIC) + _HEADER.size:])
+        size = (lemmas + 7) // 8
+        return cls(payload[:size], payload[size:].decode("utf-8").split("\n") if len(payload) > size else ())
+
+    def save(self, path):
+        """Write the model atomically (temporary file, then rename)"""
+        path = Path(path)
+        temp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        payload = bytes(self.bitmap) + "\n".join(sorted(self.extra)).encode("utf-8")
+        temp.write_bytes(_MAGIC + _HEADER.pack(len(load_frequency_index())) + zlib.compress(payload, 9))
+        os.replace(temp, path)
+
+    # -- lookups -------------------------------------------------------------
+
+    @staticmethod
+    def lemma_rank(word: str) -> Tuple[str, Optional[int]]:
+        """A word's lemma and frequency rank (None if it is not on the list)"""
+        return load_frequency_index().lemma_rank(normalize_token(word.strip().lower()))
+
+    def knows_rank(self, rank: Optional[int]) -> bool:
+        return rank is not None and bool(self.bitmap[(rank - 1) >> 3] >> ((rank - 1) & 7) & 1)
+
+    def knows(self, lemma: str, rank: Optional[int]) -> bool:
+        """Whether the learner knows a lemma whose rank is already looked up"""
+        return self.knows_rank(rank) if rank is not None else lemma in self.extra
+
+    def __contains__(self, word: str) -> bool:
+        return self.knows(*self.lemma_rank(word))
+
+    def __len__(self) -> int:
+        return bin(self.bitset).count("1") + len(self.extra)
+
+    @property
+    def bitset(self) -> int:
+        """The bitmap as one integer (bit rank - 1), for intersections and ted_recommend"""
+        if self._bitset is None:
+            self._bitset = int.from_bytes(self.bitmap, "little")
+        return self._bitset
+
+    def intersection(self, bits: int) -> int:
+        """The known lemmas among a bitset such as rank_bitset(talk ranks)"""
+        return self.bitset & bits
+
+    @property
+    def fingerprint(self) -> str:
+        """Changes whenever the known words do (part of the batch cache key)"""
+        digest = hashlib.sha256(self.bitmap)
+        digest.update("\n".join(sorted(self.extra)).encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    # -- updates -------------------------------------------------------------
+
+    def _set(self, word: str, known: bool) -> bool:
+        """Mark a word's lemma known or unknown; True if that changed anything"""
+        lemma, rank = self.lemma_rank(word)
+        if self.knows(lemma, rank) == known:
+            return False
+        if rank is not None:
+            self.bitmap[(rank - 1) >> 3] ^= 1 << ((rank - 1) & 7)
+            self._bitset = None
+        elif known:
+            if not is_word(lemma):  # e.g. a sentence on the front of a card
+                return False
+            self.extra.add(lemma)
+        else:
+            self.extra.discard(lemma)
+        return True
+
+    def add(self, word: str) -> bool:
+        return self._set(word, True)
+
+    def discard(self, word: str) -> bool:
+        return self._set(word, False)
+
+    def apply_reviews(self, reviews: Iterable[Tuple[str, int]]) -> int:
+        """Update from (word, Anki ease) reviews in the order they happened.
+
+        Good and Easy mark the word known, Again unknown; Hard changes
+        nothing. Returns the number of words whose state changed (counting a
+        word again each time it flips).
+        """
+        changed = 0
+        for word, ease in reviews:
+            if ease >= GOOD:
+                changed += self.add(word)
+            elif ease == AGAIN:
+                changed += self.discard(word)
+        return changed
+
+
+def card_word(fields: str) -> str:
+    """The word an Anki note is about, from its fields (separated by \\x1f).
+
+    Word cards have it as the front; the review kit's "Fill in: ..."
+    cards start their back with it ("word | example").
+    """
+    parts = [_TAGS.sub("", field).strip() for field in fields.split("\x1f")]
+    if parts[0].startswith("Fill in:") and len(parts) > 1:
+        return parts[1].split("|", 1)[0].strip()
+    return parts[0]
+
+
+def read_anki_reviews(collection) -> Iterator[Tuple[str, int]]:
+    """(word, ease) of every review in an Anki collection (collection.anki2), oldest first"""
+    connection = sqlite3.connect(f"file:{Path(collection)}?mode=ro", uri=True)
+    try:
+        rows = connection.execute(
+            "SELECT notes.flds, revlog.ease FROM revlog "
+            "JOIN cards ON cards.id = revlog.cid JOIN notes ON notes.id = cards.nid "
+            "WHERE revlog.ease > 0 ORDER BY revlog.id"
+        )
+        for fields, ease in rows:
+            yield card_word(fields), ease
+    finally:
+        connection.close()
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) < 2 or args[0] not in ("init", "update", "info") or \
+            (args[0] == "init" and len(args) != 4) or (args[0] == "update" and len(args) != 3):
+        print(__doc__.strip())
+        return 1
+    path = args[1]
+    if args[0] == "init":
+        KnownWords.from_vocabulary_size(int(args[3])).save(path)
+    elif args[0] == "update":
+        known = KnownWords.load(path)
+        changed = known.apply_reviews(read_anki_reviews(args[2]))
+        known.save(path)
+        print(f"{changed} words changed")
+    known = KnownWords.load(path)
+    print(f"{path}: {len(known)} known words, {os.path.getsize(path)} bytes on disk")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
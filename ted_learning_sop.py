@@ -5,13 +5,36 @@ A comprehensive system for processing TED transcripts into structured learning m
 """
 
 import re
-import json
-from typing import List, Dict, Tuple, Optional
-from dataclasses import dataclass, asdict
-from datetime import datetime
-import csv
+import math
+import time
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from itertools import accumulate
+from typing import TYPE_CHECKING, List, Dict, Tuple, Optional, Iterator, TextIO
+from dataclasses import dataclass
+from contextlib import contextmanager
+from functools import cached_property, wraps
 from io import StringIO
 
+from ted_subtitles import iter_cues, looks_like_subtitles, format_timestamp
+from ted_tokenizer import TokenizedText, tokenize, split_clauses
+from ted_frequency import STOPWORDS, load_frequency_index, normalize_token, is_word
+from ted_sections import SECTIONS, select_sections
+
+# Phrase mining, subtitle alignment and the global glossary are imported where
+# they are first needed, so importing this module (and `ted_cli.py --help`)
+# stays cheap; see test_startup_time in run_all_tests.py
+if TYPE_CHECKING:
+    from ted_bilingual import BilingualTranscript
+    from ted_difficulty import DifficultyReport
+    from ted_known_words import KnownWords
+
+
+# Bump whenever generate_markdown_output changes what it produces for the same
+# input, so incremental builds (see ted_batch.BuildCache) regenerate packages.
+GENERATOR_VERSION = "1.9"
+
 
 @dataclass
 class LearnerProfile:
@@ -22,6 +45,8 @@ class LearnerProfile:
     output_language: str  # "bilingual" or "english_only"
     subtitle_format: str  # "srt" or "plain_text"
     output_style: str  # "complete" or "simplified"
+    sections: Optional[List[str]] = None  # explicit section names (see SECTIONS); overrides output_style
+    known_words: Optional["KnownWords"] = None  # the learner's known lemmas (see ted_known_words)
 
 
 @dataclass
@@ -36,6 +61,7 @@ class VocabularyItem:
     original_sentence: str
     timestamp: str
     teacher_example: str
+    original_translation: str = ""  # from aligned Chinese subtitles, if any
 
 
 @dataclass
@@ -46,6 +72,7 @@ class PhrasePattern:
     variants: List[str]
     original_excerpt: str
     transfer_examples: Dict[str, str]  # Simple, Natural, Stretch
+    excerpt_translation: str = ""  # from aligned Chinese subtitles, if any
 
 
 @dataclass
@@ -86,6 +113,56 @@ class ReviewKit:
     seven_day_plan: List[Dict[str, str]]
 
 
+_NOISE_MARKER = re.compile(r'\[.*?\]')
+_BLANK_LINES = re.compile(r'\n\s*\n')
+
+
+# Hand-written learner notes for common TED vocabulary; extracted words that
+# are not listed here keep the talk's own sentence and collocations, and take
+# their Chinese meaning from the talk's glossary or the global one (ted_glossary).
+# word: (IPA, POS, Chinese meaning, English gloss, collocations, teacher example)
+_LEXICON = {
+    "innovation": ("/ˌɪnəˈveɪʃn/", "n.", "创新", "the introduction of new ideas or methods",
+                   ["technological innovation", "drive innovation"],
+                   "Innovation in education can transform learning experiences."),
+    "perspective": ("/pərˈspektɪv/", "n.", "观点；视角", "a particular way of viewing things",
+                    ["from my perspective", "gain perspective"],
+                    "Understanding different perspectives helps us make better decisions."),
+    "sustainable": ("/səˈsteɪnəbl/", "adj.", "可持续的", "able to be maintained at a certain level",
+                    ["sustainable development", "sustainable practices"],
+                    "Sustainable practices are essential for our planet's future."),
+}
+
+
+# Discourse phrases worth teaching whenever a talk uses them
+# expression: (usage note, variants, transfer examples)
+_PHRASEBOOK = {
+    "in other words": ("Used to rephrase or clarify what was just said",
+                       ["to put it another way", "that is to say"],
+                       {"Simple": "This means we must do something soon.",
+                        "Natural": "In other words, immediate action is required.",
+                        "Stretch": "Put another way, the exigency of the situation demands swift intervention."}),
+    "on the other hand": ("Used to present a contrasting point",
+                          ["conversely", "by contrast"],
+                          {"Simple": "But we could also wait and see.",
+                           "Natural": "On the other hand, we might benefit from patience.",
+                           "Stretch": "Conversely, a more measured approach might yield superior outcomes."}),
+}
+
+
+def _stage(name: str):
+    """Report each call of the decorated method to the processor's hooks as stage name"""
+    def decorate(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.hooks:
+                return method(self, *args, **kwargs)
+            with self.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
 class TEDTranscriptProcessor:
     """Main processor for TED transcripts"""
     
@@ -93,53 +170,142 @@ class TEDTranscriptProcessor:
         self.profile = profile
         self.duration = 0
         self.difficulty_score = 0
-        
+        # Cue timing for the last cleaned transcript: character offset of each
+        # cue in the cleaned text and its start time (both empty for plain text)
+        self.cue_offsets = array('L')
+        self.cue_starts_ms = array('L')
+        self._tokens: Optional[TokenizedText] = None
+        # Aligned Chinese subtitles for the current package (see ted_bilingual)
+        self.bilingual: Optional["BilingualTranscript"] = None
+        self._lemmas: Optional[Tuple[TokenizedText, Tuple]] = None
+        # Objects told when each stage starts and finishes (see ted_profiling)
+        self.hooks: List = []
+        # Corpus statistics (a ted_corpus.CorpusStats); when set, difficulty is the
+        # talk's percentile rank in the corpus and vocabulary keyness uses IDF
+        self.corpus = None
+    
+    @contextmanager
+    def stage(self, name: str):
+        """Bracket a stage of work with the hooks' stage_started/stage_finished calls"""
+        if not self.hooks:
+            yield
+            return
+        for hook in self.hooks:
+            hook.stage_started(name)
+        try:
+            yield
+        finally:
+            for hook in reversed(self.hooks):
+                hook.stage_finished(name)
+        
+    @_stage("clean")
     def clean_transcript(self, transcript: str) -> str:
         """Clean and normalize transcript text"""
-        # Remove SRT timestamps
-        text = re.sub(r'\d{2}:\d{2}:\d{2},\d{3}\s*-->\s*\d{2}:\d{2}:\d{2},\d{3}', '', transcript)
-        # Remove sequence numbers at start of lines
-        text = re.sub(r'^\d+\s*$', '', text, flags=re.MULTILINE)
+        self.cue_offsets = array('L')
+        self.cue_starts_ms = array('L')
+        
+        if looks_like_subtitles(transcript):
+            # Parse SRT/VTT cues, keeping where each cue lands in the clean text
+            pieces = []
+            length = 0
+            for cue in iter_cues(StringIO(transcript)):
+                text = " ".join(_NOISE_MARKER.sub('', cue.text).split())
+                if not text:
+                    continue
+                self.cue_offsets.append(length)
+                self.cue_starts_ms.append(cue.start_ms)
+                pieces.append(text)
+                length += len(text) + 1
+            return "\n".join(pieces)
+        
         # Remove noise markers
-        text = re.sub(r'\[.*?\]', '', text)
+        text = _NOISE_MARKER.sub('', transcript)
         # Clean up extra whitespace
-        text = re.sub(r'\n\s*\n', '\n', text)
+        text = _BLANK_LINES.sub('\n', text)
         text = text.strip()
         return text
     
-    def segment_by_meaning(self, text: str, max_words: int = 18) -> List[str]:
-        """Segment text into meaningful chunks"""
-        sentences = re.split(r'[.!?]+', text)
+    def timestamp_at(self, offset: int) -> str:
+        """Timestamp (HH:MM:SS) of the cue containing a clean-text offset, or '' for plain text"""
+        position = bisect_right(self.cue_offsets, offset) - 1
+        if position < 0:
+            return ""
+        return format_timestamp(self.cue_starts_ms[position])
+    
+    def _time_at(self, offset: int) -> int:
+        """Start time (ms) of the cue containing a clean-text offset"""
+        return self.cue_starts_ms[max(0, bisect_right(self.cue_offsets, offset) - 1)]
+    
+    def sentence_translation(self, tokens: TokenizedText, i: int) -> str:
+        """Chinese for sentence i from the aligned subtitles ('' without them)"""
+        if self.bilingual is None or not self.cue_offsets:
+            return ""
+        start = tokens.sentence_starts[i]
+        end = start + len(tokens.sentences[i]) - 1
+        return self.bilingual.translation_between(self._time_at(start), self._time_at(end))
+    
+    def tokenize(self, text: str) -> TokenizedText:
+        """Tokenize text once; later stages asking for the same text share the result"""
+        if self._tokens is None or self._tokens.text != text:
+            with self.stage("tokenize"):
+                self._tokens = tokenize(text)
+        return self._tokens
+    
+    @_stage("segment")
+    def segment_by_meaning(self, text: str, max_words: int = 18,
+                           with_timestamps: bool = False) -> List:
+        """Segment text into meaningful chunks.
+        
+        With with_timestamps=True, returns (segment, timestamp) pairs using the
+        cue timing recorded by clean_transcript.
+        """
         segments = []
+        offsets = []
         
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-            
-            words = sentence.split()
-            if len(words) <= max_words:
+        tokens = self.tokenize(text)
+        starts = tokens.sentence_starts if with_timestamps else None
+        
+        for i, (sentence, word_count) in enumerate(tokens.iter_sentences()):
+            if word_count <= max_words:
                 segments.append(sentence)
+                if with_timestamps:
+                    offsets.append(starts[i])
             else:
                 # Split long sentences at commas or conjunctions
-                parts = re.split(r',|\sand\s|\sbut\s|\sor\s', sentence)
-                for part in parts:
-                    part = part.strip()
-                    if part:
-                        segments.append(part)
-        
+                parts = split_clauses(sentence)
+                segments += parts
+                if with_timestamps:
+                    # Locate each part by its first word in the original sentence
+                    position = 0
+                    for part in parts:
+                        head = part.split(None, 1)[0]
+                        position = sentence.find(head, position)
+                        offsets.append(starts[i] + position)
+                        position += len(head)
+        
+        if with_timestamps:
+            return [(segment, self.timestamp_at(offset)) for segment, offset in zip(segments, offsets)]
         return segments
     
+    @_stage("difficulty")
     def calculate_difficulty(self, text: str) -> Tuple[int, str]:
-        """Calculate difficulty score (0-100) and strategy"""
-        words = text.lower().split()
-        unique_words = set(words)
-        
-        # Simple heuristic based on vocabulary diversity and text length
-        vocab_diversity = len(unique_words) / len(words) if words else 0
-        avg_word_length = sum(len(w) for w in words) / len(words) if words else 0
-        
-        score = min(100, int((vocab_diversity * 50) + (avg_word_length * 5)))
+        """Calculate difficulty score (0-100) and strategy.
+        
+        With a corpus of at least min_talks talks, the score is the talk's
+        percentile rank by lexical score, so scores compare across talks.
+        """
+        tokens = self.tokenize(text)
+        word_count = len(tokens)
+        
+        if self.corpus is not None and len(self.corpus) >= self.corpus.min_talks:
+            # How the talk's vocabulary compares with the rest of the corpus
+            counts, ranks, _ = self.lemma_counts(text)
+            score = min(99, int(self.corpus.percentile(self.corpus.lexical_score(counts, ranks))))
+        else:
+            # Simple heuristic based on vocabulary diversity and text length
+            vocab_diversity = len(set(tokens.tokens)) / word_count if word_count else 0
+            avg_word_length = tokens.total_token_chars() / word_count if word_count else 0
+            score = min(100, int((vocab_diversity * 50) + (avg_word_length * 5)))
         
         strategies = {
             (0, 30): "Focus on basic vocabulary and simple sentence structures",
@@ -154,57 +320,190 @@ class TEDTranscriptProcessor:
     
     def estimate_duration(self, text: str) -> float:
         """Estimate speech duration in minutes (assuming 150 words/minute)"""
-        words = len(text.split())
-        return words / 150
+        return len(self.tokenize(text)) / 150
+    
+    def lemma_counts(self, text: str) -> Tuple[Dict[str, int], Dict[str, Optional[int]], Dict[str, str]]:
+        """Content-word lemmas of text: (lemma -> count, lemma -> general-English
+        rank or None if unlisted, surface form -> lemma); computed once per text"""
+        tokens = self.tokenize(text)
+        if self._lemmas is not None and self._lemmas[0] is tokens:
+            return self._lemmas[1]
+        frequency = load_frequency_index()
+        
+        # Group surface forms (already lowercase) by lemma
+        lemma_counts: Dict[str, int] = {}
+        lemma_ranks: Dict[str, Optional[int]] = {}
+        form_lemmas: Dict[str, str] = {}
+        for token, n in Counter(tokens.tokens).items():
+            word = normalize_token(token)
+            if not is_word(word) or word in STOPWORDS:
+                continue
+            lemma, rank = frequency.lemma_rank(word)
+            form_lemmas[token] = lemma
+            lemma_counts[lemma] = lemma_counts.get(lemma, 0) + n
+            lemma_ranks[lemma] = rank
+        
+        # Unlisted words are usually names; keep them only if the talk writes them lowercase
+        unlisted = [lemma for lemma, rank in lemma_ranks.items() if rank is None]
+        if unlisted:
+            written = {normalize_token(t) for t in text.split()}
+            for lemma in unlisted:
+                if lemma not in written:
+                    del lemma_counts[lemma]
+        
+        self._lemmas = (tokens, (lemma_counts, lemma_ranks, form_lemmas))
+        return self._lemmas[1]
     
+    @_stage("extract.vocabulary")
     def extract_vocabulary(self, text: str, count: int = 20) -> List[VocabularyItem]:
-        """Extract core vocabulary items"""
-        # This is a simplified implementation
-        # In production, this would use NLP libraries and frequency analysis
-        
-        vocab_items = []
-        
-        # Sample vocabulary extraction (would be more sophisticated in production)
-        sample_words = [
-            ("innovation", "/ˌɪnəˈveɪʃn/", "n.", "创新", "the introduction of new ideas or methods",
-             ["technological innovation", "drive innovation"], "Innovation is key to progress.", "00:01:23",
-             "Innovation in education can transform learning experiences."),
-            ("perspective", "/pərˈspektɪv/", "n.", "观点；视角", "a particular way of viewing things",
-             ["from my perspective", "gain perspective"], "We need a new perspective.", "00:02:15",
-             "Understanding different perspectives helps us make better decisions."),
-            ("sustainable", "/səˈsteɪnəbl/", "adj.", "可持续的", "able to be maintained at a certain level",
-             ["sustainable development", "sustainable practices"], "We must find sustainable solutions.", "00:03:45",
-             "Sustainable practices are essential for our planet's future."),
-        ]
-        
-        for word_data in sample_words[:count]:
-            vocab_items.append(VocabularyItem(*word_data))
-        
-        return vocab_items
+        """Extract core vocabulary items.
+        
+        Lemmas are scored by how much more often the talk uses them than
+        general English would predict (keyness against the frequency index).
+        Lemmas beyond the learner's vocabulary_size come first; if there are
+        too few, the band just inside it tops up the list. If the profile has
+        a known-word model, it replaces the vocabulary_size cut-off: every
+        lemma the learner does not know is a candidate and known ones never
+        are. With a corpus attached, keyness is weighted by each lemma's IDF
+        across the talks.
+        """
+        tokens = self.tokenize(text)
+        if not tokens.tokens:
+            return []
+        unlisted_rank = len(load_frequency_index()) * 2
+        lemma_counts, lemma_ranks, form_lemmas = self.lemma_counts(text)
+        total = len(tokens.tokens)
+        vocabulary_size = self.profile.vocabulary_size
+        # With a corpus, lemmas that many other talks use too are worth less
+        idf = self.corpus.idf(lemma_counts) if self.corpus is not None else None
+        
+        def keyness(lemma):
+            n = lemma_counts[lemma]
+            rank = lemma_ranks[lemma] or unlisted_rank
+            expected = total * 0.1 / rank  # Zipf's law estimate from general English
+            score = n * math.log(n / expected) if n > expected else 0.0
+            return score * idf[lemma] if idf is not None else score
+        
+        known = self.profile.known_words
+        if known is not None:
+            beyond = [l for l in lemma_counts if not known.knows(l, lemma_ranks[l])]
+            review = []
+        else:
+            beyond = [l for l in lemma_counts if (lemma_ranks[l] or unlisted_rank) > vocabulary_size]
+            review = [l for l in lemma_counts if vocabulary_size // 2 < (lemma_ranks[l] or 0) <= vocabulary_size]
+        selected = sorted(beyond, key=keyness, reverse=True)[:count]
+        if len(selected) < count:
+            selected += sorted(review, key=keyness, reverse=True)[:count - len(selected)]
+        
+        return [self._build_vocabulary_item(text, tokens, lemma, form_lemmas) for lemma in selected]
+    
+    def _build_vocabulary_item(self, text: str, tokens: TokenizedText, lemma: str,
+                               form_lemmas: Dict[str, str]) -> VocabularyItem:
+        """Fill a VocabularyItem from the talk (first use, collocations) and the lexicon"""
+        words = tokens.tokens
+        sentence_ends = list(accumulate(tokens.sentence_token_counts))
+        sentence_starts = set(sentence_ends)  # token i starts a sentence iff i is a previous end
+        first = None
+        neighbours = Counter()
+        for i, token in enumerate(words):
+            if form_lemmas.get(token) != lemma:
+                continue
+            if first is None:
+                first = i
+            # Content-word neighbours within the same clause make the collocations
+            if i > 0 and i not in sentence_starts and words[i - 1][-1:].isalpha() \
+                    and normalize_token(words[i - 1]) not in STOPWORDS:
+                neighbours[f"{normalize_token(words[i - 1])} {normalize_token(token)}"] += 1
+            if i + 1 < len(words) and i + 1 not in sentence_starts and token[-1:].isalpha() \
+                    and normalize_token(words[i + 1]) not in STOPWORDS:
+                neighbours[f"{normalize_token(token)} {normalize_token(words[i + 1])}"] += 1
+        
+        sentence_index = bisect_right(sentence_ends, first)
+        timestamp = self.timestamp_at(tokens.token_starts[first]) if self.cue_offsets else ""
+        
+        ipa, pos, chinese, gloss, collocations, example = _LEXICON.get(lemma, ("", "", "", "", [], ""))
+        form = normalize_token(words[first])
+        if not chinese and self.bilingual is not None:
+            glossary = self.bilingual.glossary
+            chinese = glossary.get(lemma) or glossary.get(form, "")
+        if not chinese:
+            from ted_glossary import load_glossary_index
+            glossary = load_glossary_index()
+            if glossary is not None:
+                chinese = glossary.lookup(lemma, form)
+        if not collocations:
+            collocations = [c for c, n in neighbours.most_common(2) if is_word(c.replace(" ", ""))]
+        
+        return VocabularyItem(
+            word=lemma,
+            ipa=ipa,
+            pos=pos,
+            chinese_meaning=chinese,
+            english_gloss=gloss,
+            collocations=collocations,
+            original_sentence=tokens.sentence(sentence_index),
+            timestamp=timestamp,
+            teacher_example=example,
+            original_translation=self.sentence_translation(tokens, sentence_index)
+        )
     
+    def _sentence_at(self, text: str, offset: int) -> str:
+        """Return the sentence of text that contains offset"""
+        tokens = self.tokenize(text)
+        return tokens.sentence(max(0, bisect_right(tokens.sentence_starts, offset) - 1))
+    
+    @_stage("extract.phrases")
     def extract_phrases(self, text: str, count: int = 10) -> List[PhrasePattern]:
-        """Extract high-frequency phrases and patterns"""
-        phrases = []
-        
-        # Sample phrases (would be extracted from actual text in production)
-        sample_phrases = [
-            ("in other words", "Used to rephrase or clarify what was just said",
-             ["to put it another way", "that is to say"], "In other words, we need to act now.",
-             {"Simple": "This means we must do something soon.",
-              "Natural": "In other words, immediate action is required.",
-              "Stretch": "Put another way, the exigency of the situation demands swift intervention."}),
-            ("on the other hand", "Used to present a contrasting point",
-             ["conversely", "by contrast"], "On the other hand, we could wait.",
-             {"Simple": "But we could also wait and see.",
-              "Natural": "On the other hand, we might benefit from patience.",
-              "Stretch": "Conversely, a more measured approach might yield superior outcomes."}),
-        ]
+        """Extract high-frequency phrases and patterns.
+        
+        Known discourse phrases from the phrasebook that the talk uses come
+        first; the rest are 2-5 word n-grams the talk repeats more often than
+        its word frequencies (smoothed toward general English) would predict.
+        A talk too short to repeat any gets the phrasebook itself, without
+        excerpts, rather than no phrases at all.
+        """
+        tokens = self.tokenize(text)
+        # Normalized words of each sentence, padded so " phrase " matches whole words
+        normalized = {t: normalize_token(t) for t in set(tokens.tokens)}
+        sentence_words = [" " + " ".join(map(normalized.__getitem__, sentence)) + " "
+                          for sentence in tokens.iter_sentence_tokens()]
+        
+        def first_sentence(expression: str) -> Optional[int]:
+            needle = f" {expression} "
+            return next((i for i, words in enumerate(sentence_words) if needle in words), None)
         
-        for phrase_data in sample_phrases[:count]:
-            phrases.append(PhrasePattern(*phrase_data))
-        
-        return phrases
+        phrases = []
+        for expression, (note, variants, examples) in _PHRASEBOOK.items():
+            i = first_sentence(expression)
+            if i is not None:
+                phrases.append(PhrasePattern(expression, note, list(variants), tokens.sentence(i), dict(examples),
+                                             self.sentence_translation(tokens, i)))
+        
+        from ted_phrases import PhraseMiner
+        miner = PhraseMiner()
+        miner.add_document(tokens.iter_sentence_tokens())
+        for mined in miner.top(count, min_count=2, background=load_frequency_index()):
+            if len(phrases) >= count:
+                break
+            if any(f" {p.expression} " in f" {mined.text} " or f" {mined.text} " in f" {p.expression} "
+                   for p in phrases):
+                continue
+            i = first_sentence(mined.text)
+            phrases.append(PhrasePattern(
+                expression=mined.text,
+                usage_note=f"Recurring chunk: used {mined.count} times in this talk",
+                variants=[],
+                original_excerpt=tokens.sentence(i) if i is not None else "",
+                transfer_examples={},
+                excerpt_translation=self.sentence_translation(tokens, i) if i is not None else ""
+            ))
+        
+        if not phrases:
+            phrases = [PhrasePattern(expression, note, list(variants), "", dict(examples))
+                       for expression, (note, variants, examples) in _PHRASEBOOK.items()]
+        return phrases[:count]
     
+    @_stage("generate.listening")
     def generate_listening_exercises(self, text: str) -> ListeningExercise:
         """Generate listening comprehension exercises"""
         warmup = [
@@ -241,6 +540,7 @@ class TEDTranscriptProcessor:
         
         return ListeningExercise(warmup, fill_blanks, detail_questions)
     
+    @_stage("generate.speaking_writing")
     def generate_speaking_writing_tasks(self) -> SpeakingWritingTask:
         """Generate speaking and writing tasks"""
         outline = [
@@ -270,6 +570,7 @@ class TEDTranscriptProcessor:
         
         return SpeakingWritingTask(outline, speaking_cards, writing_task)
     
+    @_stage("generate.scenarios")
     def generate_scenarios_dialogues(self) -> ScenarioDialogue:
         """Generate extended scenarios and dialogues"""
         scenarios = [
@@ -304,6 +605,7 @@ B: That makes sense. When should we start?""",
         
         return ScenarioDialogue(scenarios, dialogues)
     
+    @_stage("generate.shadowing")
     def generate_shadowing_script(self, text: str) -> ShadowingScript:
         """Generate shadowing practice materials"""
         segmented = """Innovation / is the key / to solving / **global** challenges. //
@@ -326,19 +628,22 @@ We **must** / embrace **change** / and think / **creatively**. //
         
         return ShadowingScript(segmented, prosody_tips, practice_speeds)
     
+    @_stage("generate.review")
     def generate_review_kit(self, vocab: List[VocabularyItem]) -> ReviewKit:
         """Generate review materials including Anki cards and study plan"""
         anki_cards = []
         
         for item in vocab[:12]:
+            example = item.teacher_example or item.original_sentence
+            blanked = re.sub(rf'(?i)\b{re.escape(item.word)}\w*', '____', example)
             anki_cards.append({
                 "Front": item.word,
-                "Back": f"{item.chinese_meaning} | {item.english_gloss}",
-                "Tags": f"TED,{item.pos},{self.profile.level}"
+                "Back": " | ".join(m for m in (item.chinese_meaning, item.english_gloss) if m) or example,
+                "Tags": ",".join(t for t in ("TED", item.pos, self.profile.level) if t)
             })
             anki_cards.append({
-                "Front": f"Fill in: {item.teacher_example.replace(item.word, '____')}",
-                "Back": f"{item.word} | {item.teacher_example}",
+                "Front": f"Fill in: {blanked}",
+                "Back": f"{item.word} | {example}",
                 "Tags": f"TED,context,{self.profile.level}"
             })
         
@@ -354,182 +659,270 @@ We **must** / embrace **change** / and think / **creatively**. //
         
         return ReviewKit(anki_cards, seven_day_plan)
     
-    def generate_markdown_output(self, transcript: str) -> str:
-        """Generate complete markdown output following the SOP structure"""
-        
-        # Clean and process transcript
-        clean_text = self.clean_transcript(transcript)
-        self.duration = self.estimate_duration(clean_text)
-        self.difficulty_score, strategy = self.calculate_difficulty(clean_text)
-        
-        # Extract learning materials
-        vocabulary = self.extract_vocabulary(clean_text, 
-                                            count=20 if self.duration > 10 else 15)
-        phrases = self.extract_phrases(clean_text, count=10)
-        listening = self.generate_listening_exercises(clean_text)
-        speaking_writing = self.generate_speaking_writing_tasks()
-        scenarios = self.generate_scenarios_dialogues()
-        shadowing = self.generate_shadowing_script(clean_text)
-        review = self.generate_review_kit(vocabulary)
-        
-        # Build markdown output
-        output = []
-        
-        # Header
-        output.append("# TED English Learning Package")
-        output.append(f"\nGenerated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        
-        # 0. Parameter Echo
-        output.append("# 0. Parameter Echo (参数回显)")
-        output.append(f"\n- **Level (水平)**: {self.profile.level}")
-        output.append(f"- **Vocabulary (词汇量)**: {self.profile.vocabulary_size}")
-        output.append(f"- **Goals (目标)**: {', '.join(self.profile.goals)}")
-        output.append(f"- **Duration (时长)**: {self.duration:.1f} minutes")
-        output.append(f"- **Difficulty Score (难度评分)**: {self.difficulty_score}/100")
-        output.append(f"- **Strategy (策略)**: {strategy}\n")
-        
-        # 1. Overview
-        output.append("# 1. Content Overview (内容总览)")
-        output.append("\n## Summary (摘要)")
-        output.append("\n**Simple Version:**")
-        output.append("This TED talk explores important ideas about innovation and sustainable development. The speaker discusses how we can create positive change through new thinking and collaborative action.")
-        output.append("\n**Natural Version:**")
-        output.append("In this compelling TED presentation, the speaker examines the intersection of innovation and sustainability, arguing that transformative solutions to global challenges require both creative thinking and collective commitment to long-term environmental and social responsibility.")
-        
-        output.append("\n## Key Themes (主题关键词)")
-        output.append("innovation, sustainability, collaboration, technology, global challenges, creative thinking, environmental responsibility, social impact")
-        
-        output.append("\n## Speaker's Main Points (核心观点)")
-        output.append("- Innovation is essential for addressing contemporary global challenges")
-        output.append("- Sustainable practices must be integrated into all aspects of development")
-        output.append("- Collective action and collaboration are necessary for meaningful change")
-        output.append("- Technology can be leveraged as a tool for positive social and environmental impact\n")
-        
-        # 2. Core Vocabulary
-        output.append("# 2. Core Vocabulary (核心词汇表)")
-        output.append("\n| Word | IPA | POS | Meaning (中英) | Collocations | Original Sentence | Teacher Example |")
-        output.append("|------|-----|-----|----------------|--------------|-------------------|-----------------|")
-        
-        for item in vocabulary:
-            collocations = ", ".join(item.collocations)
-            output.append(f"| {item.word} | {item.ipa} | {item.pos} | {item.chinese_meaning} / {item.english_gloss} | {collocations} | {item.original_sentence} ({item.timestamp}) | {item.teacher_example} |")
+    def generate_markdown_output(self, transcript: str, sections: Optional[List[str]] = None,
+                                 translation=None) -> str:
+        """Generate the markdown learning package following the SOP structure.
+        
+        Only the selected sections are built (see select_sections); the
+        intermediates they need are computed on first use and shared.
+        translation (Chinese subtitle text, or a BilingualTranscript) is
+        aligned with SRT/VTT input to fill in Chinese meanings and sentence
+        translations.
+        """
+        return "".join(self.iter_markdown(transcript, sections, translation))
+    
+    def iter_markdown(self, transcript: str, sections: Optional[List[str]] = None,
+                      translation=None) -> Iterator[str]:
+        """Yield the package as text chunks, one per section.
+        
+        Each section is built only when the consumer asks for it, so at most
+        one section's text is held in memory at a time.
+        """
+        package = _PackageContext(self, transcript, translation)
+        yield "# TED English Learning Package\n"
+        yield f"\nGenerated: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+        for i, key in enumerate(select_sections(self.profile, sections)):
+            # Rendered inside the stage; the consumer's handling of the chunk is not part of it
+            with self.stage(f"render.{key}"):
+                text = "\n".join(getattr(self, SECTIONS[key][0])(package))
+            yield ("\n" if i else "") + text + "\n"
+    
+    def write_markdown(self, transcript: str, file: TextIO, sections: Optional[List[str]] = None,
+                       translation=None) -> int:
+        """Stream the package into a text file object; returns characters written"""
+        written = 0
+        for chunk in self.iter_markdown(transcript, sections, translation):
+            file.write(chunk)
+            written += len(chunk)
+        return written
+    
+    def review_kit(self, transcript: str, translation=None) -> ReviewKit:
+        """Just the review kit of a transcript's package (e.g. to export its Anki cards)"""
+        return _PackageContext(self, transcript, translation).review
+    
+    def _render_parameters(self, package: "_PackageContext") -> Iterator[str]:
+        yield "# 0. Parameter Echo (参数回显)"
+        yield f"\n- **Level (水平)**: {self.profile.level}"
+        yield f"- **Vocabulary (词汇量)**: {self.profile.vocabulary_size}"
+        if self.profile.known_words is not None:
+            yield f"- **Known Words (已掌握词汇)**: {len(self.profile.known_words)}"
+        yield f"- **Goals (目标)**: {', '.join(self.profile.goals)}"
+        yield f"- **Duration (时长)**: {self.duration:.1f} minutes"
+        yield f"- **Difficulty Score (难度评分)**: {self.difficulty_score}/100"
+        yield f"- **Readability (可读性)**: {package.readability.summary()}"
+        yield f"- **Strategy (策略)**: {package.strategy}"
+    
+    def _render_overview(self, package: "_PackageContext") -> Iterator[str]:
+        yield "# 1. Content Overview (内容总览)"
+        yield "\n## Summary (摘要)"
+        yield "\n**Simple Version:**"
+        yield "This TED talk explores important ideas about innovation and sustainable development. The speaker discusses how we can create positive change through new thinking and collaborative action."
+        yield "\n**Natural Version:**"
+        yield "In this compelling TED presentation, the speaker examines the intersection of innovation and sustainability, arguing that transformative solutions to global challenges require both creative thinking and collective commitment to long-term environmental and social responsibility."
+        
+        yield "\n## Key Themes (主题关键词)"
+        yield "innovation, sustainability, collaboration, technology, global challenges, creative thinking, environmental responsibility, social impact"
+        
+        yield "\n## Speaker's Main Points (核心观点)"
+        yield "- Innovation is essential for addressing contemporary global challenges"
+        yield "- Sustainable practices must be integrated into all aspects of development"
+        yield "- Collective action and collaboration are necessary for meaningful change"
+        yield "- Technology can be leveraged as a tool for positive social and environmental impact"
+    
+    def _render_vocabulary(self, package: "_PackageContext") -> Iterator[str]:
+        yield "# 2. Core Vocabulary (核心词汇表)"
+        yield "\n| Word | IPA | POS | Meaning (中英) | Collocations | Original Sentence | Teacher Example |"
+        yield "|------|-----|-----|----------------|--------------|-------------------|-----------------|"
         
-        # 3. Phrases and Patterns
-        output.append("\n# 3. High-Frequency Phrases & Patterns (高频短语与句型)")
-        output.append("\n| Expression | Usage Note | Variants | Original Excerpt | Transfer Examples |")
-        output.append("|------------|------------|----------|------------------|-------------------|")
+        for item in package.vocabulary:
+            collocations = ", ".join(item.collocations)
+            original = f"{item.original_sentence} ({item.timestamp})" if item.timestamp else item.original_sentence
+            if item.original_translation and self.profile.output_language == "bilingual":
+                original += f"<br>{item.original_translation}"
+            meaning = " / ".join(m for m in (item.chinese_meaning, item.english_gloss) if m)
+            yield f"| {item.word} | {item.ipa} | {item.pos} | {meaning} | {collocations} | {original} | {item.teacher_example} |"
+    
+    def _render_phrases(self, package: "_PackageContext") -> Iterator[str]:
+        yield "# 3. High-Frequency Phrases & Patterns (高频短语与句型)"
+        yield "\n| Expression | Usage Note | Variants | Original Excerpt | Transfer Examples |"
+        yield "|------------|------------|----------|------------------|-------------------|"
         
-        for phrase in phrases:
+        for phrase in package.phrases:
             variants = ", ".join(phrase.variants)
             examples = " | ".join([f"**{k}**: {v}" for k, v in phrase.transfer_examples.items()])
-            output.append(f"| {phrase.expression} | {phrase.usage_note} | {variants} | {phrase.original_excerpt} | {examples} |")
-        
-        # 4. Grammar Mini-Lessons
-        output.append("\n# 4. Grammar & Expression Mini-Lessons (语法与表达微课)")
-        output.append("\n## Lesson 1: Parallel Structure (平行结构)")
-        output.append("**Rule**: Use consistent grammatical forms when listing items or ideas.")
-        output.append("**Template**: We need to [verb], [verb], and [verb].")
-        output.append("**Example**: We need to *innovate*, *collaborate*, and *persevere*.")
-        
-        output.append("\n## Lesson 2: Emphasis with 'It is...that' (强调句型)")
-        output.append("**Rule**: Use 'It is...that/who' to emphasize specific elements.")
-        output.append("**Template**: It is [emphasized element] that [rest of sentence].")
-        output.append("**Example**: It is *through collective action* that we will succeed.\n")
-        
-        # 5. Listening Training
-        output.append("# 5. Listening Training (听力训练)")
-        output.append("\n## Pre-Listening Warm-up (听前热身)")
+            excerpt = phrase.original_excerpt
+            if phrase.excerpt_translation and self.profile.output_language == "bilingual":
+                excerpt += f"<br>{phrase.excerpt_translation}"
+            yield f"| {phrase.expression} | {phrase.usage_note} | {variants} | {excerpt} | {examples} |"
+    
+    def _render_grammar(self, package: "_PackageContext") -> Iterator[str]:
+        yield "# 4. Grammar & Expression Mini-Lessons (语法与表达微课)"
+        yield "\n## Lesson 1: Parallel Structure (平行结构)"
+        yield "**Rule**: Use consistent grammatical forms when listing items or ideas."
+        yield "**Template**: We need to [verb], [verb], and [verb]."
+        yield "**Example**: We need to *innovate*, *collaborate*, and *persevere*."
+        
+        yield "\n## Lesson 2: Emphasis with 'It is...that' (强调句型)"
+        yield "**Rule**: Use 'It is...that/who' to emphasize specific elements."
+        yield "**Template**: It is [emphasized element] that [rest of sentence]."
+        yield "**Example**: It is *through collective action* that we will succeed."
+    
+    def _render_listening(self, package: "_PackageContext") -> Iterator[str]:
+        listening = package.listening
+        yield "# 5. Listening Training (听力训练)"
+        yield "\n## Pre-Listening Warm-up (听前热身)"
         for i, q in enumerate(listening.warmup_questions, 1):
-            output.append(f"{i}. {q}")
+            yield f"{i}. {q}"
         
-        output.append("\n## Fill in the Blanks (听中填空)")
+        yield "\n## Fill in the Blanks (听中填空)"
         for i, item in enumerate(listening.fill_blanks, 1):
-            output.append(f"{i}. {item['sentence']}")
+            yield f"{i}. {item['sentence']}"
         
-        output.append("\n<details><summary>Answers & Explanations (答案与解析)</summary>\n")
+        yield "\n<details><summary>Answers & Explanations (答案与解析)</summary>\n"
         for i, item in enumerate(listening.fill_blanks, 1):
-            output.append(f"{i}. **{item['answer']}** - {item['explanation']}")
-        output.append("\n</details>")
+            yield f"{i}. **{item['answer']}** - {item['explanation']}"
+        yield "\n</details>"
         
-        output.append("\n## Detail Questions (细节判断) - True/False/Not Given")
+        yield "\n## Detail Questions (细节判断) - True/False/Not Given"
         for i, item in enumerate(listening.detail_questions, 1):
-            output.append(f"{i}. {item['question']}")
+            yield f"{i}. {item['question']}"
         
-        output.append("\n<details><summary>Answers & Location (答案与定位)</summary>\n")
+        yield "\n<details><summary>Answers & Location (答案与定位)</summary>\n"
         for i, item in enumerate(listening.detail_questions, 1):
-            output.append(f"{i}. **{item['answer']}** - {item['location']}")
-        output.append("\n</details>\n")
-        
-        # 6. Speaking & Writing
-        output.append("# 6. Speaking & Writing (口语与写作)")
-        output.append("\n## Summary Outline (要点复述提纲)")
+            yield f"{i}. **{item['answer']}** - {item['location']}"
+        yield "\n</details>"
+    
+    def _render_speaking_writing(self, package: "_PackageContext") -> Iterator[str]:
+        speaking_writing = package.speaking_writing
+        yield "# 6. Speaking & Writing (口语与写作)"
+        yield "\n## Summary Outline (要点复述提纲)"
         for point in speaking_writing.summary_outline:
-            output.append(point)
+            yield point
         
-        output.append("\n## Speaking Cards (即兴口语卡片)")
+        yield "\n## Speaking Cards (即兴口语卡片)"
         for i, card in enumerate(speaking_writing.speaking_cards, 1):
-            output.append(f"\n**Card {i}**: {card['prompt']}")
-            output.append(f"*Evaluation Criteria*: {card['criteria']}")
-        
-        output.append("\n## Writing Task (段落写作)")
-        output.append(f"\n**Prompt**: {speaking_writing.writing_task['prompt']}")
-        output.append(f"\n**Opening Sentence**: {speaking_writing.writing_task['starter']}")
-        output.append(f"\n**Structure**: {speaking_writing.writing_task['structure']}")
-        output.append(f"\n**Key Phrases**: {', '.join(speaking_writing.writing_task['key_phrases'])}\n")
-        
-        # 7. Scenarios & Dialogues
-        output.append("# 7. Extended Scenarios & Dialogues (场景扩展与模拟对话)")
-        output.append("\n## Scenarios (扩展情景)")
+            yield f"\n**Card {i}**: {card['prompt']}"
+            yield f"*Evaluation Criteria*: {card['criteria']}"
+        
+        yield "\n## Writing Task (段落写作)"
+        yield f"\n**Prompt**: {speaking_writing.writing_task['prompt']}"
+        yield f"\n**Opening Sentence**: {speaking_writing.writing_task['starter']}"
+        yield f"\n**Structure**: {speaking_writing.writing_task['structure']}"
+        yield f"\n**Key Phrases**: {', '.join(speaking_writing.writing_task['key_phrases'])}"
+    
+    def _render_scenarios(self, package: "_PackageContext") -> Iterator[str]:
+        scenarios = package.scenarios
+        yield "# 7. Extended Scenarios & Dialogues (场景扩展与模拟对话)"
+        yield "\n## Scenarios (扩展情景)"
         for i, scenario in enumerate(scenarios.scenarios, 1):
-            output.append(f"\n**Scenario {i}: {scenario['title']}**")
-            output.append(f"- Context: {scenario['context']}")
-            output.append(f"- Key Expressions: {scenario['key_expressions']}")
+            yield f"\n**Scenario {i}: {scenario['title']}**"
+            yield f"- Context: {scenario['context']}"
+            yield f"- Key Expressions: {scenario['key_expressions']}"
         
-        output.append("\n## Dialogues (模拟对话)")
+        yield "\n## Dialogues (模拟对话)"
         for i, dialogue in enumerate(scenarios.dialogues, 1):
-            output.append(f"\n**Dialogue {i}: {dialogue['title']}**")
-            output.append(f"\n*Setting*: {dialogue['setting']}")
-            output.append(f"\n```\n{dialogue['dialogue']}\n```")
-            output.append(f"\n*Roles*: {dialogue['roles']}")
-            output.append(f"\n*Replaceable Expressions*: {dialogue['replaceable']}\n")
-        
-        # 8. Shadowing & Prosody
-        output.append("# 8. Shadowing & Prosody (跟读与语音)")
-        output.append("\n## Segmented Script (断句稿)")
-        output.append(f"\n```\n{shadowing.segmented_script}\n```")
-        output.append("\n*Legend*: / = pause, // = longer pause, **bold** = stress")
-        
-        output.append("\n## Prosody Tips (语音提示)")
+            yield f"\n**Dialogue {i}: {dialogue['title']}**"
+            yield f"\n*Setting*: {dialogue['setting']}"
+            yield f"\n```\n{dialogue['dialogue']}\n```"
+            yield f"\n*Roles*: {dialogue['roles']}"
+            yield f"\n*Replaceable Expressions*: {dialogue['replaceable']}"
+    
+    def _render_shadowing(self, package: "_PackageContext") -> Iterator[str]:
+        shadowing = package.shadowing
+        yield "# 8. Shadowing & Prosody (跟读与语音)"
+        yield "\n## Segmented Script (断句稿)"
+        yield f"\n```\n{shadowing.segmented_script}\n```"
+        yield "\n*Legend*: / = pause, // = longer pause, **bold** = stress"
+        
+        yield "\n## Prosody Tips (语音提示)"
         for tip in shadowing.prosody_tips:
-            output.append(tip)
+            yield tip
         
-        output.append("\n## Practice Speeds (练习速度)")
+        yield "\n## Practice Speeds (练习速度)"
         for speed, desc in shadowing.practice_speeds.items():
-            output.append(f"- **{speed}**: {desc}\n")
-        
-        # 9. Review Kit
-        output.append("# 9. Review Kit (巩固复习材料)")
-        output.append("\n## Anki Cards (CSV Preview)")
-        output.append("\n| Front | Back | Tags |")
-        output.append("|-------|------|------|")
+            yield f"- **{speed}**: {desc}"
+    
+    def _render_review(self, package: "_PackageContext") -> Iterator[str]:
+        review = package.review
+        yield "# 9. Review Kit (巩固复习材料)"
+        yield "\n## Anki Cards (CSV Preview)"
+        yield "\n| Front | Back | Tags |"
+        yield "|-------|------|------|"
         for card in review.anki_cards[:12]:
-            output.append(f"| {card['Front']} | {card['Back']} | {card['Tags']} |")
+            yield f"| {card['Front']} | {card['Back']} | {card['Tags']} |"
         
-        output.append("\n## 7-Day Micro-Learning Plan (7天微学习计划)")
-        output.append("\n| Day | Duration | Task | Goal |")
-        output.append("|-----|----------|------|------|")
+        yield "\n## 7-Day Micro-Learning Plan (7天微学习计划)"
+        yield "\n| Day | Duration | Task | Goal |"
+        yield "|-----|----------|------|------|"
         for day in review.seven_day_plan:
-            output.append(f"| {day['Day']} | {day['Duration']} | {day['Task']} | {day['Goal']} |")
-        
-        output.append("\n---")
-        output.append("\n## Quality Assurance (质量保证)")
-        output.append("- ✓ All terminology is accurate and examples are authentic")
-        output.append("- ✓ Content difficulty matches learner profile")
-        output.append("- ✓ Timestamps provided where available")
-        output.append("- ✓ Bilingual explanations included")
-        output.append("- ✓ Materials follow systematic learning progression\n")
-        
-        return "\n".join(output)
+            yield f"| {day['Day']} | {day['Duration']} | {day['Task']} | {day['Goal']} |"
+        
+        yield "\n---"
+        yield "\n## Quality Assurance (质量保证)"
+        yield "- ✓ All terminology is accurate and examples are authentic"
+        yield "- ✓ Content difficulty matches learner profile"
+        yield "- ✓ Timestamps provided where available"
+        yield "- ✓ Bilingual explanations included"
+        yield "- ✓ Materials follow systematic learning progression"
+
+
+class _PackageContext:
+    """Intermediate results for one package, each computed on first use.
+    
+    Cleaning, duration and difficulty are needed by every package (the
+    parameter echo and the CLI report them); everything else is built only
+    if a selected section asks for it, and at most once (the review kit
+    reuses the vocabulary table's items).
+    """
+    
+    def __init__(self, processor: TEDTranscriptProcessor, transcript: str, translation=None):
+        self.processor = processor
+        self.clean_text = processor.clean_transcript(transcript)
+        # Chinese subtitles can only be aligned with timed (SRT/VTT) English
+        if isinstance(translation, str):
+            from ted_bilingual import BilingualTranscript
+            with processor.stage("align"):
+                translation = BilingualTranscript.from_text(transcript, translation) \
+                    if translation.strip() and processor.cue_offsets else None
+        processor.bilingual = translation
+        processor.duration = processor.estimate_duration(self.clean_text)
+        processor.difficulty_score, self.strategy = processor.calculate_difficulty(self.clean_text)
+    
+    @cached_property
+    def readability(self) -> "DifficultyReport":
+        from ted_difficulty import DifficultyEngine, extract_features
+        with self.processor.stage("readability"):
+            features = extract_features(self.processor, self.clean_text)
+            return DifficultyEngine([features]).report(0, self.processor.profile)
+    
+    @cached_property
+    def vocabulary(self) -> List[VocabularyItem]:
+        count = 20 if self.processor.duration > 10 else 15
+        return self.processor.extract_vocabulary(self.clean_text, count=count)
+    
+    @cached_property
+    def phrases(self) -> List[PhrasePattern]:
+        return self.processor.extract_phrases(self.clean_text, count=10)
+    
+    @cached_property
+    def listening(self) -> ListeningExercise:
+        return self.processor.generate_listening_exercises(self.clean_text)
+    
+    @cached_property
+    def speaking_writing(self) -> SpeakingWritingTask:
+        return self.processor.generate_speaking_writing_tasks()
+    
+    @cached_property
+    def scenarios(self) -> ScenarioDialogue:
+        return self.processor.generate_scenarios_dialogues()
+    
+    @cached_property
+    def shadowing(self) -> ShadowingScript:
+        return self.processor.generate_shadowing_script(self.clean_text)
+    
+    @cached_property
+    def review(self) -> ReviewKit:
+        return self.processor.generate_review_kit(self.vocabulary)
 
 
 def main():
@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+"""
+Storage backends for the TED Material Library
+MaterialLibrary keeps its materials in memory and reports every change to a
+storage backend:
+
+    JSONStorage    the original material_library.json file (rewritten per change)
+    SQLiteStorage  a SQLite database in WAL mode; changes are row-level and
+                   transactional, and several processes can share the file
+
+open_storage() picks the backend from the file suffix (.db/.sqlite/.sqlite3
+-> SQLite). Move an existing JSON library (either format) to SQLite with:
+    python3 ted_library_storage.py migrate material_library.json material_library.db
+"""
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from ted_search import FIELD_WEIGHTS
+
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+# Columns of the materials table, in material-dict key order; any other keys
+# a material carries are kept as JSON in the "extra" column
+_COLUMNS = ("id", "url", "title", "description", "date_added", "processed",
+            "transcript_file", "learning_package_file")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS materials (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    title TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT '',
+    date_added TEXT NOT NULL,
+    processed INTEGER NOT NULL DEFAULT 0,
+    transcript_file TEXT,
+    learning_package_file TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS materials_pending ON materials (id) WHERE processed = 0;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    material_id INTEGER PRIMARY KEY,
+    worker TEXT NOT NULL,
+    expires REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+"""
+
+# Full-text index (rowid = material id) for search(); BM25 weights follow
+# ted_search.FIELD_WEIGHTS
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS materials_fts
+USING fts5(title, description, transcript, tokenize = 'porter unicode61')
+"""
+_FTS_SYNC = """
+DELETE FROM materials_fts WHERE rowid NOT IN (SELECT id FROM materials);
+UPDATE materials_fts SET
+    title = (SELECT title FROM materials WHERE id = materials_fts.rowid),
+    description = (SELECT description FROM materials WHERE id = materials_fts.rowid);
+INSERT INTO materials_fts (rowid, title, description, transcript)
+    SELECT id, title, description, '' FROM materials
+    WHERE id NOT IN (SELECT rowid FROM materials_fts);
+"""
+_QUERY_WORD = re.compile(r"\w+")
+
+
+def _fsync_directory(path: Path):
+    """Persist a rename in path (a no-op where directories cannot be opened)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class JSONStorage:
+    """Whole-file JSON storage (the original material_library.json format).
+
+    The storage keeps the materials by id (the same dicts the library
+    mutates); insert/update/delete apply their changes to that map and
+    rewrite the file from it. It has no search of its own; the library keeps
+    an in-memory ted_search.SearchIndex instead.
+    """
+
+    has_search = False
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._materials: Dict[int, Dict] = {}
+        self._next_id = 1
+
+    def load(self) -> Tuple[List[Dict], int]:
+        """Load existing library or create new one"""
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+                # Handle both old format (list) and new format (dict with metadata)
+                if isinstance(data, list):
+                    materials = data
+                    next_id = max([m['id'] for m in materials], default=0) + 1
+                else:
+                    materials = data.get('materials', [])
+                    next_id = data.get('next_id', max([m['id'] for m in materials], default=0) + 1)
+        else:
+            materials, next_id = [], 1
+        self._materials, self._next_id = {m['id']: m for m in materials}, next_id
+        return materials, next_id
+
+    def save(self, materials: List[Dict], next_id: int):
+        """Save library to file with metadata.
+
+        The file is written to a temporary sibling, fsynced and renamed over
+        the old one, so a crash leaves either the old or the new library.
+        """
+        self._materials, self._next_id = {m['id']: m for m in materials}, next_id
+        data = {
+            'materials': materials,
+            'next_id': next_id
+        }
+        temp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        try:
+            with open(temp, 'w') as f:
+                json.dump(data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.path)
+        except BaseException:
+            temp.unlink(missing_ok=True)
+            raise
+        _fsync_directory(self.path.parent)
+
+    def allocate_ids(self, count: int, next_id: int) -> int:
+        return next_id
+
+    def _apply(self, inserted: List[Dict], updated: List[Dict], deleted: List[int], next_id: int):
+        for material_id in deleted:
+            self._materials.pop(material_id, None)
+        for material in inserted + updated:
+            self._materials[material['id']] = material
+        self.save(list(self._materials.values()), next_id)
+
+    def insert(self, materials: List[Dict], next_id: int):
+        self._apply(materials, [], [], next_id)
+
+    def update(self, materials: List[Dict], transcripts: Optional[Dict[int, str]] = None):
+        self._apply([], materials, [], self._next_id)
+
+    def update_fields(self, changes: Dict[int, Dict]):
+        for material_id, fields in changes.items():
+            if material_id in self._materials:
+                self._materials[material_id].update(fields)
+        self._apply([], [], [], self._next_id)
+
+    def delete(self, material_ids: List[int]):
+        self._apply([], [], material_ids, self._next_id)
+
+    def apply(self, inserted: List[Dict], updated: List[Dict], deleted: List[int],
+              next_id: int, transcripts: Optional[Dict[int, str]] = None):
+        self._apply(inserted, updated, deleted, next_id)
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage:
+    """SQLite storage in WAL mode.
+
+    insert/update/delete take lists and apply them in one transaction, and
+    apply() combines all three, so bulk changes cost one commit. WAL lets readers proceed while another
+    process writes; writers wait up to ``timeout`` seconds for the lock.
+    If SQLite was built with FTS5, titles, descriptions and transcripts are
+    kept in a full-text index in the same transactions (has_search).
+    claim/release/renew_leases/complete hand out pending materials to worker
+    processes (see ted_worker).
+    """
+
+    def __init__(self, path, timeout: float = 30.0):
+        self.path = Path(path)
+        # Autocommit mode; transactions are opened explicitly in _transaction
+        self.connection = sqlite3.connect(str(self.path), timeout=timeout, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_SCHEMA)
+        try:
+            self.connection.execute(_FTS_SCHEMA)
+            self.has_search = True
+        except sqlite3.OperationalError:  # SQLite built without FTS5
+            self.has_search = False
+        if self.has_search:
+            # Covers databases created before the index existed
+            counts = self.connection.execute(
+                "SELECT (SELECT count(*) FROM materials), (SELECT count(*) FROM materials_fts)"
+            ).fetchone()
+            if counts[0] != counts[1]:
+                with self._transaction() as connection:
+                    self._sync_search(connection)
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, rolled back on error"""
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    @staticmethod
+    def _sync_search(connection):
+        """Make the full-text rows match the materials table (transcripts are kept)"""
+        for statement in _FTS_SYNC.split(";"):
+            if statement.strip():
+                connection.execute(statement)
+
+    @staticmethod
+    def _to_row(material: Dict) -> Tuple:
+        extra = {k: v for k, v in material.items() if k not in _COLUMNS}
+        return (material['id'], material['url'], material.get('title') or '',
+                material.get('description') or '', material['date_added'],
+                int(bool(material.get('processed'))), material.get('transcript_file'),
+                material.get('learning_package_file'), json.dumps(extra) if extra else None)
+
+    @staticmethod
+    def _from_row(row: sqlite3.Row) -> Dict:
+        material = {column: row[column] for column in _COLUMNS}
+        material['processed'] = bool(material['processed'])
+        if row['extra']:
+            material.update(json.loads(row['extra']))
+        return material
+
+    def load(self) -> Tuple[List[Dict], int]:
+        materials = [self._from_row(row) for row in
+                     self.connection.execute("SELECT * FROM materials ORDER BY id")]
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+        next_id = int(row[0]) if row else max([m['id'] for m in materials], default=0) + 1
+        return materials, next_id
+
+    def _set_next_id(self, connection, next_id: int):
+        # Never move next_id backwards, even if another process got further
+        connection.execute(
+            "INSERT INTO meta (key, value) VALUES ('next_id', ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))",
+            (next_id,)
+        )
+
+    def save(self, materials: List[Dict], next_id: int):
+        """Replace the stored library with materials"""
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM materials")
+            connection.executemany(f"INSERT INTO materials VALUES ({', '.join('?' * 9)})",
+                                   map(self._to_row, materials))
+            connection.execute("DELETE FROM meta WHERE key = 'next_id'")
+            self._set_next_id(connection, next_id)
+            if self.has_search:
+                self._sync_search(connection)
+
+    def allocate_ids(self, count: int, next_id: int) -> int:
+        """Reserve count consecutive ids; returns the first.
+
+        Starts at the larger of next_id and the stored next_id, so processes
+        sharing the database never hand out the same id twice.
+        """
+        with self._transaction() as connection:
+            row = connection.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+            first = max(next_id, int(row[0]) if row else 1)
+            self._set_next_id(connection, first + count)
+        return first
+
+    def _insert(self, connection, materials: List[Dict], next_id: int):
+        connection.executemany(f"INSERT INTO materials VALUES ({', '.join('?' * 9)})",
+                               map(self._to_row, materials))
+        self._set_next_id(connection, next_id)
+        if self.has_search:
+            connection.executemany(
+                "INSERT INTO materials_fts (rowid, title, description, transcript) VALUES (?, ?, ?, '')",
+                ((m['id'], m.get('title') or '', m.get('description') or '') for m in materials)
+            )
+
+    def _update(self, connection, materials: List[Dict]):
+        connection.executemany(
+            "UPDATE materials SET url = ?, title = ?, description = ?, date_added = ?, "
+            "processed = ?, transcript_file = ?, learning_package_file = ?, extra = ? WHERE id = ?",
+            (row[1:] + row[:1] for row in map(self._to_row, materials))
+        )
+        if self.has_search:
+            connection.executemany(
+                "UPDATE materials_fts SET title = ?, description = ? WHERE rowid = ?",
+                ((m.get('title') or '', m.get('description') or '', m['id']) for m in materials)
+            )
+
+    def _index_transcripts(self, connection, transcripts: Dict[int, str]):
+        if self.has_search and transcripts:
+            connection.executemany("UPDATE materials_fts SET transcript = ? WHERE rowid = ?",
+                                   ((text, i) for i, text in transcripts.items()))
+
+    def _delete(self, connection, material_ids: List[int]):
+        connection.executemany("DELETE FROM materials WHERE id = ?", ((i,) for i in material_ids))
+        connection.executemany("DELETE FROM leases WHERE material_id = ?", ((i,) for i in material_ids))
+        if self.has_search:
+            connection.executemany("DELETE FROM materials_fts WHERE rowid = ?", ((i,) for i in material_ids))
+
+    def insert(self, materials: List[Dict], next_id: int):
+        """Add new materials and record next_id, in one transaction"""
+        with self._transaction() as connection:
+            self._insert(connection, materials, next_id)
+
+    def update(self, materials: List[Dict], transcripts: Optional[Dict[int, str]] = None):
+        """Write back changed materials, in one transaction.
+
+        transcripts maps material ids to transcript text for the search index.
+        """
+        with self._transaction() as connection:
+            self._update(connection, materials)
+            self._index_transcripts(connection, transcripts)
+
+    def update_fields(self, changes: Dict[int, Dict]):
+        """Write only the given fields of materials (material id -> {field: value}), in one transaction.
+
+        Unlike update(), columns a change does not name keep whatever is
+        stored, so other processes' changes to the same rows survive. Extra
+        fields are merged into the stored ones (a None value removes one).
+        """
+        with self._transaction() as connection:
+            for material_id, fields in changes.items():
+                columns = [column for column in _COLUMNS[1:] if column in fields]
+                extra = {k: v for k, v in fields.items() if k not in _COLUMNS}
+                assignments = [f"{column} = ?" for column in columns]
+                values = [int(bool(fields[c])) if c == "processed" else fields[c] for c in columns]
+                if extra:
+                    assignments.append("extra = json_patch(coalesce(extra, '{}'), ?)")
+                    values.append(json.dumps(extra))
+                if not assignments:
+                    continue
+                connection.execute(f"UPDATE materials SET {', '.join(assignments)} WHERE id = ?",
+                                   values + [material_id])
+                if self.has_search and ("title" in fields or "description" in fields):
+                    connection.execute(
+                        "UPDATE materials_fts SET title = (SELECT title FROM materials WHERE id = ?), "
+                        "description = (SELECT description FROM materials WHERE id = ?) WHERE rowid = ?",
+                        (material_id, material_id, material_id))
+
+    def delete(self, material_ids: List[int]):
+        with self._transaction() as connection:
+            self._delete(connection, material_ids)
+
+    def apply(self, inserted: List[Dict], updated: List[Dict], deleted: List[int],
+              next_id: int, transcripts: Optional[Dict[int, str]] = None):
+        """Apply a batch of inserts, updates and deletes as one transaction"""
+        with self._transaction() as connection:
+            self._delete(connection, deleted)
+            self._insert(connection, inserted, next_id)
+            self._update(connection, updated)
+            self._index_transcripts(connection, transcripts)
+
+    def claim(self, worker: str, lease_seconds: float, limit: int = 1,
+              max_attempts: int = 3) -> List[Dict]:
+        """Lease up to limit unprocessed materials to worker.
+
+        A material can be claimed if nobody holds a live lease on it and it
+        has been attempted fewer than max_attempts times; a lease left by a
+        crashed worker becomes claimable again once it expires.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            rows = connection.execute(
+                "SELECT m.* FROM materials m LEFT JOIN leases l ON l.material_id = m.id "
+                "WHERE m.processed = 0 AND (l.material_id IS NULL OR (l.expires < ? AND l.attempts < ?)) "
+                "ORDER BY m.id LIMIT ?",
+                (now, max_attempts, limit)
+            ).fetchall()
+            connection.executemany(
+                "INSERT INTO leases (material_id, worker, expires, attempts) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (material_id) DO UPDATE SET worker = excluded.worker, "
+                "expires = excluded.expires, attempts = attempts + 1",
+                ((row['id'], worker, now + lease_seconds) for row in rows)
+            )
+        return [self._from_row(row) for row in rows]
+
+    @staticmethod
+    def renew_leases(connection, worker: str, material_ids: List[int], lease_seconds: float) -> int:
+        """Extend worker's leases (heartbeat); returns how many it still holds.
+
+        Static so a heartbeat thread can call it on its own connection.
+        """
+        cursor = connection.executemany(
+            "UPDATE leases SET expires = ? WHERE material_id = ? AND worker = ?",
+            ((time.time() + lease_seconds, i, worker) for i in material_ids)
+        )
+        connection.commit()
+        return cursor.rowcount
+
+    def release(self, worker: str, material_id: int, error: Optional[str] = None,
+                retry_after: float = 0.0):
+        """Drop worker's lease: done if error is None, otherwise free for a retry in retry_after seconds"""
+        with self._transaction() as connection:
+            if error is None:
+                connection.execute("DELETE FROM leases WHERE material_id = ? AND worker = ?",
+                                   (material_id, worker))
+            else:
+                connection.execute("UPDATE leases SET worker = '', expires = ?, last_error = ? "
+                                   "WHERE material_id = ? AND worker = ?",
+                                   (time.time() + retry_after, error, material_id, worker))
+
+    def complete(self, worker: str, material_id: int, transcript_file: str, package_file: str,
+                 transcript: str = "") -> bool:
+        """Mark a leased material processed and drop the lease, in one transaction.
+
+        Nothing is written unless worker still holds the lease (it may have
+        expired and gone to another worker); returns whether it did. Only the
+        status columns are written, never a whole (possibly stale) row, so
+        concurrent workers and other writers keep their changes.
+        """
+        with self._transaction() as connection:
+            if not connection.execute("DELETE FROM leases WHERE material_id = ? AND worker = ?",
+                                      (material_id, worker)).rowcount:
+                return False
+            connection.execute("UPDATE materials SET processed = 1, transcript_file = ?, "
+                               "learning_package_file = ? WHERE id = ?",
+                               (transcript_file, package_file, material_id))
+            self._index_transcripts(connection, {material_id: transcript} if transcript else {})
+        return True
+
+    def lease_counts(self, max_attempts: int = 3) -> Dict[str, int]:
+        """Unprocessed materials by lease state.
+
+        pending: claimable now; leased: held by a live worker; retrying: failed,
+        waiting for its retry delay; failed: out of attempts.
+        """
+        row = self.connection.execute(
+            "SELECT "
+            "sum(l.material_id IS NULL OR (l.expires < :now AND l.attempts < :max)), "
+            "sum(l.worker != '' AND l.expires >= :now), "
+            "sum(l.worker = '' AND l.expires >= :now AND l.attempts < :max), "
+            "sum(l.attempts >= :max AND (l.worker = '' OR l.expires < :now)) "
+            "FROM materials m LEFT JOIN leases l ON l.material_id = m.id WHERE m.processed = 0",
+            {"now": time.time(), "max": max_attempts}
+        ).fetchone()
+        return {"pending": row[0] or 0, "leased": row[1] or 0,
+                "retrying": row[2] or 0, "failed": row[3] or 0}
+
+    def search(self, query: str, limit: Optional[int] = 20) -> List[Tuple[int, float]]:
+        """(material id, BM25 score) pairs, best first, from the FTS5 index"""
+        words = _QUERY_WORD.findall(query)
+        if not words:
+            return []
+        # Quote every word so FTS5 query syntax in user input is taken literally
+        match = " OR ".join('"' + word.replace('"', '') + '"' for word in words)
+        weights = ", ".join(str(FIELD_WEIGHTS[field]) for field in ("title", "description", "transcript"))
+        rows = self.connection.execute(
+            f"SELECT rowid, bm25(materials_fts, {weights}) AS rank FROM materials_fts "
+            f"WHERE materials_fts MATCH ? ORDER BY rank LIMIT ?",
+            (match, limit if limit else -1)
+        )
+        return [(material_id, -rank) for material_id, rank in rows]
+
+    def close(self):
+        self.connection.close()
+
+
+def open_storage(path):
+    """JSON or SQLite storage, chosen by file suffix"""
+    path = Path(path)
+    if path.suffix.lower() in SQLITE_SUFFIXES:
+        return SQLiteStorage(path)
+    return JSONStorage(path)
+
+
+def migrate_json_to_sqlite(json_path, sqlite_path) -> int:
+    """One-shot copy of a JSON library (list or dict format) into a new SQLite library.
+
+    Refuses to write into a database that already holds materials.
+    Returns the number of materials migrated.
+    """
+    if not Path(json_path).exists():
+        raise FileNotFoundError(f"JSON library not found: {json_path}")
+    materials, next_id = JSONStorage(json_path).load()
+    target = SQLiteStorage(sqlite_path)
+    try:
+        if target.connection.execute("SELECT 1 FROM materials LIMIT 1").fetchone():
+            raise ValueError(f"SQLite library is not empty: {sqlite_path}")
+        target.insert(materials, next_id)
+    finally:
+        target.close()
+    return len(materials)
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "migrate":
+        count = migrate_json_to_sqlite(sys.argv[2], sys.argv[3])
+        print(f"Migrated {count} materials from {sys.argv[2]} to {sys.argv[3]}")
+        return 0
+    print(__doc__.strip())
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,49 +1,234 @@
 # TED Material Library
 # URL storage and management for TED transcripts
 
-import json
+import re
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import TYPE_CHECKING, List, Dict, Optional, Iterable, Union, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from ted_library_storage import open_storage
+from ted_search import SearchIndex, build_index as build_search_index, read_transcript_text
+
+if TYPE_CHECKING:
+    from ted_recommend import Recommendation
+
+
+# Query parameters that say where a link was shared or where playback starts,
+# never which talk it is
+_IGNORED_PARAMS = {"fbclid", "gclid", "igshid", "si", "feature", "ref", "referrer", "source",
+                   "t", "start", "list", "index", "pp"}
+
+# Hosts whose talk URLs are fully identified by the path (?language=, ?subtitle=
+# etc. only select a view of the same talk)
+_PATH_ONLY_HOSTS = {"ted.com", "embed.ted.com"}
+
+
+def _canonical_parts(url: str) -> Tuple[str, str, str, List[Tuple[str, str]]]:
+    """(scheme, host, path, significant query parameters sorted) of a URL"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme == "http":
+        scheme = "https"
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/")
+    query = parse_qsl(parts.query)
+    if host == "youtu.be" and path:
+        # Short links name the same video as youtube.com/watch?v=
+        host, query, path = "youtube.com", [("v", path.lstrip("/"))] + query, "/watch"
+    if host in _PATH_ONLY_HOSTS:
+        query = []
+    query = sorted((key, value) for key, value in query
+                   if key.lower() not in _IGNORED_PARAMS and not key.lower().startswith("utm_"))
+    return scheme, host, path, query
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a talk URL, used to detect duplicates.
+    
+    Scheme and host are lowercased (http is treated as https, a leading
+    "www." is dropped), the fragment and trailing slash are removed:
+    https://www.TED.com/talks/x/?language=en -> https://ted.com/talks/x
+    
+    Query parameters that identify the talk are kept, sorted, so
+    youtube.com/watch?v=a and ?v=b stay distinct. Tracking and playback
+    parameters (utm_*, fbclid, t, ...) are dropped, as is the whole query
+    on ted.com.
+    """
+    if not urlsplit(url.strip()).netloc:
+        return url.strip().rstrip("/")
+    scheme, host, path, query = _canonical_parts(url)
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+def url_slug(url: str) -> str:
+    """File-name stem for a talk URL's transcript: its last path segment,
+    plus the identifying query values when there are any:
+    https://www.ted.com/talks/my_talk?language=en -> my_talk
+    https://www.youtube.com/watch?v=abc123 -> watch_abc123
+    """
+    _, _, path, query = _canonical_parts(url)
+    slug = "_".join([path.rsplit("/", 1)[-1]] + [value for _, value in query])
+    return re.sub(r"[^A-Za-z0-9._-]+", "-", slug).strip("-._")
 
 
 class MaterialLibrary:
     """Manages a library of TED talk materials"""
     
-    def __init__(self, library_file: str = "material_library.json"):
+    # Ids reserved from storage at a time while a batch is open
+    ID_BLOCK = 256
+    
+    def __init__(self, library_file: str = "material_library.json", storage=None):
+        """Open a library file: .db/.sqlite/.sqlite3 use SQLite, anything else JSON.
+        
+        A custom backend (see ted_library_storage) can be passed as storage.
+        """
         self.library_file = Path(library_file)
-        self.materials, self.next_id = self._load_library()
+        self.storage = storage if storage is not None else open_storage(self.library_file)
+        materials, self.next_id = self._load_library()
+        self._build_indexes(materials)
+        # Changes queued by batch(), written in one storage call when it ends
+        self._batch_depth = 0
+        self._pending_inserts: Dict[int, Dict] = {}
+        self._pending_updates: Dict[int, Dict] = {}
+        self._pending_deletes: List[int] = []
+        self._pending_transcripts: Dict[int, str] = {}
+        self._reserved_ids = iter(())
+        # Talk recommender over the lexical profiles, built on first recommend()
+        self._recommender = None
+    
+    def _build_indexes(self, materials: List[Dict]):
+        """Key materials by id and index them by normalized URL and processed state.
+        
+        The id-keyed dict holds the materials themselves (insertion-ordered,
+        so in the order they were added); every mutation below keeps the
+        indexes in step with it, so adding, finding, updating and removing a
+        material never scans the whole library.
+        """
+        self._by_id: Dict[int, Dict] = {}
+        self._by_url: Dict[str, Dict] = {}
+        self._unprocessed: Dict[int, Dict] = {}  # insertion-ordered, like materials
+        for material in materials:
+            self._by_id[material['id']] = material
+            self._index(material)
+        # Full-text index for storages without their own search; built on first search
+        self._search_index: Optional[SearchIndex] = None
+    
+    @property
+    def materials(self) -> List[Dict]:
+        """All materials, in the order they were added"""
+        return list(self._by_id.values())
+    
+    def _index(self, material: Dict):
+        self._by_url.setdefault(normalize_url(material['url']), material)
+        if not material['processed']:
+            self._unprocessed[material['id']] = material
+    
+    def _unindex(self, material: Dict):
+        key = normalize_url(material['url'])
+        if self._by_url.get(key) is material:
+            del self._by_url[key]
+        self._unprocessed.pop(material['id'], None)
     
     def _load_library(self):
         """Load existing library or create new one"""
-        if self.library_file.exists():
-            with open(self.library_file, 'r') as f:
-                data = json.load(f)
-                # Handle both old format (list) and new format (dict with metadata)
-                if isinstance(data, list):
-                    materials = data
-                    next_id = max([m['id'] for m in materials], default=0) + 1
-                else:
-                    materials = data.get('materials', [])
-                    next_id = data.get('next_id', max([m['id'] for m in materials], default=0) + 1)
-                return materials, next_id
-        return [], 1
+        return self.storage.load()
     
     def _save_library(self):
-        """Save library to file with metadata"""
-        data = {
-            'materials': self.materials,
-            'next_id': self.next_id
-        }
-        with open(self.library_file, 'w') as f:
-            json.dump(data, f, indent=2)
+        """Write the whole library to storage"""
+        self.storage.save(self.materials, self.next_id)
+    
+    def reload(self):
+        """Re-read the library from storage, e.g. to pick up materials another process added"""
+        if self._batch_depth:
+            raise RuntimeError("Cannot reload inside batch()")
+        materials, self.next_id = self._load_library()
+        self._build_indexes(materials)
+    
+    def close(self):
+        self.storage.close()
+    
+    @contextmanager
+    def batch(self):
+        """Group changes into a single storage write.
+        
+        Inside ``with library.batch():`` add_url, mark_processed and
+        remove_material only change the in-memory library; everything is
+        written in one go (one JSON rewrite, or one SQLite transaction) when
+        the outermost batch exits. Changes made before an exception inside
+        the block are still written, since they are already visible in memory.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._flush()
+    
+    def _flush(self):
+        self._reserved_ids = iter(())
+        if not (self._pending_inserts or self._pending_updates or self._pending_deletes):
+            return
+        inserted = list(self._pending_inserts.values())
+        updated = list(self._pending_updates.values())
+        deleted, transcripts = self._pending_deletes, self._pending_transcripts
+        self._pending_inserts, self._pending_updates = {}, {}
+        self._pending_deletes, self._pending_transcripts = [], {}
+        self.storage.apply(inserted, updated, deleted, self.next_id, transcripts)
+    
+    def _allocate_id(self) -> int:
+        if not self._batch_depth:
+            return self.storage.allocate_ids(1, self.next_id)
+        material_id = next(self._reserved_ids, None)
+        if material_id is None:
+            material_id = self.storage.allocate_ids(self.ID_BLOCK, self.next_id)
+            self._reserved_ids = iter(range(material_id + 1, material_id + self.ID_BLOCK))
+        return material_id
+    
+    def _write_insert(self, material: Dict):
+        if self._batch_depth:
+            self._pending_inserts[material['id']] = material
+        else:
+            self.storage.insert([material], self.next_id)
+    
+    def _write_update(self, material: Dict, transcript: Optional[str] = None):
+        """Write a changed material; transcript (if given) goes to the search index"""
+        material_id = material['id']
+        transcripts = {} if transcript is None else {material_id: transcript}
+        if not self._batch_depth:
+            self.storage.update([material], transcripts)
+            return
+        if material_id not in self._pending_inserts:  # a pending insert writes the latest state anyway
+            self._pending_updates[material_id] = material
+        self._pending_transcripts.update(transcripts)
+    
+    def _write_delete(self, material_id: int):
+        if not self._batch_depth:
+            self.storage.delete([material_id])
+            return
+        self._pending_transcripts.pop(material_id, None)
+        if self._pending_inserts.pop(material_id, None) is None:
+            self._pending_updates.pop(material_id, None)
+            self._pending_deletes.append(material_id)
     
     def add_url(self, url: str, title: str = "", description: str = "") -> Dict:
-        """Add a TED talk URL to the library"""
+        """Add a TED talk URL to the library.
+        
+        Raises ValueError if the URL (after normalize_url) is already in it.
+        """
+        existing = self.find_by_url(url)
+        if existing is not None:
+            raise ValueError(f"URL already in library as [{existing['id']}]: {url}")
+        material_id = self._allocate_id()
+        self.next_id = material_id + 1
         material = {
-            "id": self.next_id,
+            "id": material_id,
             "url": url,
-            "title": title or f"TED Talk {self.next_id}",
+            "title": title or f"TED Talk {material_id}",
             "description": description,
             "date_added": datetime.now().isoformat(),
             "processed": False,
@@ -51,17 +236,38 @@ class MaterialLibrary:
             "learning_package_file": None
         }
         
-        self.materials.append(material)
-        self.next_id += 1
-        self._save_library()
+        self._by_id[material_id] = material
+        self._index(material)
+        self._write_insert(material)
+        if self._search_index is not None:
+            self._search_index.add(material_id, self._search_fields(material))
         return material
     
+    def add_urls(self, items: Iterable[Union[str, Tuple[str, str, str]]],
+                 skip_duplicates: bool = True) -> List[Dict]:
+        """Add many URLs (or (url, title, description) tuples) with one storage write.
+        
+        URLs already in the library, or repeated in items, are skipped unless
+        skip_duplicates is False, in which case they raise ValueError like
+        add_url (the URLs before the duplicate are still added).
+        Returns the materials that were added.
+        """
+        added = []
+        with self.batch():
+            for item in items:
+                url, title, description = (item, "", "") if isinstance(item, str) else item
+                if skip_duplicates and self.find_by_url(url) is not None:
+                    continue
+                added.append(self.add_url(url, title, description))
+        return added
+    
     def get_material(self, material_id: int) -> Optional[Dict]:
         """Get a specific material by ID"""
-        for material in self.materials:
-            if material['id'] == material_id:
-                return material
-        return None
+        return self._by_id.get(material_id)
+    
+    def find_by_url(self, url: str) -> Optional[Dict]:
+        """Get the material for a URL (compared after normalize_url)"""
+        return self._by_url.get(normalize_url(url))
     
     def get_all_materials(self) -> List[Dict]:
         """Get all materials in the library"""
@@ -69,7 +275,7 @@ class MaterialLibrary:
     
     def get_unprocessed_materials(self) -> List[Dict]:
         """Get materials that haven't been processed yet"""
-        return [m for m in self.materials if not m['processed']]
+        return list(self._unprocessed.values())
     
     def mark_processed(self, material_id: int, transcript_file: str, package_file: str):
         """Mark a material as processed"""
@@ -78,32 +284,142 @@ class MaterialLibrary:
             material['processed'] = True
             material['transcript_file'] = transcript_file
             material['learning_package_file'] = package_file
-            self._save_library()
+            self._unprocessed.pop(material_id, None)
+            # The transcript is only read for a search index that will keep it:
+            # the storage's own (SQLite FTS) or the in-memory one, once built
+            indexed = getattr(self.storage, "has_search", False)
+            transcript = None
+            if indexed or self._search_index is not None:
+                transcript = read_transcript_text(transcript_file) if transcript_file else ""
+            self._write_update(material, transcript if indexed else None)
+            if self._search_index is not None:
+                self._search_index.add(material_id, self._search_fields(material, transcript))
+    
+    def update_material(self, material_id: int, **fields) -> Optional[Dict]:
+        """Change fields of a material, e.g. transcript_file after a download.
+        
+        Fields other than the standard ones are stored with the material too
+        (both backends keep them). The id cannot be changed.
+        """
+        updated = self.update_materials({material_id: fields})
+        return updated[0] if updated else None
+    
+    def update_materials(self, changes: Dict[int, Dict]) -> List[Dict]:
+        """Change fields of several materials (id -> {field: value}) in one storage write.
+        
+        Only the named fields are written, so changes another process made
+        to the same materials meanwhile (say, a worker marking one processed)
+        are kept. Inside batch() the changes are queued like any other.
+        Unknown ids are skipped; returns the updated materials.
+        """
+        if any('id' in fields for fields in changes.values()):
+            raise ValueError("A material's id cannot be changed")
+        updated = []
+        for material_id, fields in changes.items():
+            material = self.get_material(material_id)
+            if material is None:
+                continue
+            self._unindex(material)
+            material.update(fields)
+            self._index(material)
+            updated.append(material)
+            if self._batch_depth:
+                self._write_update(material)
+            if self._search_index is not None and ('title' in fields or 'description' in fields):
+                transcript = read_transcript_text(material['transcript_file']) \
+                    if material['processed'] and material['transcript_file'] else ""
+                self._search_index.add(material_id, self._search_fields(material, transcript))
+        if updated and not self._batch_depth:
+            self.storage.update_fields({m['id']: changes[m['id']] for m in updated})
+        return updated
     
     def remove_material(self, material_id: int) -> bool:
         """Remove a material from the library"""
-        initial_length = len(self.materials)
-        self.materials = [m for m in self.materials if m['id'] != material_id]
-        if len(self.materials) < initial_length:
-            self._save_library()
-            return True
-        return False
-    
-    def search_materials(self, query: str) -> List[Dict]:
-        """Search materials by title or description"""
+        material = self._by_id.get(material_id)
+        if material is None:
+            return False
+        self._unindex(material)
+        del self._by_id[material_id]
+        self._write_delete(material_id)
+        if self._search_index is not None:
+            self._search_index.remove(material_id)
+        return True
+    
+    @staticmethod
+    def _search_fields(material: Dict, transcript: str = "") -> Dict[str, str]:
+        return {"title": material['title'], "description": material['description'], "transcript": transcript}
+    
+    def _memory_search_index(self) -> SearchIndex:
+        """In-memory BM25 index, built from the materials and their transcript files once"""
+        if self._search_index is None:
+            self._search_index = build_search_index(
+                (m['id'], self._search_fields(m, read_transcript_text(m['transcript_file'])
+                                              if m['processed'] and m['transcript_file'] else ""))
+                for m in self._by_id.values()
+            )
+        return self._search_index
+    
+    def rebuild_search_index(self):
+        """Re-read every processed material's transcript into the search index"""
+        if getattr(self.storage, "has_search", False):
+            processed = [m for m in self._by_id.values() if m['processed'] and m['transcript_file']]
+            self.storage.update(processed, {m['id']: read_transcript_text(m['transcript_file'])
+                                            for m in processed})
+        else:
+            self._search_index = None
+            self._memory_search_index()
+    
+    def search_materials(self, query: str, limit: Optional[int] = None) -> List[Dict]:
+        """Search titles, descriptions and processed transcripts, best match first.
+        
+        Whole words are ranked with BM25 (SQLite FTS5 when the storage has it,
+        otherwise an in-memory index). If no word matches, falls back to a
+        substring match on titles and descriptions, so partial words still work.
+        """
+        if not query.strip():
+            return []
+        if getattr(self.storage, "has_search", False):
+            hits = self.storage.search(query, limit)
+        else:
+            hits = self._memory_search_index().search(query, limit)
+        results = [self._by_id[i] for i, _ in hits if i in self._by_id]
+        if results:
+            return results
+        
         query = query.lower()
-        return [
-            m for m in self.materials
+        matches = [
+            m for m in self._by_id.values()
             if query in m['title'].lower() or query in m['description'].lower()
         ]
+        return matches[:limit] if limit else matches
+    
+    def recommend(self, profile, limit: Optional[int] = 10, known: Optional[int] = None,
+                  exclude: Iterable[int] = ()) -> List[Tuple[Dict, "Recommendation"]]:
+        """Processed materials best suited to a LearnerProfile, best first.
+        
+        known is a known-word bitset (see ted_recommend); it defaults to the
+        profile's known-word model. Lexical profiles of new or changed
+        transcripts are computed first and kept in <library>.profiles.db; the
+        recommender is rebuilt only when they change.
+        """
+        from ted_recommend import ProfileStore, TalkRecommender, profiles_path, update_profiles
+        store = ProfileStore(profiles_path(self.library_file))
+        try:
+            if update_profiles(self, store) or self._recommender is None:
+                self._recommender = TalkRecommender.from_store(store)
+        finally:
+            store.close()
+        return [(self._by_id[r.material_id], r)
+                for r in self._recommender.recommend(profile, known, limit, exclude)
+                if r.material_id in self._by_id]
     
     def list_materials(self) -> str:
         """Format materials as a readable list"""
-        if not self.materials:
+        if not self._by_id:
             return "No materials in library."
         
         lines = ["Material Library:", "=" * 60]
-        for material in self.materials:
+        for material in self._by_id.values():
             status = "✓ Processed" if material['processed'] else "○ Pending"
             lines.append(f"\n[{material['id']}] {status}")
             lines.append(f"Title: {material['title']}")
@@ -121,18 +437,18 @@ def main():
     """Example usage of MaterialLibrary"""
     library = MaterialLibrary()
     
-    # Add some example materials
-    library.add_url(
-        "https://www.ted.com/talks/...",
-        "The Future of Innovation",
-        "A talk about how innovation shapes our world"
-    )
-    
-    library.add_url(
-        "https://www.ted.com/talks/...",
-        "Sustainable Development Goals",
-        "Understanding the UN's SDGs"
-    )
+    # Add some example materials (add_url rejects URLs already in the library)
+    examples = [
+        ("https://www.ted.com/talks/the_future_of_innovation",
+         "The Future of Innovation",
+         "A talk about how innovation shapes our world"),
+        ("https://www.ted.com/talks/sustainable_development_goals",
+         "Sustainable Development Goals",
+         "Understanding the UN's SDGs"),
+    ]
+    for url, title, description in examples:
+        if library.find_by_url(url) is None:
+            library.add_url(url, title, description)
     
     # List all materials
     print(library.list_materials())
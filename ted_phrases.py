@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+N-gram phrase mining for TED English Learning SOP System
+Counts 2-5 word n-grams over one talk or a whole library of talks and ranks
+them by how much more cohesive they are than a background model predicts.
+
+Words are mapped to integer ids and every n-gram is packed into a single int
+(id0 * B**(n-1) + ... + id(n-1)), built incrementally from the (n-1)-gram
+keys, so counting is a Counter.update over int lists per clause. B starts at
+2**20; a vocabulary that outgrows it widens B and re-packs the counted keys,
+so ids never spill into a neighbouring field.
+"""
+
+import math
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from ted_frequency import STOPWORDS, FrequencyIndex, normalize_token
+
+
+# Bits per word id in a packed n-gram key (a vocabulary of up to ~1M words),
+# and how many more a miner takes when its vocabulary outgrows them
+_ID_BITS = 20
+_WIDEN_BITS = 4
+
+# Tokens ending in these characters close a clause; phrases never span them
+_CLAUSE_END = (",", ";", ":", "—", "–", ")", '"', "”")
+
+# Phrases should not open with these function words ("the key to ...")
+_WEAK_STARTERS = frozenset("""
+the a an and but or nor so of to is are was were be been am it's that which who
+i you we they he she it i'm you're we're they're
+can could will would shall should may might must
+""".split())
+
+
+@dataclass
+class MinedPhrase:
+    """An n-gram with its corpus count and association score"""
+    text: str
+    words: int
+    count: int
+    score: float
+
+
+class PhraseMiner:
+    """Accumulates n-gram counts over any number of documents.
+
+    ``max_entries`` bounds memory when mining a large library: when the
+    n-gram table grows past it, n-grams seen only once are dropped (they can
+    never reach a useful min_count from a single occurrence anyway).
+    """
+
+    def __init__(self, min_n: int = 2, max_n: int = 5, max_entries: int = 2_000_000):
+        self.min_n = min_n
+        self.max_n = max_n
+        self.max_entries = max_entries
+        self.word_ids: Dict[str, int] = {}
+        self.words: List[str] = [""]  # id 0 is never used, so keys have no leading zeros
+        self._token_ids: Dict[str, int] = {}
+        self.unigrams = Counter()
+        self.ngrams = Counter()
+        self.total_tokens = 0
+        self.documents = 0
+        self._base = 1 << _ID_BITS  # ids must stay below it, see _widen
+
+    def _token_id(self, token: str) -> int:
+        """Word id of a raw lowercase token; 0 if it is not a word, negative if it ends a clause"""
+        word = normalize_token(token)
+        # Unlike vocabulary, phrases need one-letter words ("make a difference")
+        if not word.replace("'", "").replace("-", "").isalpha():
+            return 0
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            word_id = self.word_ids[word] = len(self.words)
+            self.words.append(word)
+        return -word_id if token.endswith(_CLAUSE_END) else word_id
+
+    def _clauses(self, sentences: Iterable[List[str]]) -> Iterable[List[int]]:
+        """Split lowercase sentence tokens into clauses of word ids"""
+        # Talks repeat a small vocabulary, so each distinct token is normalized once
+        token_ids = self._token_ids
+        for sentence in sentences:
+            clause = []
+            for token in sentence:
+                word_id = token_ids.get(token)
+                if word_id is None:
+                    word_id = token_ids[token] = self._token_id(token)
+                if word_id > 0:
+                    clause.append(word_id)
+                    continue
+                if word_id < 0:
+                    clause.append(-word_id)
+                if clause:
+                    yield clause
+                clause = []
+            if clause:
+                yield clause
+
+    def _widen(self):
+        """Grow the key base until every word id fits, re-packing the counted keys"""
+        old = self._base
+        while len(self.words) > self._base:
+            self._base <<= _WIDEN_BITS
+        if self._base != old:
+            self.ngrams = Counter({self._pack(self._unpack(key, old)): c for key, c in self.ngrams.items()})
+
+    def _pack(self, ids: List[int]) -> int:
+        key = 0
+        for word_id in ids:
+            key = key * self._base + word_id
+        return key
+
+    def _unpack(self, key: int, base: Optional[int] = None) -> List[int]:
+        base = base or self._base
+        ids = []
+        while key:
+            key, word_id = divmod(key, base)
+            ids.append(word_id)
+        ids.reverse()
+        return ids
+
+    def add_document(self, sentences: Iterable[List[str]]):
+        """Count the n-grams of one document given its tokenized sentences"""
+        # Ids are assigned first, so the key base can be widened before any
+        # of this document's keys are packed
+        clauses = list(self._clauses(sentences))
+        if len(self.words) > self._base:
+            self._widen()
+        # Keys are collected per document and counted with one Counter.update,
+        # which is much cheaper than updating per clause
+        ids: List[int] = []
+        keys: List[int] = []
+        min_n, max_n, base = self.min_n, self.max_n, self._base
+        for clause in clauses:
+            ids += clause
+            grams = clause
+            for n in range(2, min(max_n, len(clause)) + 1):
+                # Extend every (n-1)-gram key by the id that follows it
+                grams = [key * base + word_id for key, word_id in zip(grams, clause[n - 1:])]
+                if n >= min_n:
+                    keys += grams
+        self.unigrams.update(ids)
+        self.ngrams.update(keys)
+        self.total_tokens += len(ids)
+        self.documents += 1
+        if len(self.ngrams) > self.max_entries:
+            self.prune(2)
+
+    def prune(self, min_count: int):
+        """Drop n-grams seen fewer than min_count times"""
+        self.ngrams = Counter({k: c for k, c in self.ngrams.items() if c >= min_count})
+
+    def decode(self, key: int) -> List[str]:
+        return [self.words[i] for i in self._unpack(key)]
+
+    def _subgram_keys(self, key: int) -> List[int]:
+        """Keys of every shorter n-gram (of two or more words) inside key"""
+        ids = self._unpack(key)
+        base = self._base
+        parts = []
+        for start in range(len(ids) - 1):
+            part = ids[start]
+            for end in range(start + 1, len(ids) - (start == 0)):
+                part = part * base + ids[end]
+                parts.append(part)
+        return parts
+
+    def _background_probability(self, word: str, background: Optional[FrequencyIndex]) -> float:
+        if background is None:
+            return 1.0 / max(1, len(self.words))
+        rank = background.lemma_rank(word)[1] or len(background) * 2
+        return 0.1 / rank  # Zipf's law
+
+    def top(self, count: int = 10, min_count: int = 2,
+            background: Optional[FrequencyIndex] = None, smoothing: float = 1000.0) -> List[MinedPhrase]:
+        """Best-scoring phrases.
+
+        Score is count * PMI / words, where word probabilities are the corpus
+        counts smoothed toward the background (general English) model:
+        p(w) = (c(w) + smoothing * p_bg(w)) / (N + smoothing).
+        Stopword-only phrases and phrases that end on a stopword or start
+        on a weak function word are skipped. So are phrases that only occur
+        inside one longer phrase, and phrases overlapping a better-scoring one.
+        """
+        total = max(1, self.total_tokens)
+        word_probability: Dict[int, float] = {}
+
+        def probability(word_id: int) -> float:
+            p = word_probability.get(word_id)
+            if p is None:
+                p_bg = self._background_probability(self.words[word_id], background)
+                p = (self.unigrams[word_id] + smoothing * p_bg) / (total + smoothing)
+                word_probability[word_id] = p
+            return p
+
+        scored = {}
+        for key, n_count in self.ngrams.items():
+            if n_count < min_count:
+                continue
+            words = self.decode(key)
+            if words[-1] in STOPWORDS or words[0] in _WEAK_STARTERS:
+                continue
+            if all(w in STOPWORDS for w in words):
+                continue
+            expected = 1.0
+            for word in words:
+                expected *= probability(self.word_ids[word])
+            pmi = math.log((n_count / total) / expected)
+            if pmi > 0:
+                # Per-word PMI, so long n-grams do not win on length alone
+                scored[key] = MinedPhrase(" ".join(words), len(words), n_count, n_count * pmi / len(words))
+
+        # A phrase that only ever appears inside the same longer phrase is not
+        # a phrase of its own ("make a" inside "make a difference")
+        for key, phrase in list(scored.items()):
+            if phrase.words > 2:
+                for part in self._subgram_keys(key):
+                    if part in scored and scored[part].count == phrase.count:
+                        del scored[part]
+
+        scored = list(scored.values())
+        scored.sort(key=lambda p: (-p.score, p.text))
+        selected: List[MinedPhrase] = []
+        for phrase in scored:
+            padded = f" {phrase.text} "
+            if any(padded in f" {s.text} " or f" {s.text} " in padded for s in selected):
+                continue
+            selected.append(phrase)
+            if len(selected) >= count:
+                break
+        return selected
+
+
+def mine_phrases(documents: Iterable[Iterable[List[str]]], count: int = 50, min_count: int = 2,
+                 background: Optional[FrequencyIndex] = None) -> List[MinedPhrase]:
+    """Mine phrases across many documents (e.g. the whole material library) at once"""
+    miner = PhraseMiner()
+    for sentences in documents:
+        miner.add_document(sentences)
+    return miner.top(count, min_count=min_count, background=background)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Stage profiling for TED English Learning SOP System
+TEDTranscriptProcessor reports each stage of package generation (clean,
+tokenize, align, difficulty, segment, extract.*, generate.*, render.*) to the
+hooks in its `hooks` list: hook.stage_started(name) when a stage begins and
+hook.stage_finished(name) when it ends. Stages nest (rendering the vocabulary
+section extracts the vocabulary, which tokenizes the text), so a hook sees a
+well-bracketed sequence of calls.
+
+StageProfiler is the built-in hook: it records wall time, CPU time and, with
+trace_memory=True, tracemalloc allocations (bytes and blocks) per stage, and formats them as a
+table or as JSON that can be merged across a batch run.
+
+    from ted_profiling import StageProfiler
+    profiler = StageProfiler(trace_memory=True)
+    processor.hooks.append(profiler)
+    processor.generate_markdown_output(transcript)
+    print(profiler.format_table())
+"""
+
+import json
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Tuple
+
+
+class StageHook:
+    """Callbacks around each processor stage; subclass and override what you need"""
+
+    def stage_started(self, stage: str):
+        pass
+
+    def stage_finished(self, stage: str):
+        pass
+
+
+@dataclass
+class StageStats:
+    """Totals for one stage over all of its calls"""
+    calls: int = 0
+    wall: float = 0.0  # seconds, including nested stages
+    self_wall: float = 0.0  # seconds, excluding nested stages
+    cpu: float = 0.0  # process CPU seconds, including nested stages
+    allocated: int = 0  # net bytes still allocated when the stage ended (tracemalloc)
+    blocks: int = 0  # net memory blocks still allocated when the stage ended (tracemalloc)
+    peak: int = 0  # largest rise in traced memory during one call (tracemalloc)
+
+    def add(self, other: "StageStats"):
+        self.calls += other.calls
+        self.wall += other.wall
+        self.self_wall += other.self_wall
+        self.cpu += other.cpu
+        self.allocated += other.allocated
+        self.blocks += other.blocks
+        self.peak = max(self.peak, other.peak)
+
+
+class _Frame:
+    __slots__ = ("name", "wall", "cpu", "memory", "blocks", "peak", "children")
+
+    def __init__(self, name: str, memory: int, blocks: int):
+        self.name = name
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.memory = memory  # traced bytes when the stage started
+        self.blocks = blocks  # traced blocks when the stage started
+        self.peak = memory  # highest traced bytes seen while it ran
+        self.children = 0.0  # wall seconds spent in nested stages
+
+
+class StageProfiler(StageHook):
+    """Per-stage wall time, CPU time and (optionally) memory of a processor.
+
+    With trace_memory=True, tracemalloc runs while an outermost stage is open
+    (unless it was already running), which slows generation down noticeably;
+    timings from such a run are best read relative to each other. Block
+    counts come from a snapshot at each stage boundary, which costs more still.
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.stats: Dict[str, StageStats] = {}
+        self._stack: List[_Frame] = []
+        self._owns_tracing = False
+
+    def _traced(self) -> Tuple[int, int]:
+        """Current traced bytes and blocks, folding the peak since the last call into the open frames"""
+        if not self.trace_memory or not tracemalloc.is_tracing():
+            return 0, 0
+        current, peak = tracemalloc.get_traced_memory()
+        for frame in self._stack:
+            frame.peak = max(frame.peak, peak)
+        blocks = len(tracemalloc.take_snapshot().traces)
+        tracemalloc.reset_peak()  # after the snapshot, so its own memory is not counted as a peak
+        return current, blocks
+
+    def stage_started(self, stage: str):
+        if self.trace_memory and not self._stack and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracing = True
+        self.stats.setdefault(stage, StageStats())  # rows in the order stages first start
+        self._stack.append(_Frame(stage, *self._traced()))
+
+    def stage_finished(self, stage: str):
+        memory, blocks = self._traced()
+        frame = self._stack.pop()
+        wall = time.perf_counter() - frame.wall
+        self.stats[frame.name].add(StageStats(1, wall, wall - frame.children, time.process_time() - frame.cpu,
+                                              memory - frame.memory, blocks - frame.blocks,
+                                              frame.peak - frame.memory))
+        if self._stack:
+            self._stack[-1].children += wall
+        elif self._owns_tracing:
+            tracemalloc.stop()
+            self._owns_tracing = False
+
+    def reset(self):
+        self.stats = {}
+
+    def merge(self, stats: Dict[str, Dict]):
+        """Add in stage totals from another profiler's to_dict() (e.g. from a batch worker)"""
+        for name, values in stats.items():
+            self.stats.setdefault(name, StageStats()).add(StageStats(**values))
+
+    def to_dict(self) -> Dict[str, Dict]:
+        return {name: asdict(stats) for name, stats in self.stats.items()}
+
+    def to_json(self, **extra) -> str:
+        """The stages as JSON, with any extra top-level fields (e.g. source=...)"""
+        return json.dumps({**extra, "stages": self.to_dict()}, ensure_ascii=False)
+
+    def format_table(self, title: Optional[str] = None) -> str:
+        """Stages in the order they first started; Self excludes nested stages, so it sums to the total"""
+        memory = self.trace_memory and any(s.allocated or s.peak for s in self.stats.values())
+        header = f"{'Stage':<26} {'Calls':>5} {'Wall ms':>9} {'Self ms':>9} {'CPU ms':>9}"
+        if memory:
+            header += f" {'Net KB':>9} {'Blocks':>9} {'Peak KB':>9}"
+        lines = [title] if title else []
+        lines += [header, "-" * len(header)]
+        for name, s in self.stats.items():
+            line = f"{name:<26} {s.calls:>5} {s.wall * 1000:>9.1f} {s.self_wall * 1000:>9.1f} {s.cpu * 1000:>9.1f}"
+            if memory:
+                line += f" {s.allocated / 1024:>9.1f} {s.blocks:>9} {s.peak / 1024:>9.1f}"
+            lines.append(line)
+        total = sum(s.self_wall for s in self.stats.values())
+        lines += ["-" * len(header), f"{'total':<26} {'':>5} {'':>9} {total * 1000:>9.1f}"]
+        return "\n".join(lines)
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Talk recommender for TED English Learning SOP System
+Ranks a material library's processed talks for a LearnerProfile by how much
+of each talk the learner should understand (vocabulary coverage) and how well
+its difficulty suits them (ted_difficulty's fit).
+
+Every processed talk has a precomputed lexical profile, kept in a SQLite file
+next to the library (<library>.profiles.db) and refreshed when its transcript
+file changes:
+
+    features   ted_difficulty.TalkFeatures (word counts, speech time and a
+               histogram of the talk's words over frequency-rank bands)
+    lemmas     sparse vector of the talk's listed lemmas: positions in the
+               frequency list (rank - 1) and token counts
+
+A learner's known words are a bitset over the same positions (bit rank - 1;
+see known_bitset and ted_known_words). Without one, the learner is taken to
+know the vocabulary_size most frequent lemmas and coverage comes straight
+from the histograms. A known-word set is compared with the nearest such prefix
+instead: known ^ prefix leaves the few lemmas where they differ, and an
+inverted index (lemma -> talks using it, with counts) corrects only the talks
+that use those lemmas. Ranking therefore costs O(talks + postings of the
+differing lemmas), not O(talks x vocabulary).
+
+    python3 ted_recommend.py material_library.db     # refresh the profiles
+    python3 ted_cli.py recommend --library material_library.db --level B1 --vocab 4000
+"""
+
+import heapq
+import json
+import sqlite3
+import sys
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from ted_difficulty import BAND_WIDTH, BANDS, DifficultyEngine, TalkFeatures, extract_features
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    material_id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    features TEXT NOT NULL,
+    lemmas BLOB NOT NULL,
+    counts BLOB NOT NULL
+);
+"""
+
+# Profiles computed before they are written in one transaction
+_WRITE_CHUNK = 256
+
+
+@dataclass
+class LexicalProfile:
+    """What the recommender knows about one talk"""
+    features: TalkFeatures
+    lemmas: array  # uint32 positions (rank - 1) of the talk's listed lemmas, ascending
+    counts: array  # uint32 token counts, aligned with lemmas
+
+
+def extract_profile(processor, text: str) -> LexicalProfile:
+    """Lexical profile of a cleaned transcript (see ted_difficulty.extract_features)"""
+    ranks: Counter = Counter()
+    features = extract_features(processor, text, ranks)
+    listed = sorted(rank for rank in ranks if rank is not None)
+    return LexicalProfile(features, array('I', (rank - 1 for rank in listed)),
+                          array('I', (ranks[rank] for rank in listed)))
+
+
+def known_bitset(words: Iterable[str]) -> int:
+    """Bitset (bit rank - 1) of the lemmas of words; words off the frequency list are left out.
+
+    A learner's ted_known_words.KnownWords model gives the same kind of
+    bitset as its .bitset.
+    """
+    from ted_known_words import KnownWords
+    return KnownWords.from_words(words).bitset
+
+
+def _positions(bits: int) -> List[int]:
+    """Indices of the set bits of a bitset, ascending"""
+    digits = bin(bits)[:1:-1]  # least significant bit first
+    positions = []
+    i = digits.find("1")
+    while i >= 0:
+        positions.append(i)
+        i = digits.find("1", i + 1)
+    return positions
+
+
+def profiles_path(library_file) -> Path:
+    """Where a library's lexical profiles are kept: material_library.db -> material_library.profiles.db"""
+    library_file = Path(library_file)
+    return library_file.with_name(f"{library_file.stem}.profiles.db")
+
+
+def source_stamp(path: Path) -> str:
+    """Identifies a transcript file's current contents without reading it"""
+    stat = path.stat()
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class ProfileStore:
+    """Lexical profiles of a library's processed materials in a SQLite file"""
+
+    def __init__(self, path, timeout: float = 30.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode; transactions are opened explicitly in _transaction
+        self.connection = sqlite3.connect(str(self.path), timeout=timeout, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, rolled back on error"""
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT count(*) FROM profiles").fetchone()[0]
+
+    def sources(self) -> Dict[int, str]:
+        """material id -> source stamp of the transcript its profile was computed from"""
+        return dict(self.connection.execute("SELECT material_id, source FROM profiles"))
+
+    def put_many(self, items: Iterable[Tuple[int, str, LexicalProfile]]):
+        """Store (material id, source stamp, profile) triples, replacing older profiles"""
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO profiles (material_id, source, features, lemmas, counts) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ((material_id, source, json.dumps(asdict(profile.features)),
+                  profile.lemmas.tobytes(), profile.counts.tobytes())
+                 for material_id, source, profile in items)
+            )
+
+    def remove(self, material_ids: Sequence[int]):
+        with self._transaction() as connection:
+            connection.executemany("DELETE FROM profiles WHERE material_id = ?",
+                                   ((material_id,) for material_id in material_ids))
+
+    def load(self) -> Dict[int, LexicalProfile]:
+        profiles = {}
+        for material_id, features, lemmas, counts in self.connection.execute(
+                "SELECT material_id, features, lemmas, counts FROM profiles ORDER BY material_id"):
+            lemma_array, count_array = array('I'), array('I')
+            lemma_array.frombytes(lemmas)
+            count_array.frombytes(counts)
+            profiles[material_id] = LexicalProfile(TalkFeatures(**json.loads(features)), lemma_array, count_array)
+        return profiles
+
+
+def update_profiles(library, store: ProfileStore,
+                    progress: Optional[Callable[[Dict], None]] = None) -> int:
+    """Profile the library's processed materials whose transcript is new or changed.
+
+    Profiles of materials that are gone or no longer processed are dropped.
+    Returns the number of profiles written or removed.
+    """
+    from ted_batch import detect_format
+    from ted_learning_sop import TEDTranscriptProcessor, LearnerProfile
+
+    processed = {m['id']: m for m in library.get_all_materials() if m['processed'] and m['transcript_file']}
+    stored = store.sources()
+    stale = [material_id for material_id in stored if material_id not in processed]
+    if stale:
+        store.remove(stale)
+
+    processors: Dict[str, TEDTranscriptProcessor] = {}
+    pending: List[Tuple[int, str, LexicalProfile]] = []
+    written = 0
+    for material_id, material in processed.items():
+        path = Path(material['transcript_file'])
+        if not path.is_file():
+            continue
+        source = source_stamp(path)
+        if stored.get(material_id) == source:
+            continue
+        transcript = path.read_text(encoding="utf-8")
+        subtitle_format = detect_format(transcript)
+        processor = processors.setdefault(subtitle_format, TEDTranscriptProcessor(LearnerProfile(
+            level="B2", vocabulary_size=8000, goals=[], output_language="english_only",
+            subtitle_format=subtitle_format, output_style="complete")))
+        pending.append((material_id, source, extract_profile(processor, processor.clean_transcript(transcript))))
+        if progress:
+            progress(material)
+        if len(pending) >= _WRITE_CHUNK:
+            store.put_many(pending)
+            written += len(pending)
+            pending = []
+    if pending:
+        store.put_many(pending)
+        written += len(pending)
+    return written + len(stale)
+
+
+@dataclass
+class Recommendation:
+    """One ranked talk for one learner"""
+    material_id: int
+    fit: float  # 0-100, see DifficultyEngine.fit
+    coverage: float  # share of the talk's words the learner knows
+
+
+class TalkRecommender:
+    """Ranks talks (material id -> LexicalProfile) for learners.
+
+    Build it once and keep it: each recommend() call only touches the
+    per-talk histograms and the postings of the learner's differing lemmas.
+    """
+
+    def __init__(self, profiles: Dict[int, LexicalProfile]):
+        self.ids = list(profiles)
+        self.profiles = [profiles[material_id] for material_id in self.ids]
+        self.engine = DifficultyEngine([profile.features for profile in self.profiles])
+        self.words = [max(sum(profile.features.histogram), 1) for profile in self.profiles]
+        self._postings: Optional[Dict[int, Tuple[array, array]]] = None
+
+    @classmethod
+    def from_store(cls, store: ProfileStore) -> "TalkRecommender":
+        return cls(store.load())
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _inverted(self) -> Dict[int, Tuple[array, array]]:
+        """lemma position -> (talk indices, counts), built on the first known-word query"""
+        if self._postings is None:
+            postings: Dict[int, Tuple[array, array]] = {}
+            for talk, profile in enumerate(self.profiles):
+                for lemma, n in zip(profile.lemmas, profile.counts):
+                    entry = postings.get(lemma)
+                    if entry is None:
+                        entry = postings[lemma] = (array('I'), array('I'))
+                    entry[0].append(talk)
+                    entry[1].append(n)
+            self._postings = postings
+        return self._postings
+
+    def coverage(self, vocabulary_size: int, known: Optional[int] = None) -> List[float]:
+        """Share of each talk's words the learner knows.
+
+        known is a known-word bitset (see known_bitset); without it the
+        vocabulary_size most frequent lemmas count as known, interpolated
+        within the last rank band.
+        """
+        if known is None:
+            return self.engine.coverage(vocabulary_size)
+        # Start from the band-aligned prefix closest to the learner's vocabulary
+        prefix_size = min(round(bin(known).count("1") / BAND_WIDTH), BANDS) * BAND_WIDTH
+        prefix = (1 << prefix_size) - 1
+        known_words = [c * w for c, w in zip(self.engine.coverage(prefix_size), self.words)]
+        different = known ^ prefix
+        postings = self._inverted()
+        for bits, sign in ((known & different, 1), (prefix & different, -1)):
+            for lemma in _positions(bits):
+                entry = postings.get(lemma)
+                if entry is not None:
+                    for talk, n in zip(*entry):
+                        known_words[talk] += sign * n
+        return [k / w for k, w in zip(known_words, self.words)]
+
+    def recommend(self, profile, known: Optional[int] = None, limit: Optional[int] = 10,
+                  exclude: Iterable[int] = ()) -> List[Recommendation]:
+        """Talks for a LearnerProfile, best fit first (ties: higher coverage first).
+
+        known defaults to the bitset of the profile's known-word model, if any.
+        """
+        if known is None and profile.known_words is not None:
+            known = profile.known_words.bitset
+        coverage = self.coverage(profile.vocabulary_size, known)
+        fits = self.engine.fit(profile, coverage)
+        exclude = set(exclude)
+        candidates = (i for i in range(len(fits)) if self.ids[i] not in exclude)
+        key = lambda i: (-fits[i], -coverage[i], self.ids[i])
+        order = heapq.nsmallest(limit, candidates, key=key) if limit is not None else sorted(candidates, key=key)
+        return [Recommendation(self.ids[i], fits[i], coverage[i]) for i in order]
+
+
+def main():
+    from ted_material_library import MaterialLibrary
+
+    if len(sys.argv) != 2:
+        print(__doc__.strip())
+        return 1
+    library = MaterialLibrary(sys.argv[1])
+    store = ProfileStore(profiles_path(sys.argv[1]))
+    try:
+        changed = update_profiles(library, store, lambda m: print(f"profiled\t[{m['id']}] {m['title']}"))
+        print(f"{changed} profiles updated, {len(store)} in {store.path}")
+    finally:
+        store.close()
+        library.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Full-text search for the TED Material Library
+An in-memory BM25 inverted index over material titles, descriptions and
+transcripts, used when the library's storage backend has no search of its own
+(SQLiteStorage uses FTS5 instead).
+
+Postings are kept as parallel arrays (document slot, weighted term frequency)
+per term. Re-indexing or removing a document retires its slot instead of
+editing every posting list; retired slots are skipped at query time (for
+scoring and document frequencies alike) and dropped when the index compacts
+itself.
+"""
+
+import heapq
+import math
+import re
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ted_frequency import STOPWORDS, load_frequency_index
+from ted_subtitles import iter_cues, looks_like_subtitles
+
+
+# Term frequency multiplier per field, so title matches outrank transcript ones
+FIELD_WEIGHTS = {"title": 3, "description": 2, "transcript": 1}
+
+_TERM = re.compile(r"[a-z0-9]+(?:'[a-z]+)*")
+_term_cache: Dict[str, str] = {}
+
+
+def search_terms(text: str) -> List[str]:
+    """Lowercase, lemmatized, stopword-free terms of text"""
+    terms = []
+    cache = _term_cache
+    frequency = None
+    for word in _TERM.findall(text.lower()):
+        term = cache.get(word)
+        if term is None:
+            if word in STOPWORDS:
+                term = ""
+            else:
+                if frequency is None:
+                    frequency = load_frequency_index()
+                term = frequency.lemma_rank(word[:-2] if word.endswith("'s") else word)[0]
+            cache[word] = term
+        if term:
+            terms.append(term)
+    return terms
+
+
+def read_transcript_text(path) -> str:
+    """Spoken text of a transcript file (cue text only for SRT/VTT); '' if unreadable"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+    except (OSError, TypeError, UnicodeDecodeError):
+        return ""
+    if looks_like_subtitles(text):
+        return " ".join(cue.text for cue in iter_cues(text.splitlines()))
+    return text
+
+
+class SearchIndex:
+    """BM25 index of documents made of named text fields (see FIELD_WEIGHTS)"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._slot_doc = array('q')      # slot -> document id, -1 once retired
+        self._slot_length = array('L')   # slot -> weighted document length
+        self._doc_slot: Dict[int, int] = {}
+        self._live_length = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_slot)
+
+    def __contains__(self, doc_id: int) -> bool:
+        return doc_id in self._doc_slot
+
+    def add(self, doc_id: int, fields: Dict[str, str]):
+        """Index (or re-index) a document"""
+        self.remove(doc_id)
+        counts: Dict[str, int] = {}
+        for field, text in fields.items():
+            weight = FIELD_WEIGHTS.get(field, 1)
+            for term in search_terms(text or ""):
+                counts[term] = counts.get(term, 0) + weight
+
+        slot = len(self._slot_doc)
+        length = sum(counts.values())
+        self._slot_doc.append(doc_id)
+        self._slot_length.append(length)
+        self._doc_slot[doc_id] = slot
+        self._live_length += length
+        postings = self._postings
+        for term, count in counts.items():
+            entry = postings.get(term)
+            if entry is None:
+                entry = postings[term] = (array('L'), array('L'))
+            entry[0].append(slot)
+            entry[1].append(count)
+
+    def remove(self, doc_id: int):
+        slot = self._doc_slot.pop(doc_id, None)
+        if slot is None:
+            return
+        self._slot_doc[slot] = -1
+        self._live_length -= self._slot_length[slot]
+        if len(self._slot_doc) > 1024 and len(self._doc_slot) * 2 < len(self._slot_doc):
+            self._compact()
+
+    def _compact(self):
+        """Rebuild postings without retired slots, renumbering the live ones"""
+        renumber = {}
+        slot_doc, slot_length = array('q'), array('L')
+        for slot, doc_id in enumerate(self._slot_doc):
+            if doc_id >= 0:
+                renumber[slot] = len(slot_doc)
+                slot_doc.append(doc_id)
+                slot_length.append(self._slot_length[slot])
+        postings = {}
+        for term, (slots, counts) in self._postings.items():
+            live = [(renumber[s], c) for s, c in zip(slots, counts) if s in renumber]
+            if live:
+                postings[term] = (array('L', (s for s, _ in live)), array('L', (c for _, c in live)))
+        self._postings = postings
+        self._slot_doc, self._slot_length = slot_doc, slot_length
+        self._doc_slot = {doc_id: slot for slot, doc_id in enumerate(slot_doc)}
+
+    def search(self, query: str, limit: Optional[int] = 20) -> List[Tuple[int, float]]:
+        """(document id, BM25 score) pairs, best first"""
+        documents = len(self._doc_slot)
+        if not documents:
+            return []
+        k1, b = self.k1, self.b
+        average = self._live_length / documents or 1.0
+        slot_doc, slot_length = self._slot_doc, self._slot_length
+        scores: Dict[int, float] = {}
+        for term in set(search_terms(query)):
+            entry = self._postings.get(term)
+            if entry is None:
+                continue
+            # Retired slots stay in the postings until _compact; they must not
+            # count towards the document frequency any more than be scored
+            live = [(slot, tf) for slot, tf in zip(*entry) if slot_doc[slot] >= 0]
+            df = len(live)
+            idf = math.log(1 + (documents - df + 0.5) / (df + 0.5))
+            for slot, tf in live:
+                norm = k1 * (1 - b + b * slot_length[slot] / average)
+                scores[slot] = scores.get(slot, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+        best = heapq.nlargest(limit, ((score, slot) for slot, score in scores.items())) if limit \
+            else sorted(((score, slot) for slot, score in scores.items()), reverse=True)
+        return [(slot_doc[slot], score) for score, slot in best]
+
+
+def build_index(documents: Iterable[Tuple[int, Dict[str, str]]]) -> SearchIndex:
+    index = SearchIndex()
+    for doc_id, fields in documents:
+        index.add(doc_id, fields)
+    return index
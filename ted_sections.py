@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Learning package sections for TED English Learning SOP System
+The section table lives apart from ted_learning_sop so the CLI can offer
+--sections choices without importing the processor.
+"""
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:  # annotations only; typing alone costs ~10 ms at startup
+    from typing import List, Optional
+    from ted_learning_sop import LearnerProfile
+
+
+# Package sections in output order: name -> (renderer, goals that select it
+# for output_style="simplified"; an empty set means it is always included)
+SECTIONS = {
+    "parameters": ("_render_parameters", set()),
+    "overview": ("_render_overview", set()),
+    "vocabulary": ("_render_vocabulary", set()),
+    "phrases": ("_render_phrases", {"vocabulary", "speaking", "writing", "presentation"}),
+    "grammar": ("_render_grammar", {"grammar", "writing"}),
+    "listening": ("_render_listening", {"listening"}),
+    "speaking_writing": ("_render_speaking_writing", {"speaking", "writing"}),
+    "scenarios": ("_render_scenarios", {"speaking", "presentation"}),
+    "shadowing": ("_render_shadowing", {"listening", "speaking", "presentation"}),
+    "review": ("_render_review", {"vocabulary"}),
+}
+
+
+def select_sections(profile: "LearnerProfile", sections: "Optional[List[str]]" = None) -> "List[str]":
+    """Names of the sections to render, in package order.
+    
+    An explicit list (argument, else profile.sections) wins; otherwise
+    "complete" renders everything and "simplified" keeps the core sections
+    plus those serving the profile's goals. The parameter echo is always kept.
+    """
+    requested = sections if sections is not None else profile.sections
+    if requested is not None:
+        unknown = set(requested) - set(SECTIONS)
+        if unknown:
+            raise ValueError(f"Unknown sections: {', '.join(sorted(unknown))}")
+        return [name for name in SECTIONS if name in requested or name == "parameters"]
+    if profile.output_style != "simplified":
+        return list(SECTIONS)
+    goals = set(profile.goals)
+    return [name for name, (_, section_goals) in SECTIONS.items()
+            if not section_goals or section_goals & goals]
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Streaming subtitle parser for TED English Learning SOP System
+Reads SRT or WebVTT cues incrementally from any iterable of lines (such as an
+open file object), so multi-hour subtitle files are parsed in constant memory.
+"""
+
+import re
+from typing import Iterable, Iterator, NamedTuple
+
+
+class Cue(NamedTuple):
+    """A single timed subtitle cue"""
+    index: int
+    start_ms: int
+    end_ms: int
+    text: str
+
+
+# 00:01:02,500 --> 00:01:04,000 (SRT) or 01:02.500 --> 01:04.000 line:90% (VTT)
+_TIMING = re.compile(
+    r'^\s*(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{3})\s*-->\s*'
+    r'(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{3})'
+)
+# VTT inline markup: <c.yellow>, <i>, </b>, <00:00:01.000>
+_MARKUP = re.compile(r'<[^>]*>')
+
+
+def _to_ms(hours, minutes, seconds, millis) -> int:
+    return ((int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(millis)
+
+
+def looks_like_subtitles(text: str) -> bool:
+    """Cheap check for SRT/VTT content: a cue timing arrow near the top"""
+    return "-->" in text and any(_TIMING.match(line) for line in text[:4000].splitlines())
+
+
+def iter_cues(lines: Iterable[str]) -> Iterator[Cue]:
+    """Yield cues from SRT or WebVTT lines.
+
+    Only the cue being assembled is held in memory. Cue numbers are taken
+    from the SRT index line when present and counted otherwise (VTT cues may
+    have no identifier or a textual one). Header, NOTE, STYLE and REGION
+    blocks are skipped.
+    """
+    counter = 0
+    identifier = None
+    timing = None
+    text_lines = []
+    skipping_block = False
+
+    def build():
+        index = int(identifier) if identifier and identifier.isdigit() else counter
+        text = _MARKUP.sub('', " ".join(text_lines)).strip()
+        return Cue(index, timing[0], timing[1], text)
+
+    for raw in lines:
+        line = raw.strip().lstrip('﻿')
+
+        if skipping_block:
+            if not line:
+                skipping_block = False
+            continue
+
+        match = _TIMING.match(line)
+        if match:
+            if timing is not None:
+                # Missing blank line: a trailing bare number is the next cue's index
+                next_identifier = None
+                if text_lines and text_lines[-1].isdigit():
+                    next_identifier = text_lines.pop()
+                yield build()
+                identifier = next_identifier
+            counter += 1
+            g = match.groups()
+            timing = (_to_ms(*g[0:4]), _to_ms(*g[4:8]))
+            text_lines = []
+            continue
+
+        if timing is not None:
+            if line:
+                text_lines.append(line)
+            else:
+                yield build()
+                timing = None
+                identifier = None
+            continue
+
+        if not line:
+            identifier = None
+        elif line.startswith(("WEBVTT", "NOTE", "STYLE", "REGION")):
+            skipping_block = True
+        else:
+            identifier = line
+
+    if timing is not None:
+        yield build()
+
+
+def format_timestamp(ms: int) -> str:
+    """Format milliseconds as HH:MM:SS"""
+    seconds = ms // 1000
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
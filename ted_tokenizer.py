@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Single-pass tokenizer for TED English Learning SOP System
+Splits cleaned transcript text into sentences and lowercase word tokens once,
+so segmentation, difficulty scoring and duration estimates can share the result.
+"""
+
+import re
+from array import array
+from itertools import accumulate, chain
+from typing import Iterator, List, Tuple
+
+
+# A sentence is a maximal run without terminators, trimmed of surrounding
+# whitespace by construction (it must start and end on a non-space character).
+# Only used to recover sentence offsets; tokenizing itself uses str methods.
+_SENTENCE = re.compile(r'[^.!?\s](?:[^.!?]*[^.!?\s])?')
+_WORD = re.compile(r'\S+')
+_CLAUSE_JOINERS = (" and ", " but ", " or ")
+
+
+def split_clauses(sentence: str) -> List[str]:
+    """Split a sentence at commas and at ' and ' / ' but ' / ' or '.
+
+    Uses str.replace/str.split rather than a regex alternation, which is
+    several times faster on long sentences. Whitespace inside the sentence
+    is normalized to single spaces first if it contains line breaks or tabs.
+    """
+    if "\n" in sentence or "\t" in sentence or "\r" in sentence:
+        sentence = " ".join(sentence.split())
+    for joiner in _CLAUSE_JOINERS:
+        if joiner in sentence:
+            sentence = sentence.replace(joiner, ",")
+    return [part for part in map(str.strip, sentence.split(",")) if part]
+
+
+class TokenizedText:
+    """Sentences and tokens of one text.
+
+    ``sentences`` holds the original-case sentences; ``tokens`` holds the
+    lowercase whitespace-separated words of every sentence, concatenated in
+    order, and ``sentence_token_counts[i]`` says how many of them belong to
+    sentence i. Character offsets into ``text`` (of sentences and of tokens)
+    are only computed if asked for.
+    """
+
+    __slots__ = ("text", "sentences", "tokens", "sentence_token_counts",
+                 "_sentence_starts", "_token_starts")
+
+    def __init__(self, text: str):
+        self.text = text
+        self._sentence_starts = None
+        self._token_starts = None
+
+        # Every step below is a C-level map over all sentences; there is no
+        # per-token Python loop on the hot path
+        # Terminators are unified with str.replace so one str.split finds every
+        # sentence; this yields exactly the runs _SENTENCE would match
+        runs = text.replace("!", ".").replace("?", ".").split(".")
+        self.sentences: List[str] = list(filter(None, map(str.strip, runs)))
+        sentence_tokens = list(map(str.split, map(str.lower, self.sentences)))
+        self.tokens: List[str] = list(chain.from_iterable(sentence_tokens))
+        self.sentence_token_counts = array('L', map(len, sentence_tokens))
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    @property
+    def sentence_count(self) -> int:
+        return len(self.sentences)
+
+    @property
+    def sentence_starts(self) -> array:
+        """Character offset of every sentence in ``text`` (computed on first use)"""
+        if self._sentence_starts is None:
+            self._sentence_starts = array('L', map(re.Match.start, _SENTENCE.finditer(self.text)))
+        return self._sentence_starts
+
+    def sentence(self, i: int) -> str:
+        """Original-case text of sentence i"""
+        return self.sentences[i]
+
+    def iter_sentences(self) -> Iterator[Tuple[str, int]]:
+        """Yield (sentence, token_count) for every sentence"""
+        return zip(self.sentences, self.sentence_token_counts)
+
+    def iter_sentence_tokens(self) -> Iterator[List[str]]:
+        """Yield the lowercase tokens of each sentence"""
+        tokens = self.tokens
+        for end, count in zip(accumulate(self.sentence_token_counts), self.sentence_token_counts):
+            yield tokens[end - count:end]
+
+    @property
+    def token_starts(self) -> array:
+        """Character offset of every token in ``text`` (computed on first use)"""
+        if self._token_starts is None:
+            starts = array('L')
+            for start, sentence in zip(self.sentence_starts, self.sentences):
+                starts.extend(m.start() for m in _WORD.finditer(self.text, start, start + len(sentence)))
+            self._token_starts = starts
+        return self._token_starts
+
+    def total_token_chars(self) -> int:
+        """Number of characters in all tokens"""
+        text = self.text
+        if text.isascii():
+            # Tokens are exactly the characters that are neither whitespace
+            # nor sentence terminators, so count those instead of joining
+            excluded = sum(text.count(c) for c in " \t\n\r\x0b\x0c.!?")
+            return len(text) - excluded
+        return len("".join(self.tokens))
+
+
+def tokenize(text: str) -> TokenizedText:
+    """Tokenize text into a reusable TokenizedText"""
+    return TokenizedText(text)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Library worker for TED English Learning SOP System
+Drains the pending materials of a SQLite material library: each worker claims
+a material under a time-limited lease, renews the lease from a heartbeat
+thread while it generates the learning package, then marks the material
+processed. Several workers (processes, or separate `ted_cli.py work` runs on
+the same database) can drain one library; if a worker dies, its lease expires
+and another worker retries the material, up to max_attempts times.
+Only SQLite libraries are supported: a finished material's status columns are
+updated in place, in the same transaction that drops its lease, so workers
+never overwrite each other's (or anyone else's) changes.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ted_batch import TRANSCRIPT_SUFFIXES, BatchResult, output_path_for, render_file, format_result
+from ted_learning_sop import LearnerProfile, TEDTranscriptProcessor
+from ted_library_storage import SQLiteStorage, open_storage
+from ted_material_library import url_slug
+from ted_search import read_transcript_text
+
+
+@dataclass
+class WorkOptions:
+    """Settings shared by every worker of one `work` run"""
+    library_file: str
+    transcripts_dir: str
+    output_dir: str
+    profile: LearnerProfile
+    lease_seconds: float = 300.0
+    max_attempts: int = 3
+    retry_delay: float = 60.0  # before a failed material may be claimed again
+    limit: Optional[int] = None  # materials per worker; None drains the library
+
+
+# Error of a job whose lease expired and was claimed by another worker
+LEASE_LOST = "lease lost to another worker"
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def find_transcript(material: Dict, transcripts_dir: str) -> Optional[Path]:
+    """The material's transcript file: transcript_file if set, else <slug> or <id> in transcripts_dir"""
+    if material.get('transcript_file'):
+        path = Path(material['transcript_file'])
+        return path if path.is_file() else None
+    for stem in filter(None, (url_slug(material['url']), str(material['id']))):
+        for suffix in TRANSCRIPT_SUFFIXES:
+            path = Path(transcripts_dir) / f"{stem}{suffix}"
+            if path.is_file():
+                return path
+    return None
+
+
+@contextmanager
+def heartbeat(db_path: Path, worker: str, material_id: int, lease_seconds: float):
+    """Renew a lease every lease_seconds / 3 until the block exits.
+
+    Yields an Event that is set once the lease turns out to be lost (it
+    expired and another worker claimed the material); the heartbeat stops
+    then, and the job's result must be dropped.
+    """
+    stop = threading.Event()
+    lost = threading.Event()
+
+    def beat():
+        connection = sqlite3.connect(str(db_path), timeout=lease_seconds)
+        try:
+            while not stop.wait(lease_seconds / 3):
+                if not SQLiteStorage.renew_leases(connection, worker, [material_id], lease_seconds):
+                    lost.set()
+                    break
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f"heartbeat-{material_id}", daemon=True)
+    thread.start()
+    try:
+        yield lost
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _write_atomically(path: Path, text: str):
+    temp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(temp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp, path)
+
+
+def run_worker(options: WorkOptions, progress: bool = True) -> List[BatchResult]:
+    """Claim, process and mark materials until none are left (or options.limit is reached)"""
+    # Workers read and write the database directly: an in-memory MaterialLibrary
+    # would write back whole rows loaded before other workers changed them
+    storage = open_storage(Path(options.library_file))
+    if not isinstance(storage, SQLiteStorage):
+        storage.close()
+        raise ValueError("work needs a SQLite library (.db); migrate with "
+                         "'python3 ted_library_storage.py migrate <library.json> <library.db>'")
+    Path(options.output_dir).mkdir(parents=True, exist_ok=True)
+    worker = worker_name()
+    processors: Dict[str, TEDTranscriptProcessor] = {}
+    results = []
+    try:
+        while options.limit is None or len(results) < options.limit:
+            claimed = storage.claim(worker, options.lease_seconds, max_attempts=options.max_attempts)
+            if not claimed:
+                break
+            material = claimed[0]
+            source = find_transcript(material, options.transcripts_dir)
+            if source is None:
+                result = BatchResult(material['url'], "", 0, 0.0, error="no transcript found")
+            else:
+                output_path = output_path_for(source, options.output_dir)
+                with heartbeat(storage.path, worker, material['id'], options.lease_seconds) as lost:
+                    markdown, words, seconds, error = render_file(source, options.profile, processors)
+                    if lost.is_set():
+                        markdown, error = None, LEASE_LOST
+                    if markdown is not None:
+                        try:
+                            _write_atomically(output_path, markdown)
+                        except OSError as e:
+                            error = str(e)
+                result = BatchResult(str(source), str(output_path), words, seconds, error)
+
+            if result.error is None:
+                if not storage.complete(worker, material['id'], result.source, result.output,
+                                        read_transcript_text(result.source)):
+                    result.error = LEASE_LOST
+            elif result.error != LEASE_LOST:  # a lost lease is another worker's now
+                storage.release(worker, material['id'], result.error, options.retry_delay)
+            results.append(result)
+            if progress:
+                print(format_result(result), flush=True)
+    finally:
+        storage.close()
+    return results
+
+
+def run_workers(options: WorkOptions, workers: int = 1) -> List[BatchResult]:
+    """Run workers in separate processes (in this process if workers == 1)"""
+    if workers <= 1:
+        return run_worker(options)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_worker, options) for _ in range(workers)]
+        return [result for future in futures for result in future.result()]
+
+
+def lease_report(library_file: str, max_attempts: int = 3) -> str:
+    storage = SQLiteStorage(library_file)
+    try:
+        counts = storage.lease_counts(max_attempts)
+    finally:
+        storage.close()
+    return (f"Library: {counts['pending']} pending, {counts['leased']} leased, "
+            f"{counts['retrying']} waiting to retry, {counts['failed']} out of attempts")